@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from database.migrations import MIGRATIONS, apply_migrations
+from database.models import Base
+from database.db_services import get_file_chunks, get_users_files, get_files_progress
+
+BENCH_USER_ID = 1
+
+# Размеры данных: небольшой прогон по умолчанию и полный (--full) — около миллиона чанков
+SMALL_RUN = {"files": 50, "chunks_per_file": 20, "users": 10}
+FULL_RUN = {"files": 2000, "chunks_per_file": 500, "users": 200}
+
+
+async def seed(engine, files: int, chunks_per_file: int, users: int):
+    """
+    Заполняет пустую базу тестовыми данными: files файлов по chunks_per_file чанков,
+    файлы распределены между users пользователями, примерно половина чанков обработана.
+    """
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text(
+            "INSERT INTO users (user_id) SELECT g FROM generate_series(1, :users) g"
+        ), {"users": users})
+        await conn.execute(text(
+            "INSERT INTO user_files (file_id, user_id, title, yandex_path) "
+            "SELECT 'file_' || g, 1 + g % :users, 'file_' || g || '.pdf', '/bench' "
+            "FROM generate_series(0, :files - 1) g"
+        ), {"users": users, "files": files})
+        await conn.execute(text(
+            "INSERT INTO file_chunks (file_id, chunk_index, content, ai_response, processed) "
+            "SELECT 'file_' || f, c, repeat('текст чанка ', 40), "
+            "CASE WHEN c % 2 = 0 THEN repeat('ответ ', 40) END, c % 2 = 0 "
+            "FROM generate_series(0, :files - 1) f, generate_series(0, :chunks - 1) c"
+        ), {"files": files, "chunks": chunks_per_file})
+        await conn.execute(text("ANALYZE"))
+
+
+async def drop_migration_indexes(engine):
+    """
+    Удаляет индексы из миграций, чтобы измерить запросы на схеме до миграций.
+    """
+    async with engine.begin() as conn:
+        for _, _, statements in MIGRATIONS:
+            for statement in statements:
+                if statement.startswith("CREATE INDEX IF NOT EXISTS "):
+                    index_name = statement.split()[5]
+                    await conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+        await conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+        await conn.execute(text("ANALYZE"))
+
+
+async def measure(session_maker, repeats: int) -> dict:
+    queries = {
+        "get_file_chunks": lambda session: get_file_chunks("file_0", session=session),
+        "get_users_files": lambda session: get_users_files(user_id=BENCH_USER_ID, session=session),
+        "get_files_progress": lambda session: get_files_progress(user_id=BENCH_USER_ID, session=session),
+    }
+    timings = {}
+    for name, query in queries.items():
+        samples = []
+        for _ in range(repeats):
+            async with session_maker() as session:
+                started = time.perf_counter()
+                await query(session)
+                samples.append((time.perf_counter() - started) * 1000)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Замер запросов к чанкам до и после миграций индексов (БД будет очищена!)"
+    )
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"),
+                        help="Отдельная тестовая БД PostgreSQL (по умолчанию BENCH_DATABASE_URL)")
+    parser.add_argument("--full", action="store_true",
+                        help=f"Полный прогон: {FULL_RUN['files']} файлов по {FULL_RUN['chunks_per_file']} чанков")
+    parser.add_argument("--files", type=int)
+    parser.add_argument("--chunks-per-file", type=int)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("укажите --database-url или BENCH_DATABASE_URL")
+    if args.database_url == os.getenv("DATABASE_URL"):
+        parser.error("замер очищает базу — укажите отдельную тестовую БД, а не DATABASE_URL бота")
+    sizes = FULL_RUN if args.full else SMALL_RUN
+    for name, value in sizes.items():
+        if getattr(args, name) is None:
+            setattr(args, name, value)
+
+    engine = create_async_engine(args.database_url)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+
+    total_chunks = args.files * args.chunks_per_file
+    print(f"Заполнение: {args.files} файлов, {total_chunks} чанков...")
+    await seed(engine, args.files, args.chunks_per_file, args.users)
+
+    await drop_migration_indexes(engine)
+    before = await measure(session_maker, args.repeats)
+
+    async with engine.begin() as conn:
+        await apply_migrations(conn)
+        await conn.execute(text("ANALYZE"))
+    after = await measure(session_maker, args.repeats)
+
+    print(f"{'запрос':<22}{'без индексов, мс':>20}{'после миграций, мс':>22}")
+    for name in before:
+        print(f"{name:<22}{before[name]:>20.1f}{after[name]:>22.1f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -41,6 +41,7 @@ async def register_routers(dp: Dispatcher):
     dp.include_router(handlers.upload.router)
     dp.include_router(handlers.status.router)
     dp.include_router(handlers.reports.router)
+    dp.include_router(handlers.ask.router)
     dp.include_router(handlers.message.router)
 
 
@@ -60,6 +61,7 @@ async def set_commands(bot: Bot):
         BotCommand(command="start_analysis", description="Начать анализ документов"),
         BotCommand(command="status", description="Узнать статус анализа"),
         BotCommand(command="reports", description="Мой архив отчетов"),
+        BotCommand(command="ask", description="Задать вопрос по документам"),
         BotCommand(command="help", description="Помощь и инструкции"),
     ]
     await bot.set_my_commands(commands)
@@ -6,4 +6,5 @@ from . import upload
 from . import start_analysis
 from . import status
 from . import reports
+from . import ask
 from . import message
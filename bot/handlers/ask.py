@@ -0,0 +1,98 @@
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Command, StateFilter
+from aiogram.fsm.context import FSMContext
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+from bot.states import SearchStates
+from bot.services.question_answering import answer_question
+from bot.services.stream_delivery import deliver_streaming_text
+from external_services.circuit_breaker import CircuitOpenError
+from database.db_services import get_users_files
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+@router.message(Command("ask"))
+async def ask_handler(message: Message, state: FSMContext, session: AsyncSession):
+    """
+    Запускает режим вопросов по документам: предлагает выбрать файл или все файлы сразу.
+    """
+    user_files = await get_users_files(user_id=message.from_user.id, session=session)
+    if not user_files:
+        await message.answer("У вас пока нет загруженных документов. Загрузите файл через /upload.")
+        return
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="📚 Все документы", callback_data="ask_all")],
+        *[
+            [InlineKeyboardButton(
+                text=f"{i + 1}. {file.title or (file.file_id[:10])}",
+                callback_data=f"ask_file_{file.id}")
+            ]
+            for i, file in enumerate(user_files)
+        ]
+    ])
+    await state.set_state(SearchStates.waiting_for_book_selection)
+    await message.answer("По какому документу вы хотите задать вопрос?", reply_markup=keyboard)
+
+
+@router.callback_query(SearchStates.waiting_for_book_selection, F.data.startswith("ask_"))
+async def ask_file_selected_handler(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
+    if callback.data == "ask_all":
+        file_ids, title = None, "всем документам"
+    else:
+        file_pk = int(callback.data.removeprefix("ask_file_"))
+        user_files = await get_users_files(user_id=callback.from_user.id, session=session)
+        selected = next((file for file in user_files if file.id == file_pk), None)
+        if selected is None:
+            await callback.message.answer("Документ не найден. Выберите его заново через /ask.")
+            await callback.answer()
+            return
+        file_ids, title = [selected.file_id], f"документу «{selected.title or selected.file_id}»"
+
+    await state.update_data(file_ids=file_ids)
+    await state.set_state(SearchStates.waiting_for_question)
+    await callback.message.answer(
+        f"Задайте вопрос по {title}. Можно задавать несколько вопросов подряд, "
+        f"для выхода из режима вопросов отправьте /cancel."
+    )
+    await callback.answer()
+
+
+@router.message(Command("cancel"), StateFilter(SearchStates))
+async def ask_cancel_handler(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Режим вопросов по документам завершён.")
+
+
+@router.message(SearchStates.waiting_for_question, F.text)
+async def question_handler(message: Message, state: FSMContext, session: AsyncSession):
+    """
+    Отвечает на вопрос пользователя по выбранным документам: ищет релевантные фрагменты
+    и отправляет в Yandex GPT только их. Ответ показывается по мере генерации.
+    """
+    data = await state.get_data()
+
+    async def stream_answer(alternatives):
+        return await deliver_streaming_text(message.chat.id, alternatives, header="💬 ")
+
+    try:
+        answer = await answer_question(
+            message.from_user.id, message.text, session,
+            file_ids=data.get("file_ids"), stream_consumer=stream_answer,
+        )
+    except CircuitOpenError as ex:
+        logger.warning(f"Вопрос пользователя {message.from_user.id} не отправлен: {ex}")
+        await message.answer(
+            f"⏳ Yandex GPT временно недоступен. Попробуйте задать вопрос через {max(1, round(ex.retry_in))} с."
+        )
+        return
+    except Exception as ex:
+        logger.error(f"Ошибка ответа на вопрос пользователя {message.from_user.id}: {ex}")
+        await message.answer("❌ Не удалось ответить на вопрос. Попробуйте повторить позже.")
+        return
+    if answer is None:
+        await message.answer("В ваших документах не нашлось фрагментов, относящихся к вопросу.")
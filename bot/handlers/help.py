@@ -32,12 +32,14 @@ async def cmd_help(message: Message):
         "/start_analysis — Запустить автоматический анализ всех загруженных документов\n"
         "/status — Проверить статус выполнения анализа\n"
         "/reports — Просмотреть или получить итоговые отчёты по документам\n"
+        "/ask — Задать вопрос по загруженным документам\n"
         "/help — Показать это сообщение\n\n"
         "<b>Как пользоваться ботом:</b>\n"
         "1. Загрузите один или несколько документов через /upload или /download_from_yandex_disk.\n"
         "2. После завершения загрузки используйте /start_analysis для запуска экспертного AI-анализа.\n"
         "3. Проверьте статус обработки через /status.\n"
-        "4. Когда отчёт будет готов, воспользуйтесь командой /reports для просмотра результатов анализа.\n\n"
+        "4. Когда отчёт будет готов, воспользуйтесь командой /reports для просмотра результатов анализа.\n"
+        "5. Чтобы быстро найти ответ на конкретный вопрос без полного анализа, используйте /ask.\n\n"
         "Если остались вопросы — всегда обращайтесь через /help!"
     )
 
@@ -2,8 +2,7 @@ from aiogram import Router
 from aiogram.types import Message
 from aiogram.filters import Command
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.db_services import get_users_files, get_file_chunks
-from database.models import FileSummary
+from database.db_services import get_files_progress, get_active_analysis_job
 
 router = Router()
 
@@ -11,38 +10,34 @@ router = Router()
 async def status_handler(message: Message, session: AsyncSession):
     user_id = message.from_user.id
 
-    # Загружаем все файлы пользователя
-    user_files = await get_users_files(user_id=user_id, session=session)
-    if not user_files:
+    # Прогресс по всем файлам пользователя одним запросом
+    files_progress = await get_files_progress(user_id=user_id, session=session)
+    if not files_progress:
         await message.answer("У вас пока нет загруженных документов.")
         return
 
     status_msg = ""
-    for user_file in user_files:
+    active_job = await get_active_analysis_job(user_id, session)
+    if active_job is not None:
+        job_state = "в очереди" if active_job.status == "pending" else "выполняется"
+        status_msg += f"⚙️ Задача анализа: {job_state}\n\n"
+
+    for user_file, total, done, has_summary, summary_preview in files_progress:
         title = user_file.title or user_file.file_id
-        # Получаем чанки
-        chunks = await get_file_chunks(user_file.file_id, session=session)
-        total = len(chunks)
         if total == 0:
             status = "❔ Не разбит на части (ошибка загрузки)"
+        elif done == 0:
+            status = "⏳ Ждёт запуска анализа"
+        elif 0 < done < total:
+            status = f"🔄 В процессе ({done}/{total} блоков обработано)"
+        elif has_summary:
+            status = "✅ Анализ завершён"
         else:
-            done = sum(1 for c in chunks if c.processed)
-            if done == 0:
-                status = "⏳ Ждёт запуска анализа"
-            elif 0 < done < total:
-                status = f"🔄 В процессе ({done}/{total} блоков обработано)"
-            else:
-                # Проверяем, есть ли summary
-                summary = getattr(user_file, "summary", None)
-                if summary and summary.summary:
-                    status = "✅ Анализ завершён"
-                else:
-                    status = "✅ Анализ завершён (отчёт готовится)"
+            status = "✅ Анализ завершён (отчёт готовится)"
         status_msg += f"📄 <b>{title}</b>\nСтатус: {status}\n\n"
         # Если файл полностью обработан — покажи фрагмент summary
-        if getattr(user_file, "summary", None) and user_file.summary and user_file.summary.summary:
-            short_report = user_file.summary.summary[:500]
-            status_msg += f"📝 Фрагмент отчёта:\n{short_report}...\n\n"
+        if has_summary:
+            status_msg += f"📝 Фрагмент отчёта:\n{summary_preview}...\n\n"
 
     await message.answer(
         status_msg if status_msg else "Нет загруженных документов.",
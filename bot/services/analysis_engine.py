@@ -0,0 +1,304 @@
+import asyncio
+import logging
+import time
+
+from bot.services.text_processing import simhash_bands, hamming_distance
+from config import ANALYSIS_WORKERS, YANDEX_GPT_MODE, CHUNK_MAX_ATTEMPTS
+from database.db_init import async_session
+from database.db_services import increment_chunk_attempts
+from database.write_behind import chunk_response_writer
+from external_services.ai_yandex_gpt import yandex_gpt_request, yandex_gpt_deferred_batch
+from external_services.model_routing import ROUTE_MAP, route_options
+from external_services.completion_cache import cache_stats
+from external_services.rate_limiter import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+
+def group_near_duplicates(pending: list, max_distance: int) -> tuple[list, dict]:
+    """
+    Делит необработанные чанки на ведущие (отправляются в AI) и почти одинаковые им
+    (сигнатуры SimHash отличаются не больше чем в max_distance битах), которые получат ответ ведущего.
+
+    Ведущие ищутся через LSH: кандидаты — чанки с хотя бы одной совпадающей полосой сигнатуры.
+
+    Args:
+        pending (list[tuple[UserFile, FileChunk, int]]): Чанки в порядке обработки с файлом и числом чанков файла.
+        max_distance (int): Максимальное расстояние Хэмминга между сигнатурами.
+
+    Returns:
+        tuple[list, dict]: Ведущие чанки и followers — похожие на них чанки по id ведущего.
+    """
+    leaders = []
+    followers = {}
+    leaders_by_band = {}
+    for item in pending:
+        chunk = item[1]
+        if chunk.simhash is None:
+            leaders.append(item)
+            continue
+        bands = simhash_bands(chunk.simhash)
+        leader = next((
+            candidate for band in bands for candidate in leaders_by_band.get(band, ())
+            if hamming_distance(chunk.simhash, candidate.simhash) <= max_distance
+        ), None)
+        if leader is not None:
+            followers.setdefault(leader.id, []).append(item)
+            continue
+        leaders.append(item)
+        for band in bands:
+            leaders_by_band.setdefault(band, []).append(chunk)
+    return leaders, followers
+
+
+def build_chunk_messages(chunk, prompt_text: str) -> list:
+    return [
+        {"role": "system", "text": prompt_text},
+        {"role": "user", "text": chunk.content}
+    ]
+
+
+async def analyze_chunk(chunk, prompt_text: str, user_id: int = None) -> str:
+    """
+    Отправляет один чанк документа на анализ в Yandex GPT (модель и размер ответа — по маршруту map).
+
+    Args:
+        chunk (FileChunk): Чанк документа.
+        prompt_text (str): Системный промт анализа.
+        user_id (int, optional): Владелец документа — по нему запрос ставится в очередь планировщика.
+
+    Returns:
+        str: Текст ответа AI по чанку.
+    """
+    messages = build_chunk_messages(chunk, prompt_text)
+    response = await yandex_gpt_request(messages=messages, **route_options(ROUTE_MAP, messages), user_id=user_id)
+    return response["result"]["alternatives"][0]["message"]["text"]
+
+
+async def run_chunk_analysis(
+        files_chunks: list,
+        prompt_text: str,
+        *,
+        on_chunk_error=None,
+        on_file_done=None,
+        workers: int = ANALYSIS_WORKERS,
+        mode: str = YANDEX_GPT_MODE,
+        prompt_hash: str = None,
+        near_duplicate_distance: int = None,
+        max_attempts: int = CHUNK_MAX_ATTEMPTS
+) -> dict:
+    """
+    Параллельно анализирует чанки нескольких файлов пулом из workers воркеров.
+
+    Все необработанные чанки всех файлов ставятся в общую очередь, поэтому файлы
+    обрабатываются одновременно. Уже обработанные чанки (processed=True) пропускаются,
+    их ответы используются при итоговом резюмировании. Ответы записываются в БД пачками
+    через буфер chunk_response_writer; воркер не ждёт записи и сразу берёт следующий чанк,
+    а чанк считается обработанным только после коммита его ответа.
+
+    Как только по файлу обработан последний чанк, вызывается on_file_done — итоговое
+    резюмирование этого файла идёт параллельно с анализом чанков остальных файлов.
+
+    Неудачные попытки анализа чанка сохраняются в БД (FileChunk.attempts); в режиме sync чанк
+    сразу повторяется с экспоненциальной задержкой, пока попыток меньше max_attempts. Чанки,
+    исчерпавшие попытки в прошлых запусках, больше не отправляются в AI.
+
+    Если задан near_duplicate_distance, из почти одинаковых чанков (group_near_duplicates)
+    в AI отправляется только первый, остальные получают его ответ.
+
+    В режиме deferred все чанки документа отправляются в отложенный API Yandex GPT разом,
+    а ответы сохраняются по мере готовности операций.
+
+    Args:
+        files_chunks (list[tuple[UserFile, list[FileChunk]]]): Файлы и их чанки.
+        prompt_text (str): Системный промт анализа.
+        on_chunk_error (Callable, optional): async-функция (user_file, chunk, ex), вызывается при ошибке чанка.
+        on_file_done (Callable, optional): async-функция (user_file, ai_answers), вызывается после
+            обработки всех чанков файла; ai_answers упорядочены по chunk_index.
+        workers (int): Количество параллельных воркеров (в режиме deferred — одновременных HTTP-вызовов).
+        mode (str): Режим запросов: sync или deferred.
+        prompt_hash (str, optional): Версия промта; сохраняется вместе с ответами по чанкам.
+        near_duplicate_distance (int, optional): Максимальное расстояние Хэмминга между сигнатурами
+            SimHash почти одинаковых чанков; None — не искать похожие чанки.
+        max_attempts (int): Максимальное число попыток анализа одного чанка.
+
+    Returns:
+        dict: Статистика: processed, failed, skipped, near_duplicates (ответ взят у похожего чанка),
+            exhausted (попытки исчерпаны ранее), elapsed (сек.), throughput (чанков/сек.).
+    """
+    started = time.monotonic()
+    cache_hits_before = cache_stats["hits"]
+    stats = {"processed": 0, "failed": 0, "skipped": 0, "near_duplicates": 0, "exhausted": 0}
+    queue = asyncio.Queue()
+    answers = {}
+    remaining = {}
+    file_tasks = []
+    completions = set()
+    all_pending = []
+
+    def finish_file(user_file):
+        if on_file_done is None:
+            return
+        file_answers = answers[user_file.file_id]
+        ordered = [file_answers[idx] for idx in sorted(file_answers)]
+        file_tasks.append(asyncio.create_task(on_file_done(user_file, ordered)))
+
+    for user_file, chunks in files_chunks:
+        answers[user_file.file_id] = {
+            chunk.chunk_index: chunk.ai_response
+            for chunk in chunks if chunk.processed and chunk.ai_response
+        }
+        pending = [chunk for chunk in chunks if not chunk.processed]
+        stats["skipped"] += len(chunks) - len(pending)
+        exhausted = [chunk for chunk in pending if (chunk.attempts or 0) >= max_attempts]
+        if exhausted:
+            stats["exhausted"] += len(exhausted)
+            logger.warning(
+                f"Файл {user_file.title or user_file.file_id}: {len(exhausted)} чанков исчерпали попытки анализа"
+            )
+            pending = [chunk for chunk in pending if (chunk.attempts or 0) < max_attempts]
+        remaining[user_file.file_id] = len(pending)
+        all_pending.extend((user_file, chunk, len(chunks)) for chunk in pending)
+        if not pending:
+            finish_file(user_file)
+
+    followers = {}
+    if near_duplicate_distance is not None:
+        all_pending, followers = group_near_duplicates(all_pending, near_duplicate_distance)
+    for item in all_pending:
+        queue.put_nowait(item)
+
+    async def complete_chunk(user_file, chunk, total, ai_answer=None, error=None, duplicate_of=None):
+        title = user_file.title or user_file.file_id
+        if error is None:
+            try:
+                await chunk_response_writer.save(chunk.id, ai_answer, prompt_hash)
+                answers[user_file.file_id][chunk.chunk_index] = ai_answer
+                stats["processed"] += 1
+                if duplicate_of is not None:
+                    stats["near_duplicates"] += 1
+                    logger.info(f"Чанк {chunk.chunk_index + 1}/{total} файла {title} получил ответ похожего чанка {duplicate_of}.")
+                else:
+                    logger.info(f"Чанк {chunk.chunk_index + 1}/{total} файла {title} успешно обработан и сохранён.")
+            except Exception as ex:
+                error = ex
+        if error is not None:
+            stats["failed"] += 1
+            logger.error(f"Ошибка анализа чанка {chunk.chunk_index + 1} файла {user_file.file_id}: {error}")
+            if on_chunk_error is not None:
+                await on_chunk_error(user_file, chunk, error)
+        remaining[user_file.file_id] -= 1
+        if remaining[user_file.file_id] == 0:
+            logger.info(f"Все чанки файла {title} обработаны.")
+            finish_file(user_file)
+
+    def track_completion(user_file, chunk, total, ai_answer=None, error=None, duplicate_of=None):
+        task = asyncio.create_task(complete_chunk(
+            user_file, chunk, total, ai_answer=ai_answer, error=error, duplicate_of=duplicate_of
+        ))
+        completions.add(task)
+        task.add_done_callback(completions.discard)
+        # Похожие чанки получают тот же ответ (или ту же ошибку) без отдельного запроса к AI
+        for follower_file, follower_chunk, follower_total in followers.pop(chunk.id, ()):
+            track_completion(follower_file, follower_chunk, follower_total,
+                             ai_answer=ai_answer, error=error, duplicate_of=chunk.id)
+
+    async def record_failure(chunk) -> int:
+        # Похожие чанки ждут ответа этого чанка, поэтому неудачная попытка засчитывается и им
+        failed = [chunk] + [follower_chunk for _, follower_chunk, _ in followers.get(chunk.id, ())]
+        for failed_chunk in failed:
+            try:
+                async with async_session() as session:
+                    failed_chunk.attempts = await increment_chunk_attempts(failed_chunk.id, session)
+            except Exception as ex:
+                logger.error(f"Не удалось сохранить счётчик попыток чанка {failed_chunk.id}: {ex}")
+                failed_chunk.attempts = (failed_chunk.attempts or 0) + 1
+        return chunk.attempts
+
+    async def worker(worker_id: int):
+        while True:
+            try:
+                user_file, chunk, total = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            title = user_file.title or user_file.file_id
+            logger.info(f"[worker {worker_id}] Отправка чанка {chunk.chunk_index + 1}/{total} файла {title} на AI")
+            while True:
+                try:
+                    ai_answer = await analyze_chunk(chunk, prompt_text, user_id=user_file.user_id)
+                except Exception as ex:
+                    attempts = await record_failure(chunk)
+                    if attempts < max_attempts:
+                        delay = backoff_delay(attempts)
+                        logger.warning(
+                            f"[worker {worker_id}] Чанк {chunk.chunk_index + 1} файла {title}: попытка {attempts} "
+                            f"из {max_attempts} не удалась ({ex}), повтор через {delay:.1f} с"
+                        )
+                        await asyncio.sleep(delay)
+                        continue
+                    track_completion(user_file, chunk, total, error=ex)
+                    break
+                track_completion(user_file, chunk, total, ai_answer=ai_answer)
+                break
+
+    async def deferred_file(user_file, pending, total):
+        title = user_file.title or user_file.file_id
+        logger.info(f"Отправка {len(pending)} чанков файла {title} в отложенный режим Yandex GPT")
+        requests = [build_chunk_messages(chunk, prompt_text) for chunk in pending]
+        options = [route_options(ROUTE_MAP, messages) for messages in requests]
+        batch = yandex_gpt_deferred_batch(
+            requests, model=options[0]["model"], temperature=options[0]["temperature"],
+            max_tokens=[option["max_tokens"] for option in options], concurrency=workers,
+            user_id=user_file.user_id, route=ROUTE_MAP,
+        )
+        async for idx, response, error in batch:
+            ai_answer = None
+            if error is None:
+                try:
+                    ai_answer = response["result"]["alternatives"][0]["message"]["text"]
+                except (KeyError, IndexError, TypeError) as ex:
+                    error = ex
+            if error is not None:
+                # Повтор — при следующем запуске анализа, пока не исчерпаны попытки
+                await record_failure(pending[idx])
+            track_completion(user_file, pending[idx], total, ai_answer=ai_answer, error=error)
+
+    try:
+        if mode == "deferred":
+            files_pending = {}
+            while not queue.empty():
+                user_file, chunk, total = queue.get_nowait()
+                files_pending.setdefault(user_file.file_id, (user_file, [], total))[1].append(chunk)
+            workers_count = len(files_pending)
+            await asyncio.gather(*(
+                deferred_file(user_file, pending, total) for user_file, pending, total in files_pending.values()
+            ))
+        else:
+            workers_count = max(1, min(workers, queue.qsize()))
+            await asyncio.gather(*(worker(i) for i in range(workers_count)))
+        # Дожидаемся записи последних ответов в БД
+        results = await asyncio.gather(*completions, return_exceptions=True)
+    except asyncio.CancelledError:
+        # Уже переданные в буфер ответы всё равно будут записаны
+        for task in completions:
+            task.cancel()
+        raise
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка завершения обработки чанка: {result}")
+
+    elapsed = time.monotonic() - started
+    stats["elapsed"] = elapsed
+    stats["throughput"] = stats["processed"] / elapsed if elapsed > 0 else 0.0
+    stats["cache_hits"] = cache_stats["hits"] - cache_hits_before
+    logger.info(
+        f"Анализ чанков завершён: обработано {stats['processed']}, ошибок {stats['failed']}, "
+        f"пропущено {stats['skipped']}, ответ похожего чанка {stats['near_duplicates']} за {elapsed:.1f} с ({stats['throughput']:.2f} чанков/с, "
+        f"воркеров: {workers_count}, из кэша: {stats['cache_hits']})"
+    )
+
+    results = await asyncio.gather(*file_tasks, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка итоговой обработки файла: {result}")
+    return stats
@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from bot.bot_instance import bot
+from bot.services.analysis_engine import run_chunk_analysis
+from bot.services.other_helpers import summarize_recursive
+from bot.services.prompt_cache import get_prompt
+from bot.services.stream_delivery import deliver_streaming_text
+from bot.services.text_processing import analyze_terms, simhash, simhash_bands
+from config import (ANALYSIS_WORKER_JOBS, ANALYSIS_JOB_LEASE_SEC, ANALYSIS_JOB_POLL_SEC, ANALYSIS_JOB_MAX_ATTEMPTS, STREAM_FINAL_REPORT,
+                    NEAR_DUPLICATE_ENABLED, NEAR_DUPLICATE_MAX_DISTANCE, CHUNK_MAX_ATTEMPTS)
+from database.db_init import async_session
+from database.db_services import (get_files_progress, get_file_chunks, save_file_summary, claim_analysis_job,
+                                  renew_analysis_job_lease, finish_analysis_job, release_analysis_job,
+                                  set_analysis_job_prompt, get_reusable_chunk_answers, get_reusable_summary,
+                                  get_near_duplicate_answers)
+from external_services.model_routing import route_stats
+
+logger = logging.getLogger(__name__)
+
+
+def make_worker_id() -> str:
+    """
+    Формирует уникальный идентификатор воркера: хост, pid и случайный суффикс.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def reuse_chunk_answers(user_file, chunks: list, prompt_hash: str, session) -> int:
+    """
+    Переносит в необработанные чанки файла ответы AI, уже полученные с той же версией промта
+    для такого же документа (совпадает sha256 файла и текст чанка), и сохраняет их.
+
+    Returns:
+        int: Количество чанков, для которых ответ взят готовым.
+    """
+    if not user_file.content_hash:
+        return 0
+    pending = [chunk for chunk in chunks if not chunk.processed]
+    if not pending:
+        return 0
+    reusable = await get_reusable_chunk_answers(user_file.content_hash, prompt_hash, user_file.file_id, session)
+    reused = 0
+    for chunk in pending:
+        content, ai_response = reusable.get(chunk.chunk_index, (None, None))
+        if content == chunk.content:
+            chunk.ai_response, chunk.prompt_hash, chunk.processed = ai_response, prompt_hash, True
+            reused += 1
+    if reused:
+        await session.commit()
+    return reused
+
+
+async def reuse_near_duplicate_answers(chunks: list, prompt_hash: str, user_id: int, session) -> int:
+    """
+    Переносит в необработанные чанки ответы AI, полученные с той же версией промта для почти
+    одинаковых чанков (сигнатуры SimHash отличаются не больше чем в NEAR_DUPLICATE_MAX_DISTANCE битах):
+    повторяющиеся шапки, дисклеймеры и типовые разделы не отправляются в Yandex GPT повторно.
+    Похожие чанки ищутся только в документах того же пользователя.
+
+    Чанкам, сохранённым до появления сигнатур, сигнатура считается и сохраняется здесь.
+
+    Returns:
+        int: Количество чанков, для которых ответ взят у похожего чанка.
+    """
+    pending = [chunk for chunk in chunks if not chunk.processed]
+    if not pending:
+        return 0
+    unsigned = [chunk for chunk in pending if chunk.simhash is None]
+    if unsigned:
+        signatures = await asyncio.to_thread(lambda: [simhash(analyze_terms(chunk.content)) for chunk in unsigned])
+        for chunk, signature in zip(unsigned, signatures):
+            chunk.simhash, chunk.simhash_bands = signature, simhash_bands(signature)
+    matches = await get_near_duplicate_answers(
+        {chunk.id: chunk.simhash for chunk in pending}, prompt_hash, user_id, session, NEAR_DUPLICATE_MAX_DISTANCE
+    )
+    for chunk in pending:
+        if chunk.id in matches:
+            source_chunk_id, ai_response = matches[chunk.id]
+            chunk.ai_response, chunk.prompt_hash, chunk.processed = ai_response, prompt_hash, True
+            logger.debug(f"Для чанка {chunk.id} использован ответ похожего чанка {source_chunk_id}")
+    if unsigned or matches:
+        await session.commit()
+    return len(matches)
+
+
+async def process_analysis_job(user_id: int, send_func, job_id: int = None):
+    """
+    Выполняет анализ всех документов пользователя.
+
+    - Берёт актуальную версию промта из кэша (сверяется с Яндекс.Диском).
+    - Параллельно анализирует необработанные чанки всех файлов.
+    - Формирует и сохраняет итоговый отчёт по каждому файлу.
+
+    Работает в собственных сессиях БД и не зависит от обработчика сообщения,
+    поэтому может выполняться как в процессе бота, так и в отдельном воркере.
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        send_func (Callable): Функция отправки сообщения пользователю.
+        job_id (int, optional): Задача анализа, в которой запоминается версия промта.
+    """
+    logger.info(f"Начат анализ для пользователя {user_id}")
+
+    # 1. Получаем все файлы пользователя
+    async with async_session() as session:
+        files_progress = await get_files_progress(user_id=user_id, session=session)
+        logger.info(f"Найдено {len(files_progress)} файлов пользователя {user_id}")
+
+        if not files_progress:
+            await send_func("Вы ещё не загрузили ни одного файла. Загрузите документацию, чтобы начать анализ.")
+            logger.info(f"Пользователь {user_id} не загрузил ни одного файла")
+            return
+
+        # 2-3. Получаем актуальную версию промта
+        try:
+            prompt = await get_prompt()
+        except Exception as ex:
+            await send_func("Не удалось получить текущий промт с Яндекс.Диска.")
+            logger.error(f"Не удалось получить промт для пользователя {user_id}: {ex}")
+            return
+        prompt_text = prompt.text
+        logger.info(f"Используется промт версии {prompt.hash[:12]}")
+        if job_id is not None:
+            await set_analysis_job_prompt(job_id, prompt.hash, session)
+
+        files_in_progress = []
+        files_to_analyze = []
+        reused_chunks = 0
+        near_duplicate_chunks = 0
+
+        for user_file, total, done, has_summary, _ in files_progress:
+            if total == 0:
+                msg = f"Файл {user_file.title or user_file.file_id}: нет разбивки на блоки, обратитесь к администратору."
+                await send_func(msg)
+                logger.warning(f"{msg}")
+                continue
+            if done == total and has_summary:
+                logger.info(f"Файл {user_file.title or user_file.file_id} уже обработан полностью.")
+                continue
+
+            # Чанки загружаются только для файлов, по которым осталась работа;
+            # если все чанки обработаны, но отчёта нет — будет построен только отчёт
+            chunks = await get_file_chunks(user_file.file_id, session=session)
+            reused_chunks += await reuse_chunk_answers(user_file, chunks, prompt.hash, session)
+            if NEAR_DUPLICATE_ENABLED:
+                near_duplicate_chunks += await reuse_near_duplicate_answers(chunks, prompt.hash, user_id, session)
+
+            files_in_progress.append(user_file.title or user_file.file_id)
+            files_to_analyze.append((user_file, chunks))
+            await send_func(f"⏳ Анализирую файл: {user_file.title or user_file.file_id}...")
+
+    if not files_in_progress:
+        await send_func("Все ваши файлы уже были проанализированы.")
+        logger.info(f"Пользователь {user_id} уже проанализировал все свои файлы.")
+        return
+
+    async def on_chunk_error(user_file, chunk, ex):
+        await send_func(
+            f"❌ Ошибка анализа чанка файла {user_file.title or user_file.file_id}: {ex}"
+        )
+
+    async def on_file_done(user_file, ai_answers):
+        # 5. Итоговое резюмирование
+        title = user_file.title or user_file.file_id
+        header = f"✅ Анализ завершён для файла: {title}.\n\nОтчет:\n\n"
+        delivered = False
+
+        async def stream_report(alternatives):
+            # Отчёт показывается пользователю по мере генерации
+            nonlocal delivered
+            text = await deliver_streaming_text(user_id, alternatives, header=header)
+            delivered = True
+            return text
+
+        try:
+            if user_file.content_hash:
+                async with async_session() as summary_session:
+                    final_summary = await get_reusable_summary(
+                        user_file.content_hash, prompt.hash, user_file.file_id, session=summary_session
+                    )
+                    if final_summary is not None:
+                        # Такой же документ уже анализировался с этой версией промта
+                        await save_file_summary(user_file.file_id, final_summary, session=summary_session,
+                                                prompt_hash=prompt.hash)
+                        await send_func(
+                            f"{header}{final_summary[:3800]}{'...' if len(final_summary) > 3800 else ''}"
+                        )
+                        logger.info(f"Для файла {title} использован готовый отчёт по такому же документу.")
+                        return
+
+            logger.info(f"Начинается итоговое резюмирование для файла {title}. Количество ответов: {len(ai_answers)}")
+            if ai_answers:
+                async with async_session() as summary_session:
+                    final_summary = await summarize_recursive(
+                        ai_answers, prompt_text, session=summary_session,
+                        max_group_size=10, max_final_groups=20,
+                        on_final_stream=stream_report if STREAM_FINAL_REPORT else None,
+                        user_id=user_id,
+                    )
+                    await save_file_summary(user_file.file_id, final_summary, session=summary_session,
+                                            prompt_hash=prompt.hash)
+                if not delivered:
+                    await send_func(
+                        f"{header}{final_summary[:3800]}{'...' if len(final_summary) > 3800 else ''}"
+                    )
+                logger.info(f"Итоговый отчёт для файла {title} успешно сохранён и отправлен пользователю.")
+            else:
+                logger.warning(f"Для файла {title} отсутствуют ответы AI для итогового резюмирования.")
+        except Exception as ex:
+            logger.error(f"Ошибка создания общего отчёта для файла {user_file.file_id}: {ex}")
+            await send_func(f"❌ Ошибка создания общего отчета: {ex}")
+
+    # 4. Параллельный анализ чанков всех файлов
+    stats = await run_chunk_analysis(
+        files_to_analyze,
+        prompt_text,
+        on_chunk_error=on_chunk_error,
+        on_file_done=on_file_done,
+        prompt_hash=prompt.hash,
+        near_duplicate_distance=NEAR_DUPLICATE_MAX_DISTANCE if NEAR_DUPLICATE_ENABLED else None,
+    )
+    near_duplicate_chunks += stats["near_duplicates"]
+    saved_calls = reused_chunks + near_duplicate_chunks
+    logger.info(
+        f"Пользователь {user_id}: сэкономлено вызовов Yandex GPT {saved_calls} "
+        f"(такой же документ: {reused_chunks}, похожие блоки: {near_duplicate_chunks})"
+    )
+    await send_func(
+        f"📊 Обработано блоков: {stats['processed']} за {stats['elapsed']:.1f} с "
+        f"({stats['throughput']:.2f} блоков/с)."
+        + (f"\n♻️ Готовые результаты анализа такого же документа использованы для {reused_chunks} блоков."
+           if reused_chunks else "")
+        + (f"\n🔁 Похожие блоки взяли готовый ответ без запроса к AI: {near_duplicate_chunks}."
+           if near_duplicate_chunks else "")
+        + (f"\n⚠️ Не удалось обработать после {CHUNK_MAX_ATTEMPTS} попыток блоков: {stats['exhausted']}."
+           if stats["exhausted"] else "")
+    )
+
+
+async def _keep_lease(job_id: int, worker_id: str, job_task: asyncio.Task, lease_lost: asyncio.Event):
+    """
+    Периодически продлевает аренду задачи. Если аренда перехвачена другим воркером,
+    отменяет выполнение задачи, чтобы не обрабатывать её дважды.
+    """
+    while not job_task.done():
+        await asyncio.sleep(ANALYSIS_JOB_LEASE_SEC / 3)
+        try:
+            async with async_session() as session:
+                renewed = await renew_analysis_job_lease(job_id, worker_id, ANALYSIS_JOB_LEASE_SEC, session)
+        except Exception as ex:
+            logger.error(f"Не удалось продлить аренду задачи {job_id}: {ex}")
+            continue
+        if not renewed:
+            logger.warning(f"Аренда задачи {job_id} потеряна, выполнение прерывается")
+            lease_lost.set()
+            job_task.cancel()
+            return
+
+
+async def _run_job(job, worker_id: str):
+    user_id = job.user_id
+
+    async def send_func(text: str):
+        await bot.send_message(user_id, text)
+
+    lease_lost = asyncio.Event()
+    job_task = asyncio.create_task(process_analysis_job(user_id, send_func, job_id=job.id))
+    lease_task = asyncio.create_task(_keep_lease(job.id, worker_id, job_task, lease_lost))
+    try:
+        await job_task
+        status, error = "done", None
+    except asyncio.CancelledError:
+        if lease_lost.is_set():
+            # Задачей уже владеет другой воркер
+            return
+        # Воркер останавливается — возвращаем задачу в очередь без траты попытки
+        job_task.cancel()
+        async with async_session() as session:
+            await release_analysis_job(job.id, worker_id, session)
+        logger.info(f"Задача анализа {job.id} возвращена в очередь")
+        raise
+    except Exception as ex:
+        logger.error(f"Ошибка выполнения задачи анализа {job.id}: {ex}")
+        # Пока попытки не исчерпаны, возвращаем задачу в очередь
+        status = "pending" if job.attempts < ANALYSIS_JOB_MAX_ATTEMPTS else "failed"
+        error = str(ex)
+        if status == "failed":
+            try:
+                await send_func(f"❌ Ошибка анализа документов: {ex}")
+            except Exception as send_ex:
+                logger.error(f"Не удалось уведомить пользователя {user_id}: {send_ex}")
+    finally:
+        lease_task.cancel()
+
+    async with async_session() as session:
+        await finish_analysis_job(job.id, worker_id, status, session, error=error)
+    logger.info(f"Задача анализа {job.id} пользователя {user_id} завершена со статусом {status}")
+    logger.info(f"Запросы к Yandex GPT по шагам: {route_stats.format()}")
+
+
+async def run_analysis_worker(stop_event: asyncio.Event = None, max_jobs: int = ANALYSIS_WORKER_JOBS):
+    """
+    Цикл воркера очереди анализа.
+
+    Забирает задачи из таблицы analysis_jobs с арендой и выполняет до max_jobs задач
+    одновременно. Задачи, брошенные упавшим воркером, подхватываются после истечения аренды.
+
+    Слоты задач не ограничивают обращения к Yandex GPT: задача сразу начинает отправлять
+    запросы, а планировщик llm_scheduler по очереди выдаёт квоту пользователям. Поэтому
+    max_jobs выбирается с запасом, иначе длинные задачи занимают все слоты и задачи
+    остальных пользователей ждут в очереди, не получая доли квоты.
+
+    Args:
+        stop_event (asyncio.Event, optional): Событие остановки цикла.
+        max_jobs (int): Максимальное число одновременно выполняемых задач.
+    """
+    worker_id = make_worker_id()
+    slots = asyncio.Semaphore(max_jobs)
+    running = set()
+    logger.info(f"Воркер анализа {worker_id} запущен (задач одновременно: {max_jobs})")
+    try:
+        while stop_event is None or not stop_event.is_set():
+            await slots.acquire()
+            try:
+                async with async_session() as session:
+                    job = await claim_analysis_job(worker_id, ANALYSIS_JOB_LEASE_SEC, ANALYSIS_JOB_MAX_ATTEMPTS,
+                                                   session)
+            except Exception as ex:
+                logger.error(f"Ошибка получения задачи из очереди: {ex}")
+                job = None
+            if job is None:
+                slots.release()
+                await asyncio.sleep(ANALYSIS_JOB_POLL_SEC)
+                continue
+
+            logger.info(f"Воркер {worker_id} взял задачу анализа {job.id} (попытка {job.attempts})")
+            task = asyncio.create_task(_run_job(job, worker_id))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        logger.info(f"Воркер анализа {worker_id} остановлен")
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import math
+from collections import OrderedDict
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.services.text_processing import analyze_terms, term_frequencies
+from config import BM25_CACHE_USERS
+from database.db_services import get_chunks_without_term_freqs, save_chunk_term_freqs, get_user_chunk_term_freqs
+
+logger = logging.getLogger(__name__)
+
+# Обратные индексы пользователей, самые давно использованные вытесняются
+_user_indexes = OrderedDict()
+
+
+class BM25Index:
+    """
+    Обратный индекс чанков пользователя с ранжированием BM25.
+
+    Индекс пополняется по месту: add дописывает вхождения терминов нового чанка и обновляет
+    число документов и их суммарную длину, remove_file исключает чанки файла (например,
+    прежней ревизии). Веса BM25 считаются при поиске только для терминов запроса по
+    numpy-массивам вхождений, которые пересобираются лишь для изменившихся терминов.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunk_ids = []
+        self.file_codes = []
+        self._file_codes_by_id = {}
+        self.doc_lengths = []
+        self._alive = []
+        self.docs_count = 0
+        self.total_length = 0
+        self._postings = {}
+        self._term_arrays = {}
+        self._doc_arrays = None
+
+    def __len__(self):
+        return self.docs_count
+
+    def add(self, chunk_id: int, file_id: str, term_freqs: dict[str, int]):
+        """
+        Добавляет чанк в индекс.
+
+        Args:
+            chunk_id (int): id чанка.
+            file_id (str): Файл чанка.
+            term_freqs (dict[str, int]): Частоты терминов (term_frequencies).
+        """
+        doc = len(self.chunk_ids)
+        length = sum(term_freqs.values())
+        self.chunk_ids.append(chunk_id)
+        self.file_codes.append(self._file_codes_by_id.setdefault(file_id, len(self._file_codes_by_id)))
+        self.doc_lengths.append(length)
+        self._alive.append(True)
+        self.docs_count += 1
+        self.total_length += length
+        for term, freq in term_freqs.items():
+            self._postings.setdefault(term, []).append((doc, freq))
+            self._term_arrays.pop(term, None)
+        self._doc_arrays = None
+
+    def remove_file(self, file_id: str) -> int:
+        """
+        Исключает из индекса чанки файла. Их вхождения остаются в списках терминов,
+        но не учитываются ни в весах, ни в результатах поиска.
+
+        Returns:
+            int: Количество исключённых чанков.
+        """
+        code = self._file_codes_by_id.get(file_id)
+        if code is None:
+            return 0
+        removed = 0
+        for doc, doc_code in enumerate(self.file_codes):
+            if doc_code == code and self._alive[doc]:
+                self._alive[doc] = False
+                self.docs_count -= 1
+                self.total_length -= self.doc_lengths[doc]
+                removed += 1
+        if removed:
+            self._doc_arrays = None
+        return removed
+
+    def _get_doc_arrays(self):
+        if self._doc_arrays is None:
+            self._doc_arrays = (
+                np.array(self.chunk_ids, dtype=np.int64),
+                np.array(self.file_codes, dtype=np.int32),
+                np.array(self.doc_lengths, dtype=np.float32),
+                np.array(self._alive, dtype=bool),
+            )
+        return self._doc_arrays
+
+    def _get_term_arrays(self, term: str):
+        arrays = self._term_arrays.get(term)
+        if arrays is None:
+            postings = self._postings[term]
+            arrays = (
+                np.fromiter((doc for doc, _ in postings), dtype=np.int32, count=len(postings)),
+                np.fromiter((freq for _, freq in postings), dtype=np.float32, count=len(postings)),
+            )
+            self._term_arrays[term] = arrays
+        return arrays
+
+    def search(self, query: str, top_k: int, file_ids: list[str] = None) -> list[tuple[int, float]]:
+        """
+        Возвращает top_k чанков с наибольшим весом BM25 по терминам запроса.
+
+        Args:
+            query (str): Текст запроса.
+            top_k (int): Количество результатов.
+            file_ids (list[str], optional): Искать только среди чанков этих файлов.
+
+        Returns:
+            list[tuple[int, float]]: (id чанка, вес BM25) по убыванию веса.
+        """
+        if not self.docs_count:
+            return []
+        chunk_ids, doc_file_codes, doc_lengths, alive = self._get_doc_arrays()
+        avg_length = self.total_length / self.docs_count or 1.0
+        scores = np.zeros(len(chunk_ids), dtype=np.float32)
+        for term in set(analyze_terms(query)):
+            if term not in self._postings:
+                continue
+            docs, freqs = self._get_term_arrays(term)
+            live = alive[docs]
+            docs, freqs = docs[live], freqs[live]
+            if not len(docs):
+                continue
+            idf = math.log((self.docs_count - len(docs) + 0.5) / (len(docs) + 0.5) + 1)
+            norms = self.k1 * (1 - self.b + self.b * doc_lengths[docs] / avg_length)
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + norms)
+        if file_ids is not None:
+            codes = [self._file_codes_by_id[file_id] for file_id in file_ids if file_id in self._file_codes_by_id]
+            scores[~np.isin(doc_file_codes, codes)] = 0
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(chunk_ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+
+async def backfill_user_term_freqs(user_id: int, session: AsyncSession, batch_size: int = 1000) -> int:
+    """
+    Считает частоты терминов для чанков пользователя, сохранённых до появления BM25-индекса.
+
+    Returns:
+        int: Количество проиндексированных чанков.
+    """
+    indexed = 0
+    while True:
+        rows = await get_chunks_without_term_freqs(user_id, session, limit=batch_size)
+        if not rows:
+            return indexed
+        term_freqs = await asyncio.to_thread(
+            lambda: {chunk_id: term_frequencies(content) for chunk_id, content in rows}
+        )
+        await save_chunk_term_freqs(term_freqs, session=session)
+        indexed += len(rows)
+
+
+async def get_user_bm25_index(user_id: int, session: AsyncSession) -> BM25Index:
+    """
+    Возвращает BM25-индекс чанков пользователя, при необходимости собирая его
+    из сохранённых в БД частот терминов.
+    """
+    if user_id in _user_indexes:
+        _user_indexes.move_to_end(user_id)
+        return _user_indexes[user_id]
+
+    indexed = await backfill_user_term_freqs(user_id, session)
+    if indexed:
+        logger.info(f"Проиндексировано чанков пользователя {user_id} для BM25: {indexed}")
+    index = BM25Index()
+    for row in await get_user_chunk_term_freqs(user_id, session):
+        index.add(row.id, row.file_id, row.term_freqs)
+    _user_indexes[user_id] = index
+    while len(_user_indexes) > BM25_CACHE_USERS:
+        _user_indexes.popitem(last=False)
+    return index
+
+
+async def update_user_bm25_index(user_id: int, file_id: str, session: AsyncSession):
+    """
+    Добавляет в закэшированный BM25-индекс пользователя чанки загруженного файла; для новой
+    ревизии файла прежние чанки предварительно исключаются. Если индекса пользователя нет
+    в кэше, ничего не делает — индекс соберётся из БД при первом поиске.
+    """
+    index = _user_indexes.get(user_id)
+    if index is None:
+        return
+    try:
+        rows = await get_user_chunk_term_freqs(user_id, session, file_id=file_id)
+    except Exception as ex:
+        logger.warning(f"Не удалось дополнить BM25-индекс пользователя {user_id}, он будет собран заново: {ex}")
+        _user_indexes.pop(user_id, None)
+        return
+    index.remove_file(file_id)
+    for row in rows:
+        index.add(row.id, row.file_id, row.term_freqs)
+
+
+async def search_user_chunks_bm25(user_id: int, query: str, session: AsyncSession, top_k: int,
+                                  file_ids: list[str] = None) -> list[tuple[int, float]]:
+    """
+    Ищет чанки документов пользователя по точному совпадению терминов (BM25).
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        query (str): Текст запроса.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        top_k (int): Количество результатов.
+        file_ids (list[str], optional): Искать только в этих файлах.
+
+    Returns:
+        list[tuple[int, float]]: (id чанка, вес BM25) по убыванию веса.
+    """
+    index = await get_user_bm25_index(user_id, session)
+    return index.search(query, top_k, file_ids=file_ids)
@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_USERS
+from database.db_services import get_chunks_without_embeddings, save_chunk_embeddings, get_user_chunk_embeddings
+
+logger = logging.getLogger(__name__)
+
+_model = None
+_model_lock = threading.Lock()
+# Модель сама использует все ядра CPU, поэтому вычисления идут в одном отдельном потоке
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embeddings")
+# Матрицы векторов пользователей, самые давно использованные вытесняются
+_user_indexes = OrderedDict()
+
+
+def _get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"Загрузка модели эмбеддингов {EMBEDDING_MODEL}")
+            _model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    return _model
+
+
+def encode_texts(texts: list[str]) -> np.ndarray:
+    """
+    Считает нормированные векторы текстов локальной моделью (синхронно, нагружает CPU).
+
+    Returns:
+        np.ndarray: Матрица float32 размером (len(texts), dim).
+    """
+    vectors = _get_model().encode(
+        texts,
+        batch_size=EMBEDDING_BATCH_SIZE,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False,
+    )
+    return vectors.astype(np.float32)
+
+
+async def embed_texts(texts: list[str]) -> np.ndarray:
+    """
+    Считает нормированные векторы текстов, не блокируя цикл событий.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, encode_texts, list(texts))
+
+
+def vector_to_bytes(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def bytes_to_matrix(blobs: list[bytes], dim: int) -> np.ndarray:
+    return np.frombuffer(b"".join(blobs), dtype=np.float16).reshape(len(blobs), dim).astype(np.float32)
+
+
+async def embed_chunk_texts(texts: list[str]) -> list:
+    """
+    Считает векторы пачки чанков для сохранения вместе с ними (stream_and_save_chunks).
+
+    Ошибка модели не прерывает загрузку файла: векторы таких чанков будут
+    досчитаны при первом поиске по документам пользователя.
+
+    Returns:
+        list[bytes | None]: Векторы float16 в порядке текстов.
+    """
+    try:
+        vectors = await embed_texts(texts)
+    except Exception as ex:
+        logger.error(f"Не удалось посчитать векторы чанков: {ex}")
+        return [None] * len(texts)
+    return [vector_to_bytes(vector) for vector in vectors]
+
+
+class UserEmbeddingIndex:
+    """
+    Векторы всех чанков пользователя одной матрицей для поиска по косинусной близости.
+    """
+
+    def __init__(self, chunk_ids: np.ndarray, file_ids: np.ndarray, matrix: np.ndarray):
+        self.chunk_ids = chunk_ids
+        self.file_ids = file_ids
+        self.matrix = matrix
+
+    def search(self, query_vector: np.ndarray, top_k: int, file_ids: list[str] = None) -> list[tuple[int, float]]:
+        """
+        Возвращает top_k самых близких к запросу чанков.
+
+        Args:
+            query_vector (np.ndarray): Нормированный вектор запроса.
+            top_k (int): Количество результатов.
+            file_ids (list[str], optional): Искать только среди чанков этих файлов.
+
+        Returns:
+            list[tuple[int, float]]: (id чанка, косинусная близость) по убыванию близости.
+        """
+        if not len(self.chunk_ids):
+            return []
+        scores = self.matrix @ query_vector
+        if file_ids is not None:
+            scores = np.where(np.isin(self.file_ids, file_ids), scores, -np.inf)
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.chunk_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+
+async def backfill_user_embeddings(user_id: int, session: AsyncSession, batch_size: int = 256) -> int:
+    """
+    Досчитывает векторы чанков пользователя, загруженных без них.
+
+    Returns:
+        int: Количество посчитанных векторов.
+    """
+    embedded = 0
+    while True:
+        rows = await get_chunks_without_embeddings(user_id, session, limit=batch_size)
+        if not rows:
+            return embedded
+        vectors = await embed_texts([content for _, content in rows])
+        await save_chunk_embeddings(
+            {chunk_id: vector_to_bytes(vector) for (chunk_id, _), vector in zip(rows, vectors)},
+            session=session,
+        )
+        embedded += len(rows)
+
+
+async def get_user_index(user_id: int, session: AsyncSession) -> UserEmbeddingIndex:
+    """
+    Возвращает матрицу векторов чанков пользователя, при необходимости загружая её из БД.
+    """
+    if user_id in _user_indexes:
+        _user_indexes.move_to_end(user_id)
+        return _user_indexes[user_id]
+
+    embedded = await backfill_user_embeddings(user_id, session)
+    if embedded:
+        logger.info(f"Досчитано векторов чанков пользователя {user_id}: {embedded}")
+    rows = await get_user_chunk_embeddings(user_id, session)
+    dim = len(rows[0].embedding) // 2 if rows else 0
+    # Векторы другой размерности остались от прежней модели — пропускаем их
+    rows = [row for row in rows if len(row.embedding) == dim * 2]
+    index = UserEmbeddingIndex(
+        chunk_ids=np.array([row.id for row in rows], dtype=np.int64),
+        file_ids=np.array([row.file_id for row in rows], dtype=object),
+        matrix=bytes_to_matrix([row.embedding for row in rows], dim) if rows else np.zeros((0, 0), np.float32),
+    )
+    _user_indexes[user_id] = index
+    while len(_user_indexes) > EMBEDDING_CACHE_USERS:
+        _user_indexes.popitem(last=False)
+    return index
+
+
+def invalidate_user_index(user_id: int):
+    """
+    Сбрасывает матрицу векторов пользователя (после загрузки нового файла).
+    """
+    _user_indexes.pop(user_id, None)
+
+
+async def search_user_chunks(user_id: int, query: str, session: AsyncSession, top_k: int,
+                             file_ids: list[str] = None) -> list[tuple[int, float]]:
+    """
+    Ищет чанки документов пользователя, наиболее близкие по смыслу к запросу.
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        query (str): Текст запроса.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        top_k (int): Количество результатов.
+        file_ids (list[str], optional): Искать только в этих файлах.
+
+    Returns:
+        list[tuple[int, float]]: (id чанка, косинусная близость) по убыванию близости.
+    """
+    index = await get_user_index(user_id, session)
+    if not len(index.chunk_ids):
+        return []
+    query_vector = (await embed_texts([query]))[0]
+    if query_vector.shape[0] != index.matrix.shape[1]:
+        logger.warning(f"Размерность векторов пользователя {user_id} не совпадает с моделью, индекс пересобирается")
+        invalidate_user_index(user_id)
+        return []
+    return index.search(query_vector, top_k, file_ids=file_ids)
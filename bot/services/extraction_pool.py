@@ -0,0 +1,297 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from bot.services.text_processing import extract_text_from_file, iter_file_chunk_batches, get_chars_per_token
+from config import (EXTRACTION_WORKERS, EXTRACTION_TIMEOUT_SEC, CHUNK_TOKEN_BUDGET, CHUNK_BATCH_SIZE,
+                    EXTRACTION_QUEUE_BATCHES)
+
+logger = logging.getLogger(__name__)
+
+_executor: ProcessPoolExecutor | None = None
+_manager = None
+_pids = None  # pid процесса пула по ключу задачи (словарь менеджера, заполняется в дочернем процессе)
+# Задачи по пулам и зависшие задачи пулов, выведенных из работы
+_tasks: dict[ProcessPoolExecutor, dict] = {}
+_hung: dict[ProcessPoolExecutor, set] = {}
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют потоки и event loop бота
+        _executor = ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Создан пул извлечения текста на {EXTRACTION_WORKERS} процессов")
+    return _executor
+
+
+def _get_manager():
+    global _manager, _pids
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+        _pids = _manager.dict()
+    return _manager
+
+
+def _run_reporting_pid(pids, key: str, func, *args):
+    """
+    Выполняется в процессе пула: сообщает pid процесса, чтобы зависшую задачу можно было остановить.
+    """
+    pids[key] = os.getpid()
+    return func(*args)
+
+
+async def _submit(func, *args) -> tuple[ProcessPoolExecutor, str, asyncio.Future]:
+    """
+    Отправляет задачу в пул и запоминает её, чтобы пул, выведенный из работы, был остановлен
+    только после завершения всех его задач.
+
+    Returns:
+        tuple: Пул, ключ задачи и future с её результатом.
+    """
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, _get_manager)
+    executor = _get_executor()
+    key = uuid.uuid4().hex
+    future = executor.submit(_run_reporting_pid, _pids, key, func, *args)
+    _tasks.setdefault(executor, {})[key] = future
+
+    def on_done(_):
+        # Вызывается в служебном потоке пула
+        try:
+            loop.call_soon_threadsafe(_task_done, executor, key)
+        except RuntimeError:
+            pass  # event loop уже закрыт
+
+    future.add_done_callback(on_done)
+    return executor, key, asyncio.wrap_future(future)
+
+
+def _task_done(executor: ProcessPoolExecutor, key: str):
+    tasks = _tasks.get(executor)
+    if tasks is None or tasks.pop(key, None) is None:
+        return
+    if _pids is not None:
+        _pids.pop(key, None)
+    _stop_retired(executor)
+
+
+def _retire_executor(executor: ProcessPoolExecutor, hung_key: str):
+    """
+    Выводит из работы пул с зависшей задачей: новые задачи идут в новый пул, а прежний
+    останавливается (вместе с зависшим процессом), когда завершатся остальные его задачи, —
+    разбор чужих файлов, выполнявшийся в том же пуле, не прерывается.
+    """
+    global _executor
+    if _executor is executor:
+        _executor = None
+    _hung.setdefault(executor, set()).add(hung_key)
+    _stop_retired(executor)
+
+
+def _stop_retired(executor: ProcessPoolExecutor, force: bool = False):
+    hung = _hung.get(executor)
+    if hung is None or (not force and any(key not in hung for key in _tasks.get(executor, {}))):
+        return
+    del _hung[executor]
+    _tasks.pop(executor, None)
+    executor.shutdown(wait=False, cancel_futures=True)
+    for key in hung:
+        pid = _pids.pop(key, None) if _pids is not None else None
+        if pid is None:
+            continue
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    logger.info(f"Остановлен прежний пул извлечения текста (зависших задач: {len(hung)})")
+
+
+def _discard_broken_executor(executor: ProcessPoolExecutor):
+    """
+    Убирает пул, сломанный аварийным завершением процесса: все его задачи уже завершились с ошибкой.
+    """
+    global _executor
+    if _executor is executor:
+        _executor = None
+    _tasks.pop(executor, None)
+    _hung.pop(executor, None)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def extract_text_async(filename: str, timeout: float = EXTRACTION_TIMEOUT_SEC, retry_broken: bool = True) -> str:
+    """
+    Извлекает текст из файла в отдельном процессе, не блокируя event loop бота.
+
+    Разбор PDF, DOCX и XLSX выполняется в пуле процессов. Если разбор не уложился
+    в timeout, новые задачи направляются в новый пул, а прежний с зависшим процессом
+    останавливается после завершения остальных своих задач. Если пул сломан
+    падением другого процесса (например, парсер упал на битом файле), задача один раз
+    повторяется на новом пуле — так падение одного файла не затрагивает остальные.
+
+    Args:
+        filename (str): Путь к файлу.
+        timeout (float): Максимальное время разбора в секундах.
+        retry_broken (bool): Повторить ли задачу, если пул оказался сломан.
+
+    Returns:
+        str: Извлечённый текст либо сообщение об ошибке (как extract_text_from_file).
+
+    Raises:
+        RuntimeError: Превышено время разбора или процесс разбора аварийно завершился.
+    """
+    executor = key = None
+    try:
+        executor, key, future = await _submit(extract_text_from_file, filename)
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Извлечение текста из {filename} не уложилось в {timeout:.0f} с, пул перезапускается")
+        _retire_executor(executor, key)
+        raise RuntimeError(f"Превышено время обработки файла ({timeout:.0f} с)")
+    except BrokenProcessPool:
+        if executor is None:
+            # Пул сломался до отправки задачи
+            executor = _get_executor()
+        _discard_broken_executor(executor)
+        if retry_broken:
+            logger.warning(f"Пул извлечения текста сломан, повтор обработки {filename}")
+            return await extract_text_async(filename, timeout, retry_broken=False)
+        logger.error(f"Процесс извлечения текста из {filename} аварийно завершился")
+        raise RuntimeError("Процесс обработки файла аварийно завершился")
+
+
+def _produce_chunk_batches(filename: str, max_tokens: int, chars_per_token: float, batch_size: int,
+                           batches_queue, cancel_event, skip: int = 0) -> int:
+    """
+    Выполняется в процессе пула: извлекает текст, режет на чанки и кладёт пачки в очередь.
+
+    Очередь ограничена по размеру, поэтому процесс ждёт, пока основной процесс
+    сохранит предыдущие пачки в БД, и память остаётся ограниченной.
+    Первые skip чанков пропускаются (они уже получены до повтора на новом пуле).
+    В конце всегда кладётся None — признак окончания потока.
+    """
+    produced = 0
+    try:
+        for batch in iter_file_chunk_batches(filename, max_tokens, chars_per_token, batch_size):
+            if skip:
+                dropped = min(skip, len(batch))
+                batch, skip = batch[dropped:], skip - dropped
+                if not batch:
+                    continue
+            while True:
+                try:
+                    batches_queue.put(batch, timeout=1)
+                    break
+                except queue.Full:
+                    if cancel_event.is_set():
+                        return produced
+            produced += len(batch)
+        return produced
+    finally:
+        try:
+            batches_queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+
+
+async def stream_chunk_batches(filename: str, max_tokens: int = CHUNK_TOKEN_BUDGET,
+                               batch_size: int = CHUNK_BATCH_SIZE, idle_timeout: float = EXTRACTION_TIMEOUT_SEC):
+    """
+    Потоково извлекает текст файла и отдаёт чанки пачками по мере разбора.
+
+    Извлечение и разбиение на чанки идут в процессе пула, а пачки передаются через
+    ограниченную очередь, поэтому сохранение первых чанков начинается до окончания
+    разбора документа, а в памяти одновременно находится не больше EXTRACTION_QUEUE_BATCHES пачек.
+
+    Если пул сломан падением другого процесса, разбор один раз повторяется на новом пуле
+    (как в extract_text_async); уже отданные чанки при повторе пропускаются.
+
+    Args:
+        filename (str): Путь к файлу.
+        max_tokens (int): Максимальный размер чанка в токенах.
+        batch_size (int): Размер пачки чанков.
+        idle_timeout (float): Максимальное время ожидания очередной пачки в секундах.
+
+    Yields:
+        list[str]: Пачка чанков.
+
+    Raises:
+        RuntimeError: Превышено время ожидания или процесс разбора аварийно завершился.
+    """
+    yielded = 0
+    for retry_broken in (True, False):
+        try:
+            async for batch in _stream_chunk_batches_once(filename, max_tokens, batch_size, idle_timeout, yielded):
+                yielded += len(batch)
+                yield batch
+            return
+        except BrokenProcessPool:
+            if retry_broken:
+                logger.warning(f"Пул извлечения текста сломан, повтор разбора {filename} с чанка {yielded + 1}")
+                continue
+            logger.error(f"Процесс извлечения текста из {filename} аварийно завершился")
+            raise RuntimeError("Процесс обработки файла аварийно завершился")
+
+
+async def _stream_chunk_batches_once(filename: str, max_tokens: int, batch_size: int, idle_timeout: float, skip: int):
+    loop = asyncio.get_running_loop()
+    manager = await loop.run_in_executor(None, _get_manager)
+    batches_queue = manager.Queue(maxsize=EXTRACTION_QUEUE_BATCHES)
+    cancel_event = manager.Event()
+    executor = None
+    try:
+        executor, key, future = await _submit(
+            _produce_chunk_batches, filename, max_tokens, get_chars_per_token(), batch_size, batches_queue,
+            cancel_event, skip
+        )
+        waited = 0.0
+        while True:
+            try:
+                batch = await loop.run_in_executor(None, batches_queue.get, True, 1.0)
+            except queue.Empty:
+                waited += 1.0
+                if future.done() and future.exception() is not None:
+                    break
+                if waited >= idle_timeout:
+                    logger.error(f"Разбор {filename} не выдал данных за {idle_timeout:.0f} с, пул перезапускается")
+                    _retire_executor(executor, key)
+                    raise RuntimeError(f"Превышено время обработки файла ({idle_timeout:.0f} с)")
+                continue
+            if batch is None:
+                break
+            waited = 0.0
+            yield batch
+        await future
+    except BrokenProcessPool:
+        _discard_broken_executor(executor if executor is not None else _get_executor())
+        raise
+    finally:
+        cancel_event.set()
+
+
+def shutdown_extraction_pool():
+    """
+    Останавливает пул извлечения текста. Вызывается при остановке бота.
+    """
+    global _executor, _manager, _pids
+    for executor in list(_hung):
+        # При остановке бота прежние пулы не ждут остальных задач
+        _stop_retired(executor, force=True)
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        logger.info("Пул извлечения текста остановлен")
+    _tasks.clear()
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+        _pids = None
@@ -1,3 +1,5 @@
+import asyncio
+import hashlib
 from aiogram.fsm.context import FSMContext
 from config import YANDEX_CLIENT_ID
 from bot.states import DownloadStates, SearchStates
@@ -5,12 +7,19 @@ from sqlalchemy.ext.asyncio import AsyncSession
 import os
 import logging
 from types import SimpleNamespace
-from external_services.ai_yandex_gpt import yandex_gpt_request
+from external_services.ai_yandex_gpt import yandex_gpt_request, yandex_gpt_stream
+from external_services.model_routing import ROUTE_REDUCE, ROUTE_FINAL, route_options
 
-from database.db_services import file_save, split_and_save_chunks
+from database.db_services import (file_save, stream_and_save_chunks, get_file_content, copy_file_chunks,
+                                  register_file_content, get_user_file_by_title, start_file_revision,
+                                  carry_over_chunk_answers)
 
-from bot.services.text_processing import extract_text_from_file
-from config import ALLOWED_EXTENSIONS, MAX_FILE_SIZE_MB
+from bot.services.text_processing import estimate_tokens, is_anchor_block
+from bot.services.extraction_pool import extract_text_async, stream_chunk_batches
+from bot.services.embeddings import embed_chunk_texts, invalidate_user_index
+from bot.services.bm25_index import update_user_bm25_index
+from config import (ALLOWED_EXTENSIONS, MAX_FILE_SIZE_MB, REDUCE_GROUP_TOKEN_BUDGET, SUMMARY_CONCURRENCY,
+                    SUMMARY_ANCHOR_EVERY, EMBEDDINGS_ENABLED)
 
 logger = logging.getLogger(__name__)
 
@@ -79,7 +88,7 @@ async def process_and_save_file_from_disk(
             raise RuntimeError("Ошибка при сохранении файла в базе данных")
 
         # Извлекаем текст
-        text = extract_text_from_file(local_file_path)
+        text = await extract_text_async(local_file_path)
         if not text or text == "Формат файла не поддерживается.":
             raise RuntimeError("Не удалось извлечь текст из файла")
 
@@ -105,6 +114,17 @@ async def process_and_save_file_from_disk(
         )
 
 
+def file_sha256(path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Считает sha256 содержимого файла, читая его блоками (без загрузки целиком в память).
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 async def process_and_save_file(
         user_id: int,
         filename: str,
@@ -120,7 +140,10 @@ async def process_and_save_file(
 
     - Проверяет расширение и размер файла.
     - Сохраняет информацию о файле в базе данных.
-    - Извлекает и индексирует текст.
+    - Извлекает и индексирует текст; если такое же содержимое (по sha256) уже разбиралось,
+      копирует готовые чанки без повторного извлечения.
+    - Изменённый документ с уже загруженным названием сохраняет как новую ревизию того же файла:
+      ответы AI по неизменённым чанкам переносятся, анализироваться будут только изменённые.
     - Удаляет локальный файл после обработки.
     - Откатывает изменения при ошибках.
 
@@ -148,38 +171,88 @@ async def process_and_save_file(
                 f"⚠️ Файл большой ({file_size_mb:.2f} МБ). Обработка может занять время."
             )
 
+        content_hash = await asyncio.to_thread(file_sha256, local_file_path)
+
         doc_obj = SimpleNamespace(
             file_id=file_id or f"file_{user_id}_{filename}",
             file_name=filename
         )
 
-        user_file_obj = await file_save(user_id, doc_obj, remote_path, session)
-        if user_file_obj == 'already_exists':
-            await message_send_func(
-                f"⚠️ Файл с именем '{filename}' уже был загружен ранее.\n"
-                f"Вы можете воспользоваться уже загруженным файлом."
-            )
-            try:
-                os.remove(local_file_path)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить локальный файл {local_file_path}: {e}")
-            return
-        elif user_file_obj is None:
-            raise RuntimeError("Ошибка при сохранении файла в базе данных")
-
-        # Извлекаем текст
-        text = extract_text_from_file(local_file_path)
-        if not text or text == "Формат файла не поддерживается.":
-            raise RuntimeError("Не удалось извлечь текст из файла")
-
-        # Разбиваем и сохраняем чанки:
-        await split_and_save_chunks(user_file_obj, text, session)
+        # Изменённый документ с тем же названием загружается как новая ревизия существующего файла
+        previous_file = await get_user_file_by_title(user_id, filename, session)
+        if previous_file is not None and previous_file.content_hash != content_hash:
+            user_file_obj = previous_file
+        else:
+            # Запись файла фиксируется вместе с чанками одной транзакцией
+            user_file_obj = await file_save(user_id, doc_obj, remote_path, session, commit=False,
+                                            content_hash=content_hash)
+            if user_file_obj == 'already_exists':
+                await message_send_func(
+                    f"⚠️ Файл с именем '{filename}' или с таким же содержимым уже был загружен ранее.\n"
+                    f"Вы можете воспользоваться уже загруженным файлом."
+                )
+                try:
+                    os.remove(local_file_path)
+                except Exception as e:
+                    logger.warning(f"Не удалось удалить локальный файл {local_file_path}: {e}")
+                return
+            elif user_file_obj is None:
+                raise RuntimeError("Ошибка при сохранении файла в базе данных")
+
+        previous_chunks = None
+        carried_over = 0
+        try:
+            if user_file_obj is previous_file:
+                previous_chunks = await start_file_revision(user_file_obj, remote_path, content_hash, session)
+            known_content = await get_file_content(content_hash, session)
+            chunks_count = 0
+            if known_content is not None:
+                # Такой документ уже разбирался (у этого или другого пользователя) — копируем его чанки
+                chunks_count = await copy_file_chunks(known_content.source_file_id, user_file_obj.file_id, session)
+                logger.info(f"Файл {filename}: скопировано {chunks_count} чанков уже разобранного документа")
+            streamed = not chunks_count
+            if streamed:
+                # Потоково извлекаем текст, разбиваем на чанки и сохраняем их пачками вместе с векторами
+                chunks_count = await stream_and_save_chunks(
+                    user_file_obj, stream_chunk_batches(local_file_path), session,
+                    embed_func=embed_chunk_texts if EMBEDDINGS_ENABLED else None, commit=False,
+                )
+                if not chunks_count:
+                    raise RuntimeError("Не удалось извлечь текст из файла")
+            if previous_chunks is not None:
+                # Неизменённые чанки новой ревизии сразу получают ответы AI предыдущей
+                carried_over, chunks_count = await carry_over_chunk_answers(
+                    user_file_obj.file_id, previous_chunks, session
+                )
+                logger.info(
+                    f"Файл {filename}: ревизия {user_file_obj.revision}, перенесено ответов AI "
+                    f"{carried_over} из {chunks_count} чанков"
+                )
+            await session.commit()
+            if streamed:
+                try:
+                    await register_file_content(content_hash, file_size, user_file_obj.file_id, chunks_count, session)
+                except Exception as ex:
+                    logger.warning(f"Не удалось добавить файл {filename} в хранилище содержимого: {ex}")
+                    await session.rollback()
+        except Exception:
+            await session.rollback()
+            raise
+        invalidate_user_index(user_id)
+        await update_user_bm25_index(user_id, user_file_obj.file_id, session)
 
         try:
             os.remove(local_file_path)
         except Exception as e:
             logger.warning(f"Не удалось удалить локальный файл {local_file_path}: {e}")
 
+        if previous_chunks is not None:
+            await message_send_func(
+                f"🔄 Файл '{filename}' обновлён (ревизия {user_file_obj.revision}). Готовые результаты анализа "
+                f"перенесены для {carried_over} из {chunks_count} неизменённых блоков — при анализе в AI будут "
+                f"отправлены только новые и изменённые блоки."
+            )
+            return
         await message_send_func(
             f"✅ Файл '{filename}' готов для анализа системой. После загрузки всех файлов нажмите Начать анализ документов"
         )
@@ -199,7 +272,7 @@ async def process_and_save_file(
 CHUNKS_PER_STEP = 10  # Кол-во чанков для одного промежуточного резюме
 
 
-async def summarize_in_steps(ai_answers: list, prompt_text: str, session: AsyncSession):
+async def summarize_in_steps(ai_answers: list, prompt_text: str, session: AsyncSession, user_id: int = None):
     summaries = []
     # Разбиваем список ответов на группы по CHUNKS_PER_STEP
     for i in range(0, len(ai_answers), CHUNKS_PER_STEP):
@@ -219,9 +292,8 @@ async def summarize_in_steps(ai_answers: list, prompt_text: str, session: AsyncS
         try:
             response = await yandex_gpt_request(
                 messages=messages,
-                model="yandexgpt-lite",
-                temperature=0.1,
-                max_tokens=1500,  # Можно уменьшить, чтобы вместить результат
+                **route_options(ROUTE_REDUCE, messages),
+                user_id=user_id,
             )
             intermediate_summary = response["result"]["alternatives"][0]["message"]["text"]
             summaries.append(intermediate_summary)
@@ -244,9 +316,8 @@ async def summarize_in_steps(ai_answers: list, prompt_text: str, session: AsyncS
         try:
             response = await yandex_gpt_request(
                 messages=messages,
-                model="yandexgpt-lite",
-                temperature=0.1,
-                max_tokens=2000,
+                **route_options(ROUTE_FINAL, messages),
+                user_id=user_id,
             )
             final_summary = response["result"]["alternatives"][0]["message"]["text"]
         except Exception as ex:
@@ -258,79 +329,130 @@ async def summarize_in_steps(ai_answers: list, prompt_text: str, session: AsyncS
     return final_summary
 
 
+SUMMARY_PROMPT = "Пожалуйста, сделай краткое резюмирование следующих частей документа:\n\n"
+FINAL_REPORT_PROMPT = "Пожалуйста, на основе ниже приведённых кратких резюме сделай общий итоговый экспертный отчёт:\n\n"
+
+
+def group_texts_by_tokens(texts: list, token_budget: int, max_group_size: int,
+                          anchor_every: int = SUMMARY_ANCHOR_EVERY) -> list[list[str]]:
+    """
+    Делит тексты на последовательные группы, каждая из которых помещается в бюджет токенов.
+
+    Размер группы (fan-in) определяется объёмом текстов, а не фиксированным числом:
+    короткие ответы объединяются большими группами, длинные — маленькими.
+    В группе всегда не меньше двух текстов (если они есть), чтобы каждый уровень
+    дерева гарантированно уменьшал число текстов.
+
+    Группа, набравшая хотя бы половину max_group_size, также закрывается после текста-якоря
+    (is_anchor_block): после правки одной части документа остальные группы совпадают с прежними,
+    их запросы берутся из кэша ответов, и перестраиваются только затронутые ветви дерева.
+
+    Args:
+        texts (list[str]): Тексты одного уровня.
+        token_budget (int): Максимальный объём группы в токенах.
+        max_group_size (int): Максимальное число текстов в группе.
+        anchor_every (int): Средний шаг текстов-якорей; 0 — только границы по бюджету.
+
+    Returns:
+        list[list[str]]: Группы текстов.
+    """
+    groups = []
+    curr_group = []
+    curr_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        fits = curr_tokens + tokens <= token_budget and len(curr_group) < max_group_size
+        if curr_group and not fits and len(curr_group) >= 2:
+            groups.append(curr_group)
+            curr_group = []
+            curr_tokens = 0
+        curr_group.append(text)
+        curr_tokens += tokens
+        if len(curr_group) >= max(2, max_group_size // 2) and is_anchor_block(text, anchor_every):
+            groups.append(curr_group)
+            curr_group = []
+            curr_tokens = 0
+    if curr_group:
+        groups.append(curr_group)
+    return groups
+
+
+async def _summarize_texts(texts: list, prompt_text: str, instruction: str, route: str,
+                           stream_consumer=None, user_id: int = None) -> str:
+    combined_text = "\n---\n".join(texts)
+    messages = [
+        {"role": "system", "text": prompt_text},
+        {"role": "user", "text": instruction + combined_text},
+    ]
+    options = route_options(route, messages)
+    if stream_consumer is not None:
+        alternatives = yandex_gpt_stream(messages=messages, **options, user_id=user_id)
+        return await stream_consumer(alternatives)
+    response = await yandex_gpt_request(messages=messages, **options, user_id=user_id)
+    return response["result"]["alternatives"][0]["message"]["text"]
+
+
 async def summarize_recursive(ai_texts: list, prompt_text: str, session: AsyncSession,
                               max_group_size: int = 10,
-                              max_final_groups: int = 20) -> str:
+                              max_final_groups: int = 20,
+                              token_budget: int = REDUCE_GROUP_TOKEN_BUDGET,
+                              concurrency: int = SUMMARY_CONCURRENCY,
+                              on_final_stream=None,
+                              user_id: int = None) -> str:
     """
-    Многоступенчатое резюмирование
+    Многоступенчатое резюмирование (параллельная редукция деревом)
     ai_texts       — список текстов для резюмирования (ответы или промежуточные сводки)
     prompt_text    — системный промт, который даётся в system-сообщении
     max_group_size — максимальное число текстов на одном промежуточном резюме
     max_final_groups — максимальное допустимое количество групп для финального объединения
+    token_budget   — максимальный объём входа одного запроса в токенах, по нему выбирается размер групп
+    concurrency    — сколько резюме одного уровня выполняется одновременно
+    on_final_stream — async-функция, получающая поток альтернатив финального шага (yandex_gpt_stream)
+                      и возвращающая итоговый текст; позволяет показывать отчёт по мере генерации
+    user_id        — пользователь, для которого строится отчёт (очередь планировщика запросов)
+
+    Все группы одного уровня резюмируются параллельно, поэтому время работы
+    пропорционально глубине дерева, а не числу узлов. Промежуточные резюме выполняются
+    моделью маршрута reduce, итоговый отчёт — моделью маршрута final (model_routing).
 
     Возвращает итоговое сводное резюме.
     """
-
-    # Если текстов мало или нет, просто объединяем и возвращаем
     if not ai_texts:
         return ""
-    if len(ai_texts) <= max_group_size:
-        # Формируем запрос на резюмирование одного уровня
-        combined_text = "\n---\n".join(ai_texts)
-        user_prompt = (
-                "Пожалуйста, сделай краткое резюмирование следующих частей документа:\n\n"
-                + combined_text
-        )
-        messages = [
-            {"role": "system", "text": prompt_text},
-            {"role": "user", "text": user_prompt},
-        ]
-        try:
-            response = await yandex_gpt_request(
-                messages=messages,
-                model="yandexgpt-lite",
-                temperature=0.1,
-                max_tokens=1500,
-            )
-            summary = response["result"]["alternatives"][0]["message"]["text"]
-            return summary
-        except Exception as ex:
-            # Логируем ошибку и возвращаем частичное резюме/пустой результат
-            logger.error(f"Ошибка при промежуточном резюмировании: {ex}")
-            return ""
 
-    # Разбиваем список текстов на группы max_group_size
-    grouped_summaries = []
-    for i in range(0, len(ai_texts), max_group_size):
-        group_texts = ai_texts[i:i + max_group_size]
-        summary = await summarize_recursive(group_texts, prompt_text, max_group_size, max_final_groups, session)
-        if summary:
-            grouped_summaries.append(summary)
-
-    # Если на этом уровне число групп не превышает max_final_groups, то объединяем их
-    if len(grouped_summaries) <= max_final_groups:
-        combined_text = "\n---\n".join(grouped_summaries)
-        user_prompt = (
-                "Пожалуйста, на основе ниже приведённых кратких резюме сделай общий итоговый экспертный отчёт:\n\n"
-                + combined_text
-        )
-        messages = [
-            {"role": "system", "text": prompt_text},
-            {"role": "user", "text": user_prompt},
-        ]
-        try:
-            response = await yandex_gpt_request(
-                messages=messages,
-                model="yandexgpt-lite",
-                temperature=0.1,
-                max_tokens=2000,
-            )
-            final_summary = response["result"]["alternatives"][0]["message"]["text"]
-            return final_summary
-        except Exception as ex:
-            logger.error(f"Ошибка при финальном резюмировании: {ex}")
-            # Возвращаем объединение всех промежуточных резюме без отправки на AI, если хотите
-            return combined_text
-    else:
-        # Если групп слишком много — повторяем резюмирование рекурсивно
-        return await summarize_recursive(grouped_summaries, prompt_text, max_group_size, max_final_groups, session)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarize_group(group: list, stream_consumer=None, route: str = ROUTE_REDUCE) -> str:
+        async with semaphore:
+            try:
+                return await _summarize_texts(group, prompt_text, SUMMARY_PROMPT, route,
+                                              stream_consumer=stream_consumer, user_id=user_id)
+            except Exception as ex:
+                # Логируем ошибку, группа пропускается
+                logger.error(f"Ошибка при промежуточном резюмировании: {ex}")
+                return ""
+
+    level_texts = list(ai_texts)
+    depth = 0
+    while True:
+        total_tokens = sum(estimate_tokens(text) for text in level_texts)
+        if depth == 0 and len(level_texts) <= max_group_size and total_tokens <= token_budget:
+            # Текстов мало — одно резюмирование без дерева, оно же итоговый отчёт
+            return await summarize_group(level_texts, stream_consumer=on_final_stream, route=ROUTE_FINAL)
+        fits_final = len(level_texts) <= max_final_groups and total_tokens <= token_budget
+        if depth > 0 and (fits_final or len(level_texts) == 1):
+            try:
+                return await _summarize_texts(level_texts, prompt_text, FINAL_REPORT_PROMPT, ROUTE_FINAL,
+                                              stream_consumer=on_final_stream, user_id=user_id)
+            except Exception as ex:
+                logger.error(f"Ошибка при финальном резюмировании: {ex}")
+                # Возвращаем объединение всех промежуточных резюме без отправки на AI
+                return "\n---\n".join(level_texts)
+
+        groups = group_texts_by_tokens(level_texts, token_budget, max_group_size)
+        logger.info(f"Резюмирование, уровень {depth + 1}: {len(level_texts)} текстов в {len(groups)} группах")
+        summaries = await asyncio.gather(*(summarize_group(group) for group in groups))
+        level_texts = [summary for summary in summaries if summary]
+        depth += 1
+        if not level_texts:
+            return ""
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+
+import aiofiles
+
+from config import PROMPT_REMOTE_PATH, PROMPT_LOCAL_PATH, PROMPT_CACHE_TTL_SEC
+from external_services.yandex_disk import get_prompt_meta, read_prompt_from_yandex
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PromptVersion:
+    text: str
+    hash: str  # sha256 текста промта, записывается в задачу, чанки и отчёт
+    md5: str | None = None  # md5 файла на Яндекс.Диске
+
+
+_current: PromptVersion | None = None
+_checked_at = 0.0
+_refresh_lock = asyncio.Lock()
+
+
+def prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+async def _save_local_copy(text: str):
+    # Локальная копия нужна только как запасной вариант при недоступности Яндекс.Диска;
+    # пишем во временный файл и атомарно подменяем, чтобы читатели не видели половину файла
+    tmp_path = f"{PROMPT_LOCAL_PATH}.{os.getpid()}.tmp"
+    async with aiofiles.open(tmp_path, "w", encoding="utf-8") as f:
+        await f.write(text)
+    os.replace(tmp_path, PROMPT_LOCAL_PATH)
+
+
+async def _read_local_copy() -> PromptVersion | None:
+    try:
+        async with aiofiles.open(PROMPT_LOCAL_PATH, "r", encoding="utf-8") as f:
+            text = await f.read()
+    except OSError:
+        return None
+    return PromptVersion(text=text, hash=prompt_hash(text))
+
+
+async def _refresh():
+    global _current, _checked_at
+    try:
+        meta = await get_prompt_meta(PROMPT_REMOTE_PATH)
+        if meta is None:
+            raise FileNotFoundError(PROMPT_REMOTE_PATH)
+        if _current is None or meta["md5"] != _current.md5:
+            text = await read_prompt_from_yandex(PROMPT_REMOTE_PATH)
+            _current = PromptVersion(text=text, hash=prompt_hash(text), md5=meta["md5"])
+            logger.info(f"Загружена версия промта {_current.hash[:12]} (изменён {meta['modified']})")
+            try:
+                await _save_local_copy(text)
+            except OSError as ex:
+                logger.warning(f"Не удалось сохранить локальную копию промта: {ex}")
+    except Exception as ex:
+        if _current is None:
+            _current = await _read_local_copy()
+            if _current is None:
+                raise RuntimeError(f"Промт недоступен: {ex}") from ex
+            logger.warning(f"Яндекс.Диск недоступен, используется локальная копия промта: {ex}")
+        else:
+            logger.warning(f"Не удалось проверить промт на Яндекс.Диске, используется текущая версия: {ex}")
+    _checked_at = time.monotonic()
+
+
+async def get_prompt() -> PromptVersion:
+    """
+    Возвращает актуальную версию промта анализа.
+
+    Промт хранится в памяти и сверяется с метаданными файла на Яндекс.Диске (md5)
+    не чаще раза в PROMPT_CACHE_TTL_SEC секунд; содержимое скачивается только при изменении.
+    Одновременные вызовы ждут одну общую проверку. Если Яндекс.Диск недоступен,
+    используется последняя известная версия (или локальная копия после перезапуска).
+
+    Raises:
+        RuntimeError: Промт не удалось получить ни с Яндекс.Диска, ни из локальной копии.
+
+    Returns:
+        PromptVersion: Текст промта и его хэш.
+    """
+    if _current is not None and time.monotonic() - _checked_at < PROMPT_CACHE_TTL_SEC:
+        return _current
+    async with _refresh_lock:
+        if _current is None or time.monotonic() - _checked_at >= PROMPT_CACHE_TTL_SEC:
+            await _refresh()
+    return _current
@@ -0,0 +1,115 @@
+import logging
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from bot.services.bm25_index import search_user_chunks_bm25
+from bot.services.embeddings import search_user_chunks
+from bot.services.text_processing import estimate_tokens
+from config import QA_TOP_K, QA_CONTEXT_TOKEN_BUDGET
+from database.db_services import get_chunks_by_ids
+from external_services.ai_yandex_gpt import yandex_gpt_request, yandex_gpt_stream
+from external_services.llm_scheduler import LANE_INTERACTIVE
+from external_services.model_routing import ROUTE_QA, route_options
+
+logger = logging.getLogger(__name__)
+
+QA_SYSTEM_PROMPT = (
+    "Ты — помощник, который отвечает на вопросы по технической документации пользователя. "
+    "Отвечай только на основе приведённых фрагментов документов. Указывай, из какого документа "
+    "взята информация. Если во фрагментах нет ответа, прямо скажи об этом."
+)
+
+
+# Сглаживающая константа объединения рейтингов (reciprocal rank fusion)
+RRF_K = 60
+
+
+def fuse_rankings(rankings: list[list[tuple[int, float]]], top_k: int) -> list[int]:
+    """
+    Объединяет несколько рейтингов чанков методом reciprocal rank fusion:
+    чанк получает сумму 1 / (RRF_K + место) по всем рейтингам, в которых он есть.
+
+    Returns:
+        list[int]: id чанков по убыванию итоговой оценки.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1 / (RRF_K + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:top_k]
+
+
+async def retrieve_chunks(user_id: int, question: str, session: AsyncSession, file_ids: list[str] = None,
+                          top_k: int = QA_TOP_K) -> list:
+    """
+    Находит фрагменты документов пользователя, наиболее относящиеся к вопросу.
+
+    Совмещает смысловой поиск по векторам и точный поиск по терминам (BM25) — последний
+    находит номера пунктов, коды ГОСТ и названия деталей, которые плохо ловятся векторами.
+    Если смысловой поиск недоступен (не загрузилась модель), используется только BM25.
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        question (str): Вопрос пользователя.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        file_ids (list[str], optional): Искать только в этих файлах (None — во всех).
+        top_k (int): Максимальное количество фрагментов.
+
+    Returns:
+        list[tuple[FileChunk, str]]: Пары (чанк, название файла) по убыванию релевантности.
+    """
+    rankings = [await search_user_chunks_bm25(user_id, question, session, top_k=top_k * 2, file_ids=file_ids)]
+    try:
+        rankings.append(await search_user_chunks(user_id, question, session, top_k=top_k * 2, file_ids=file_ids))
+    except Exception as ex:
+        logger.error(f"Смысловой поиск по документам пользователя {user_id} недоступен: {ex}")
+    return await get_chunks_by_ids(fuse_rankings(rankings, top_k), session)
+
+
+def build_qa_messages(question: str, chunks: list, token_budget: int = QA_CONTEXT_TOKEN_BUDGET) -> list:
+    """
+    Собирает запрос к Yandex GPT: найденные фрагменты (в пределах token_budget) и вопрос.
+    """
+    fragments = []
+    used_tokens = 0
+    for chunk, title in chunks:
+        tokens = estimate_tokens(chunk.content)
+        if fragments and used_tokens + tokens > token_budget:
+            break
+        fragments.append(f"[{len(fragments) + 1}] Документ «{title}», фрагмент {chunk.chunk_index + 1}:\n{chunk.content}")
+        used_tokens += tokens
+    return [
+        {"role": "system", "text": QA_SYSTEM_PROMPT},
+        {"role": "user", "text": "Фрагменты документов:\n\n" + "\n\n".join(fragments) + f"\n\nВопрос: {question}"},
+    ]
+
+
+async def answer_question(user_id: int, question: str, session: AsyncSession, file_ids: list[str] = None,
+                          stream_consumer=None) -> str | None:
+    """
+    Отвечает на вопрос по документам пользователя одним вызовом Yandex GPT:
+    в модель отправляются только найденные релевантные фрагменты. Пользователь ждёт ответа,
+    поэтому запрос идёт в приоритетной полосе планировщика (interactive).
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        question (str): Вопрос пользователя.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        file_ids (list[str], optional): Искать только в этих файлах (None — во всех).
+        stream_consumer (Callable, optional): async-функция, получающая поток альтернатив
+            (например, deliver_streaming_text) и возвращающая итоговый текст.
+
+    Returns:
+        str | None: Ответ модели или None, если подходящих фрагментов не нашлось.
+    """
+    chunks = await retrieve_chunks(user_id, question, session, file_ids=file_ids)
+    if not chunks:
+        return None
+    logger.info(f"Вопрос пользователя {user_id}: найдено фрагментов {len(chunks)}")
+    messages = build_qa_messages(question, chunks)
+    options = route_options(ROUTE_QA, messages)
+    if stream_consumer is not None:
+        alternatives = yandex_gpt_stream(messages=messages, **options, user_id=user_id, lane=LANE_INTERACTIVE)
+        return await stream_consumer(alternatives)
+    response = await yandex_gpt_request(messages=messages, **options, user_id=user_id, lane=LANE_INTERACTIVE)
+    return response["result"]["alternatives"][0]["message"]["text"]
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from bot.bot_instance import bot
+from config import STREAM_EDIT_INTERVAL_SEC
+
+logger = logging.getLogger(__name__)
+
+TELEGRAM_TEXT_LIMIT = 3800
+
+
+def _render(header: str, text: str, final: bool) -> str:
+    body = f"{text[:TELEGRAM_TEXT_LIMIT]}{'...' if len(text) > TELEGRAM_TEXT_LIMIT else ''}"
+    return header + body + ("" if final else " ▌")
+
+
+async def _edit(chat_id: int, message_id: int, text: str) -> bool:
+    try:
+        await bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id)
+        return True
+    except TelegramRetryAfter as ex:
+        # Превышен лимит правок — пропускаем это обновление, следующее придёт позже
+        logger.warning(f"Лимит правок сообщений Telegram, пауза {ex.retry_after} с")
+        await asyncio.sleep(ex.retry_after)
+        return False
+    except TelegramBadRequest as ex:
+        if "message is not modified" in str(ex):
+            return True
+        raise
+
+
+async def _delete(chat_id: int, message_id: int):
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+    except Exception as ex:
+        logger.warning(f"Не удалось удалить недописанное сообщение {message_id}: {ex}")
+
+
+async def deliver_streaming_text(chat_id: int, alternatives, header: str = "",
+                                 min_interval: float = STREAM_EDIT_INTERVAL_SEC) -> str:
+    """
+    Доставляет потоковый ответ AI пользователю одним сообщением, которое дописывается по мере генерации.
+
+    Первое сообщение отправляется сразу после получения первой части текста,
+    далее оно редактируется не чаще одного раза в min_interval секунд, чтобы
+    не превышать лимиты Telegram на правку сообщений. Последняя правка содержит полный текст.
+    Если поток прерывается ошибкой, уже отправленное сообщение удаляется, а ошибка пробрасывается.
+
+    Args:
+        chat_id (int): Чат получателя.
+        alternatives (AsyncIterator[dict]): Поток альтернатив (yandex_gpt_stream).
+        header (str): Заголовок перед текстом ответа.
+        min_interval (float): Минимальный интервал между правками в секундах.
+
+    Returns:
+        str: Полный текст ответа.
+    """
+    message = None
+    text = ""
+    last_rendered = ""
+    last_edit = 0.0
+    try:
+        async for alternative in alternatives:
+            text = alternative["message"]["text"]
+            if not text:
+                continue
+            rendered = _render(header, text, final=False)
+            if message is None:
+                message = await bot.send_message(chat_id, rendered)
+                last_edit, last_rendered = time.monotonic(), rendered
+            elif rendered != last_rendered and time.monotonic() - last_edit >= min_interval:
+                if await _edit(chat_id, message.message_id, rendered):
+                    last_rendered = rendered
+                last_edit = time.monotonic()
+
+        final_text = _render(header, text, final=True)
+        if message is None:
+            await bot.send_message(chat_id, final_text)
+        else:
+            # Финальную правку повторяем после паузы, если упёрлись в лимит Telegram
+            while not await _edit(chat_id, message.message_id, final_text):
+                pass
+    except (Exception, asyncio.CancelledError):
+        # Вызывающий код отправит ответ другим способом — недописанное сообщение с курсором
+        # удаляем, чтобы у пользователя не осталось обрезанной копии
+        if message is not None:
+            await _delete(chat_id, message.message_id)
+        raise
+    return text
@@ -1,13 +1,93 @@
 import os
+import re
+import math
+import hashlib
+import zlib
+from collections import Counter
+from functools import lru_cache
 import fitz
 import docx
 import logging
+import numpy as np
 from nltk.tokenize import sent_tokenize
+from nltk.stem.snowball import SnowballStemmer
 import pandas as pd
 from striprtf.striprtf import rtf_to_text
 
+from config import CHUNK_TOKEN_BUDGET, CHARS_PER_TOKEN, CHUNK_ANCHOR_EVERY, CHUNK_ANCHOR_MIN_FILL
+
 logger = logging.getLogger(__name__)
 
+# Среднее число символов на токен; уточняется калибровкой по эндпоинту tokenize (token_calibration)
+_chars_per_token = CHARS_PER_TOKEN
+
+
+def _split_paragraphs(text: str):
+    for block in text.split('\n\n'):
+        block = block.strip()
+        if block:
+            yield block
+
+
+def iter_text_blocks(filename, excel_rows_per_block: int = 50):
+    """
+    Потоково извлекает текст из файла по смысловым блокам (абзацам).
+
+    Документ не собирается целиком в памяти: PDF читается постранично,
+    DOCX — по абзацам, XLSX — пачками строк (каждая пачка с заголовком таблицы).
+
+    Поддерживаемые форматы: .txt, .pdf, .docx, .rtf, .xlsx
+
+    Args:
+        filename (str): Путь к файлу.
+        excel_rows_per_block (int): Сколько строк таблицы помещать в один блок.
+
+    Yields:
+        str: Непустой блок текста.
+
+    Raises:
+        ValueError: Формат файла не поддерживается.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext == '.txt':
+        with open(filename, 'r', encoding='utf-8') as f:
+            lines = []
+            for line in f:
+                if line.strip():
+                    lines.append(line.rstrip('\n'))
+                elif lines:
+                    yield "\n".join(lines).strip()
+                    lines = []
+            if lines:
+                yield "\n".join(lines).strip()
+
+    elif ext == '.pdf':
+        with fitz.open(filename) as doc:
+            for page in doc:
+                yield from _split_paragraphs(page.get_text())
+
+    elif ext == '.docx':
+        doc = docx.Document(filename)
+        for para in doc.paragraphs:
+            if para.text.strip():
+                yield para.text.strip()
+
+    elif ext == '.xlsx':
+        xls = pd.ExcelFile(filename)
+        for sheet_name in xls.sheet_names:
+            df = pd.read_excel(xls, sheet_name=sheet_name)
+            for start in range(0, len(df), excel_rows_per_block):
+                block = df.iloc[start:start + excel_rows_per_block].to_string()
+                yield f"Лист {sheet_name}:\n{block}"
+
+    elif ext == '.rtf':
+        with open(filename, 'r', encoding='utf-8') as f:
+            yield from _split_paragraphs(rtf_to_text(f.read()))
+
+    else:
+        raise ValueError(f"Формат файла {ext} не поддерживается")
+
 
 def extract_text_from_file(filename):
     """
@@ -20,75 +100,276 @@ def extract_text_from_file(filename):
         filename (str): Путь к файлу.
 
     Returns:
-        str: Извлечённый текст из файла либо сообщение об ошибке.
+        str: Извлечённый текст из файла (блоки разделены пустой строкой) либо сообщение об ошибке.
     """
     try:
-        ext = os.path.splitext(filename)[1].lower()
-        text = ""
+        return "\n\n".join(iter_text_blocks(filename))
+    except ValueError:
+        return "Формат файла не поддерживается."
+    except Exception as ex:
+        logger.error("Error during extracting text from file: %s", str(ex))
+        return "Формат файла не поддерживается"
 
-        if ext == '.txt':
-            with open(filename, 'r', encoding='utf-8') as f:
-                text = f.read()
 
-        elif ext == '.pdf':
-            doc = fitz.open(filename)
-            for page in doc:
-                text += page.get_text()
+def estimate_tokens(text: str) -> int:
+    """
+    Оценивает количество токенов текста без обращения к API.
+
+    Используется среднее число символов на токен (CHARS_PER_TOKEN), которое можно
+    уточнить калибровкой calibrate_token_estimator.
+
+    Args:
+        text (str): Текст.
+
+    Returns:
+        int: Оценка количества токенов.
+    """
+    if not text:
+        return 0
+    return math.ceil(len(text) / _chars_per_token)
+
+
+def get_chars_per_token() -> float:
+    return _chars_per_token
 
-        elif ext == '.docx':
-            doc = docx.Document(filename)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
 
-        elif ext == '.xlsx':
-            xls = pd.ExcelFile(filename)
-            for sheet_name in xls.sheet_names:
-                df = pd.read_excel(xls, sheet_name=sheet_name)
-                text += df.to_string() + "\n"
+def set_chars_per_token(value: float):
+    global _chars_per_token
+    _chars_per_token = value
 
-        elif ext == '.rtf':
-            with open(filename, 'r', encoding='utf-8') as f:
-                text = rtf_to_text(f.read())
 
+def _split_oversized_block(block: str, max_tokens: int, count_tokens) -> list[str]:
+    """
+    Делит абзац, не помещающийся в бюджет, по предложениям, слишком длинные
+    предложения — по словам, а слова длиннее бюджета (таблицы, base64) — по символам.
+    """
+    max_chars = max(1, int(max_tokens * _chars_per_token))
+    pieces = []
+    for sent in sent_tokenize(block):
+        if count_tokens(sent) <= max_tokens:
+            pieces.append(sent)
+            continue
+        words = []
+        for word in sent.split():
+            if count_tokens(word) > max_tokens:
+                words.extend(word[i:i + max_chars] for i in range(0, len(word), max_chars))
+            else:
+                words.append(word)
+        curr = []
+        for word in words:
+            if curr and count_tokens(" ".join(curr + [word])) > max_tokens:
+                pieces.append(" ".join(curr))
+                curr = []
+            curr.append(word)
+        if curr:
+            pieces.append(" ".join(curr))
+
+    parts = []
+    curr_part = ""
+    for piece in pieces:
+        candidate = f"{curr_part} {piece}" if curr_part else piece
+        if curr_part and count_tokens(candidate) > max_tokens:
+            parts.append(curr_part)
+            curr_part = piece
         else:
-            text = "Формат файла не поддерживается."
+            curr_part = candidate
+    if curr_part:
+        parts.append(curr_part)
+    return parts
 
-        return text
 
-    except Exception as ex:
-        logger.error("Error during extracting text from file: %s", str(ex))
-        return "Формат файла не поддерживается"
+def is_anchor_block(text: str, every: int) -> bool:
+    """
+    Проверяет, является ли блок «якорем» — границей, зависящей только от его содержимого
+    (в среднем каждый every-й блок). Используется crc32, а не hash(): результат должен
+    совпадать во всех процессах и между запусками.
+    """
+    return every > 0 and zlib.crc32(text.encode("utf-8")) % every == 0
+
+
+def iter_token_chunks(blocks, max_tokens: int = CHUNK_TOKEN_BUDGET, count_tokens=None,
+                      anchor_every: int = CHUNK_ANCHOR_EVERY):
+    """
+    Инкрементально упаковывает поток текстовых блоков в чанки по бюджету токенов.
+
+    Соседние блоки объединяются в один чанк, пока он помещается в max_tokens,
+    поэтому короткие абзацы больше не порождают отдельные запросы к AI.
+    Границы блоков сохраняются; блоки больше бюджета делятся по предложениям.
+    Чанк отдаётся сразу, как только следующий блок в него не помещается,
+    поэтому в памяти держится не больше одного чанка.
 
+    Чанк, заполненный хотя бы на CHUNK_ANCHOR_MIN_FILL, также завершается после блока-якоря
+    (is_anchor_block). Такие границы не зависят от предшествующего текста, поэтому после правки
+    в новой ревизии документа разбиение быстро совпадает с прежним и меняются только чанки
+    рядом с правкой.
 
-def split_text_into_semantic_chunks(text: str, max_chunk_size: int = 1500) -> list[str]:
+    Args:
+        blocks (Iterable[str]): Поток блоков текста (абзацев).
+        max_tokens (int): Максимальный размер чанка в токенах.
+        count_tokens (Callable, optional): Функция подсчёта токенов, по умолчанию estimate_tokens.
+        anchor_every (int): Средний шаг блоков-якорей; 0 — только границы по бюджету.
+
+    Yields:
+        str: Текстовый блок-чанк.
+    """
+    count_tokens = count_tokens or estimate_tokens
+    curr_blocks = []
+    curr_tokens = 0
+    separator_tokens = count_tokens("\n\n")
+
+    for block in blocks:
+        block_tokens = count_tokens(block)
+        if block_tokens > max_tokens:
+            if curr_blocks:
+                yield "\n\n".join(curr_blocks)
+                curr_blocks, curr_tokens = [], 0
+            yield from _split_oversized_block(block, max_tokens, count_tokens)
+            continue
+        extra = block_tokens + (separator_tokens if curr_blocks else 0)
+        if curr_blocks and curr_tokens + extra > max_tokens:
+            yield "\n\n".join(curr_blocks)
+            curr_blocks, curr_tokens = [], 0
+            extra = block_tokens
+        curr_blocks.append(block)
+        curr_tokens += extra
+        if curr_tokens >= max_tokens * CHUNK_ANCHOR_MIN_FILL and is_anchor_block(block, anchor_every):
+            yield "\n\n".join(curr_blocks)
+            curr_blocks, curr_tokens = [], 0
+    if curr_blocks:
+        yield "\n\n".join(curr_blocks)
+
+
+def iter_file_chunk_batches(filename: str, max_tokens: int, chars_per_token: float, batch_size: int):
+    """
+    Конвейер извлечение → разбиение: отдаёт чанки файла пачками по batch_size.
+
+    Выполняется в процессе пула извлечения, поэтому отношение символов к токенам
+    передаётся явно (калибровка выполняется в основном процессе).
+
+    Args:
+        filename (str): Путь к файлу.
+        max_tokens (int): Максимальный размер чанка в токенах.
+        chars_per_token (float): Среднее число символов на токен.
+        batch_size (int): Размер пачки чанков.
+
+    Yields:
+        list[str]: Пачка чанков.
+    """
+    set_chars_per_token(chars_per_token)
+    batch = []
+    for chunk in iter_token_chunks(iter_text_blocks(filename), max_tokens):
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Слова, числа и составные обозначения (пункты 4.2.1, коды ГОСТ 12.1.004-91, артикулы)
+_TERM_RE = re.compile(r"[0-9a-zа-я]+(?:[./\-][0-9a-zа-я]+)*")
+_TERM_SEPARATORS_RE = re.compile(r"[./\-]")
+_russian_stemmer = SnowballStemmer("russian")
+_english_stemmer = SnowballStemmer("english")
+
+
+@lru_cache(maxsize=200_000)
+def _stem(word: str) -> str:
+    if word.isdigit():
+        return word
+    if re.search("[а-я]", word):
+        return _russian_stemmer.stem(word)
+    return _english_stemmer.stem(word)
+
+
+def analyze_terms(text: str) -> list[str]:
     """
-    Разбивает текст на смысловые чанки, стараясь сохранять логические части: сначала по абзацам, потом по предложениям.
+    Разбивает текст на нормализованные термины для полнотекстового поиска.
+
+    Слова приводятся к нижнему регистру и основе (стеммер Snowball для русского и английского),
+    числа не меняются. Составные обозначения вида «4.2.1» или «12.1.004-91» сохраняются целиком,
+    а их буквенные части дополнительно индексируются как отдельные слова.
 
     Args:
         text (str): Исходный текст.
-        max_chunk_size (int): Максимальная длина блока в символах.
 
     Returns:
-        list[str]: Список текстовых блоков.
+        list[str]: Термины в порядке появления.
     """
-    # 1. Сначала делим по двойному переносу строк (большие логические блоки)
-    blocks = [b.strip() for b in text.split('\n\n') if b.strip()]
-    chunks = []
-    for block in blocks:
-        # Если блок меньше лимита — добавляем целиком
-        if len(block) <= max_chunk_size:
-            chunks.append(block)
-        else:
-            # Если больше лимита — делим по предложениям
-            sentences = sent_tokenize(block)
-            curr_chunk = ""
-            for sent in sentences:
-                if len(curr_chunk) + len(sent) + 1 <= max_chunk_size:
-                    curr_chunk += (" " if curr_chunk else "") + sent
-                else:
-                    if curr_chunk:
-                        chunks.append(curr_chunk.strip())
-                    curr_chunk = sent
-            if curr_chunk:
-                chunks.append(curr_chunk.strip())
-    return chunks
+    terms = []
+    for token in _TERM_RE.findall(text.lower().replace("ё", "е")):
+        parts = _TERM_SEPARATORS_RE.split(token)
+        if len(parts) == 1:
+            terms.append(_stem(token))
+            continue
+        terms.append(token)
+        terms.extend(_stem(part) for part in parts if len(part) > 1 and not part.isdigit())
+    return terms
+
+
+def term_frequencies(text: str) -> dict[str, int]:
+    """
+    Возвращает частоты терминов текста (analyze_terms) для BM25-индекса.
+    """
+    return dict(Counter(analyze_terms(text)))
+
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 4
+_SIMHASH_BAND_BITS = SIMHASH_BITS // SIMHASH_BANDS
+
+
+def simhash(terms: list[str]) -> int:
+    """
+    Считает 64-битную сигнатуру SimHash текста по его терминам (analyze_terms) и парам соседних терминов.
+
+    У почти одинаковых текстов (повторяющиеся шапки, дисклеймеры, оглавления) сигнатуры
+    отличаются в нескольких битах.
+
+    Returns:
+        int: Сигнатура как знаковое 64-битное число (для столбца BIGINT).
+    """
+    features = Counter(terms)
+    features.update(f"{first} {second}" for first, second in zip(terms, terms[1:]))
+    if not features:
+        return 0
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+         for feature in features),
+        dtype=np.uint64, count=len(features),
+    )
+    weights = np.fromiter(features.values(), dtype=np.float64, count=len(features))
+    bits = (hashes[:, None] >> np.arange(SIMHASH_BITS, dtype=np.uint64)) & np.uint64(1)
+    votes = weights @ np.where(bits == 1, 1.0, -1.0)
+    signature = sum(1 << bit for bit in range(SIMHASH_BITS) if votes[bit] > 0)
+    return signature - (1 << SIMHASH_BITS) if signature >= 1 << (SIMHASH_BITS - 1) else signature
+
+
+def simhash_bands(signature: int) -> list[int]:
+    """
+    Делит сигнатуру на SIMHASH_BANDS полос по 16 бит для LSH-поиска. Номер полосы входит
+    в значение, поэтому полосы можно хранить одним массивом. Сигнатуры с расстоянием Хэмминга
+    меньше SIMHASH_BANDS обязательно совпадают хотя бы в одной полосе.
+    """
+    unsigned = signature & ((1 << SIMHASH_BITS) - 1)
+    mask = (1 << _SIMHASH_BAND_BITS) - 1
+    return [
+        (band << _SIMHASH_BAND_BITS) | ((unsigned >> (band * _SIMHASH_BAND_BITS)) & mask)
+        for band in range(SIMHASH_BANDS)
+    ]
+
+
+def hamming_distance(first: int, second: int) -> int:
+    return bin((first ^ second) & ((1 << SIMHASH_BITS) - 1)).count("1")
+
+
+def chunk_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_search_features(text: str) -> tuple[dict[str, int], int]:
+    """
+    Считает признаки чанка, сохраняемые вместе с ним: частоты терминов для BM25 и сигнатуру SimHash.
+    """
+    terms = analyze_terms(text)
+    return dict(Counter(terms)), simhash(terms)
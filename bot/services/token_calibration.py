@@ -0,0 +1,35 @@
+import logging
+
+from bot.services.text_processing import get_chars_per_token, set_chars_per_token
+from config import TOKENIZE_CALIBRATION
+from external_services.ai_yandex_gpt import yandex_gpt_tokenize
+
+logger = logging.getLogger(__name__)
+
+# Калибровка выполняется в основном процессе: text_processing импортируется процессами пула
+# извлечения текста и не должен зависеть от клиента Yandex GPT
+_token_estimator_calibrated = False
+
+
+async def calibrate_token_estimator(sample_text: str, min_sample_chars: int = 500):
+    """
+    Однократно калибрует локальную оценку токенов по токенизатору Yandex GPT.
+
+    Отправляет образец текста в эндпоинт tokenize и сохраняет фактическое отношение
+    символов к токенам. При ошибке или слишком коротком образце остаётся значение по умолчанию.
+
+    Args:
+        sample_text (str): Образец текста документа.
+        min_sample_chars (int): Минимальная длина образца для калибровки.
+    """
+    global _token_estimator_calibrated
+    if _token_estimator_calibrated or not TOKENIZE_CALIBRATION or len(sample_text) < min_sample_chars:
+        return
+    try:
+        tokens = await yandex_gpt_tokenize(sample_text)
+        if tokens:
+            set_chars_per_token(len(sample_text) / tokens)
+            logger.info(f"Оценка токенов откалибрована: {get_chars_per_token():.2f} символов на токен")
+    except Exception as ex:
+        logger.warning(f"Не удалось откалибровать оценку токенов, используется {get_chars_per_token()}: {ex}")
+    _token_estimator_calibrated = True
@@ -21,4 +21,118 @@ MAX_FILE_SIZE_MB = 10
 
 YANDEX_GPT_ID = os.getenv('YANDEX_GPT_ID', '')
 YANDEX_GPT_API_KEY = os.getenv('YANDEX_GPT_API_KEY', '')
-FOLDER_ID = os.getenv('FOLDER_ID', '')
\ No newline at end of file
+FOLDER_ID = os.getenv('FOLDER_ID', '')
+
+# Количество параллельных воркеров анализа чанков
+ANALYSIS_WORKERS = int(os.getenv('ANALYSIS_WORKERS', '8'))
+
+# Пул HTTP-соединений к Yandex GPT
+YANDEX_GPT_POOL_LIMIT = int(os.getenv('YANDEX_GPT_POOL_LIMIT', '100'))
+YANDEX_GPT_POOL_LIMIT_PER_HOST = int(os.getenv('YANDEX_GPT_POOL_LIMIT_PER_HOST', '32'))
+YANDEX_GPT_DNS_CACHE_TTL = int(os.getenv('YANDEX_GPT_DNS_CACHE_TTL', '300'))
+YANDEX_GPT_KEEPALIVE_TIMEOUT = float(os.getenv('YANDEX_GPT_KEEPALIVE_TIMEOUT', '60'))
+
+# Квоты Yandex GPT и повторы при ошибках (0 — квота не ограничивается)
+YANDEX_GPT_RPS = float(os.getenv('YANDEX_GPT_RPS', '10'))
+YANDEX_GPT_TOKENS_PER_HOUR = int(os.getenv('YANDEX_GPT_TOKENS_PER_HOUR', '0'))
+YANDEX_GPT_MAX_RETRIES = int(os.getenv('YANDEX_GPT_MAX_RETRIES', '5'))
+YANDEX_GPT_BACKOFF_BASE_SEC = float(os.getenv('YANDEX_GPT_BACKOFF_BASE_SEC', '0.5'))
+YANDEX_GPT_BACKOFF_MAX_SEC = float(os.getenv('YANDEX_GPT_BACKOFF_MAX_SEC', '30'))
+CHUNK_MAX_ATTEMPTS = int(os.getenv('CHUNK_MAX_ATTEMPTS', '3'))
+
+# Дублирование «зависших» запросов и предохранитель при недоступности Yandex GPT
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '1') == '1'
+HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+HEDGE_MIN_DELAY_SEC = float(os.getenv('HEDGE_MIN_DELAY_SEC', '2'))
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+HEDGE_MAX_RATIO = float(os.getenv('HEDGE_MAX_RATIO', '0.1'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_COOLDOWN_SEC = float(os.getenv('CIRCUIT_COOLDOWN_SEC', '15'))
+CIRCUIT_MAX_COOLDOWN_SEC = float(os.getenv('CIRCUIT_MAX_COOLDOWN_SEC', '300'))
+
+# Кэш ответов Yandex GPT в БД
+COMPLETION_CACHE_ENABLED = os.getenv('COMPLETION_CACHE_ENABLED', '1') == '1'
+COMPLETION_CACHE_TTL_HOURS = int(os.getenv('COMPLETION_CACHE_TTL_HOURS', '720'))
+COMPLETION_CACHE_MAX_ENTRIES = int(os.getenv('COMPLETION_CACHE_MAX_ENTRIES', '100000'))
+COMPLETION_CACHE_EVICT_EVERY = int(os.getenv('COMPLETION_CACHE_EVICT_EVERY', '500'))
+
+# Очередь задач анализа
+ANALYSIS_WORKER_IN_PROCESS = os.getenv('ANALYSIS_WORKER_IN_PROCESS', '1') == '1'
+# Задача почти всё время ждёт ответов Yandex GPT, а квоту запросов между пользователями делит
+# планировщик llm_scheduler, поэтому слотов задач должно хватать на всех ожидающих пользователей
+ANALYSIS_WORKER_JOBS = int(os.getenv('ANALYSIS_WORKER_JOBS', '32'))
+ANALYSIS_JOB_LEASE_SEC = int(os.getenv('ANALYSIS_JOB_LEASE_SEC', '300'))
+ANALYSIS_JOB_POLL_SEC = float(os.getenv('ANALYSIS_JOB_POLL_SEC', '2'))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', '3'))
+
+# Режим запросов к Yandex GPT при анализе чанков: sync — синхронный API, deferred — отложенный (асинхронный) API
+YANDEX_GPT_MODE = os.getenv('YANDEX_GPT_MODE', 'sync')
+YANDEX_GPT_API_URL = os.getenv('YANDEX_GPT_API_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
+YANDEX_GPT_ASYNC_API_URL = os.getenv('YANDEX_GPT_ASYNC_API_URL',
+                                     'https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync')
+YANDEX_OPERATIONS_API_URL = os.getenv('YANDEX_OPERATIONS_API_URL', 'https://operation.api.cloud.yandex.net/operations')
+DEFERRED_POLL_INTERVAL_SEC = float(os.getenv('DEFERRED_POLL_INTERVAL_SEC', '2'))
+DEFERRED_TIMEOUT_SEC = float(os.getenv('DEFERRED_TIMEOUT_SEC', '3600'))
+
+# Разбиение документов на чанки по бюджету токенов
+CHUNK_TOKEN_BUDGET = int(os.getenv('CHUNK_TOKEN_BUDGET', '2000'))
+# Границы чанков по содержимому («якорные» абзацы), чтобы правка документа меняла только соседние чанки
+CHUNK_ANCHOR_EVERY = int(os.getenv('CHUNK_ANCHOR_EVERY', '8'))
+CHUNK_ANCHOR_MIN_FILL = float(os.getenv('CHUNK_ANCHOR_MIN_FILL', '0.5'))
+CHARS_PER_TOKEN = float(os.getenv('CHARS_PER_TOKEN', '3.5'))
+TOKENIZE_CALIBRATION = os.getenv('TOKENIZE_CALIBRATION', '1') == '1'
+YANDEX_GPT_TOKENIZE_URL = os.getenv('YANDEX_GPT_TOKENIZE_URL',
+                                    'https://llm.api.cloud.yandex.net/foundationModels/v1/tokenize')
+
+# Параллельное иерархическое резюмирование
+REDUCE_GROUP_TOKEN_BUDGET = int(os.getenv('REDUCE_GROUP_TOKEN_BUDGET', '6000'))
+SUMMARY_CONCURRENCY = int(os.getenv('SUMMARY_CONCURRENCY', '8'))
+SUMMARY_ANCHOR_EVERY = int(os.getenv('SUMMARY_ANCHOR_EVERY', '4'))
+
+# Выбор модели по шагу: map — анализ блоков, reduce — промежуточные резюме, final — итоговый отчёт, qa — вопросы
+MODEL_MAP = os.getenv('MODEL_MAP', 'yandexgpt-lite')
+MODEL_REDUCE = os.getenv('MODEL_REDUCE', 'yandexgpt-lite')
+MODEL_FINAL = os.getenv('MODEL_FINAL', 'yandexgpt')
+MODEL_QA = os.getenv('MODEL_QA', 'yandexgpt-lite')
+# Размер ответа (max_tokens): доля объёма входа, но не меньше MIN_OUTPUT_TOKENS и не больше MAX_TOKENS_<шаг>
+OUTPUT_RATIO_MAP = float(os.getenv('OUTPUT_RATIO_MAP', '0.5'))
+OUTPUT_RATIO_REDUCE = float(os.getenv('OUTPUT_RATIO_REDUCE', '0.4'))
+OUTPUT_RATIO_FINAL = float(os.getenv('OUTPUT_RATIO_FINAL', '0.6'))
+OUTPUT_RATIO_QA = float(os.getenv('OUTPUT_RATIO_QA', '0.3'))
+MAX_TOKENS_MAP = int(os.getenv('MAX_TOKENS_MAP', '1500'))
+MAX_TOKENS_REDUCE = int(os.getenv('MAX_TOKENS_REDUCE', '1500'))
+MAX_TOKENS_FINAL = int(os.getenv('MAX_TOKENS_FINAL', '2000'))
+MAX_TOKENS_QA = int(os.getenv('MAX_TOKENS_QA', '1500'))
+MIN_OUTPUT_TOKENS = int(os.getenv('MIN_OUTPUT_TOKENS', '300'))
+
+# Потоковая доставка итогового отчёта правками сообщения в Telegram
+STREAM_FINAL_REPORT = os.getenv('STREAM_FINAL_REPORT', '1') == '1'
+STREAM_EDIT_INTERVAL_SEC = float(os.getenv('STREAM_EDIT_INTERVAL_SEC', '1.5'))
+
+# Пул процессов для извлечения текста из документов
+EXTRACTION_WORKERS = int(os.getenv('EXTRACTION_WORKERS', '2'))
+EXTRACTION_TIMEOUT_SEC = float(os.getenv('EXTRACTION_TIMEOUT_SEC', '120'))
+CHUNK_BATCH_SIZE = int(os.getenv('CHUNK_BATCH_SIZE', '200'))
+EXTRACTION_QUEUE_BATCHES = int(os.getenv('EXTRACTION_QUEUE_BATCHES', '4'))
+
+# Отложенная пакетная запись ответов AI по чанкам
+CHUNK_WRITE_BATCH_SIZE = int(os.getenv('CHUNK_WRITE_BATCH_SIZE', '100'))
+CHUNK_WRITE_FLUSH_MS = int(os.getenv('CHUNK_WRITE_FLUSH_MS', '200'))
+
+# Векторный поиск по чанкам документов (локальная модель sentence-transformers на CPU)
+EMBEDDINGS_ENABLED = os.getenv('EMBEDDINGS_ENABLED', '1') == '1'
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_CACHE_USERS = int(os.getenv('EMBEDDING_CACHE_USERS', '32'))
+
+# Ответы на вопросы по документам
+QA_TOP_K = int(os.getenv('QA_TOP_K', '6'))
+QA_CONTEXT_TOKEN_BUDGET = int(os.getenv('QA_CONTEXT_TOKEN_BUDGET', '6000'))
+BM25_CACHE_USERS = int(os.getenv('BM25_CACHE_USERS', '64'))
+
+# Кэш промта анализа: как часто сверять его с файлом на Яндекс.Диске
+PROMPT_CACHE_TTL_SEC = float(os.getenv('PROMPT_CACHE_TTL_SEC', '60'))
+
+# Повторное использование ответов AI для почти одинаковых чанков (сигнатуры SimHash)
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', '1') == '1'
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', '3'))
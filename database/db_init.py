@@ -1,6 +1,7 @@
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from config import DATABASE_URL
 from database.models import Base
+from database.migrations import apply_migrations
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,7 +16,8 @@ async def init_db():
     """
     Инициализирует базу данных.
 
-    Создает все таблицы, описанные в метаданных Base, если они еще не существуют.
+    Создает все таблицы, описанные в метаданных Base, если они еще не существуют,
+    и применяет версионированные миграции схемы (индексы, новые столбцы) к существующей базе.
 
     Использует асинхронное соединение с базой данных.
 
@@ -26,6 +28,7 @@ async def init_db():
         # Создаем все таблицы, если их нет
         await conn.run_sync(Base.metadata.create_all)
         logger.info("Tables successfully created")
+        await apply_migrations(conn)
 
 
 async def get_session():
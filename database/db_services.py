@@ -1,12 +1,19 @@
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import delete
 from sqlalchemy.orm import selectinload
-from database.models import UserFile, User, FileChunk, FileSummary
+from database.models import UserFile, User, FileChunk, FileSummary, AnalysisJob, FileContent
 import numpy as np
-from sqlalchemy import select, update
+from sqlalchemy import (select, update, insert, func, text, values, column, literal, Integer, Text, LargeBinary, JSON,
+                        String)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import asyncio
+import difflib
+from datetime import datetime, timezone
+import json
 import logging
 
-from bot.services.text_processing import split_text_into_semantic_chunks
+from bot.services.text_processing import chunk_search_features, chunk_content_hash, simhash_bands, hamming_distance
+from bot.services.token_calibration import calibrate_token_estimator
 from aiogram.fsm.state import State, StatesGroup
 
 
@@ -18,10 +25,15 @@ class SearchStates(StatesGroup):
 logger = logging.getLogger(__name__)
 
 
-async def file_save(user_id: int, document, remote_path, session: AsyncSession):
+async def file_save(user_id: int, document, remote_path, session: AsyncSession, commit: bool = True,
+                    content_hash: str = None):
     """
     Сохраняет информацию о загруженном файле в базу данных.
-    Если файл с таким же file_id или названием уже есть у пользователя, возвращает 'already_exists'.
+    Если файл с таким же file_id, названием или содержимым (content_hash) уже есть у пользователя,
+    возвращает 'already_exists'.
+
+    При commit=False запись только отправляется в БД (flush) в текущей транзакции —
+    так файл и его чанки фиксируются одним коммитом.
 
     Returns:
         str: file_id сохранённого файла, 'already_exists' если файл уже есть, или None при ошибке.
@@ -30,13 +42,13 @@ async def file_save(user_id: int, document, remote_path, session: AsyncSession):
         file_id = document.file_id
         title = document.file_name
 
-        # Проверяем, есть ли уже такой файл у пользователя (по file_id или названию)
-        query = select(UserFile).where(
-            (UserFile.user_id == user_id) &
-            ((UserFile.file_id == file_id) | (UserFile.title == title))
-        )
+        # Проверяем, есть ли уже такой файл у пользователя (по file_id, названию или содержимому)
+        same_file = (UserFile.file_id == file_id) | (UserFile.title == title)
+        if content_hash is not None:
+            same_file |= UserFile.content_hash == content_hash
+        query = select(UserFile).where((UserFile.user_id == user_id) & same_file)
         result = await session.execute(query)
-        existing_file = result.scalar_one_or_none()
+        existing_file = result.scalars().first()
         if existing_file:
             return 'already_exists'
 
@@ -45,8 +57,12 @@ async def file_save(user_id: int, document, remote_path, session: AsyncSession):
             user_id=user_id,
             title=title,
             yandex_path=remote_path,
+            content_hash=content_hash,
         )
         session.add(user_file)
+        if not commit:
+            await session.flush()
+            return user_file
         await session.commit()
         await session.refresh(user_file)
         return user_file
@@ -55,6 +71,80 @@ async def file_save(user_id: int, document, remote_path, session: AsyncSession):
         return None
 
 
+async def get_user_file_by_title(user_id: int, title: str, session: AsyncSession):
+    result = await session.execute(
+        select(UserFile).where((UserFile.user_id == user_id) & (UserFile.title == title))
+    )
+    return result.scalars().first()
+
+
+async def start_file_revision(user_file: UserFile, remote_path: str, content_hash: str,
+                              session: AsyncSession) -> list[tuple[str, str | None, str | None]]:
+    """
+    Переводит файл на новую ревизию: удаляет чанки и отчёт предыдущей ревизии
+    и обновляет путь, содержимое (content_hash) и номер ревизии. Коммит не выполняется —
+    новые чанки сохраняются в той же транзакции.
+
+    Если файл был источником общего хранилища содержимого, запись хранилища удаляется:
+    его чанки больше не соответствуют прежнему содержимому.
+
+    Returns:
+        list[tuple[str, str | None, str | None]]: Чанки предыдущей ревизии по порядку:
+            (sha256 текста, ответ AI, хэш промта); для необработанных чанков ответ None.
+    """
+    result = await session.execute(
+        select(FileChunk.content_hash, FileChunk.content, FileChunk.processed, FileChunk.ai_response,
+               FileChunk.prompt_hash)
+        .where(FileChunk.file_id == user_file.file_id)
+        .order_by(FileChunk.chunk_index)
+    )
+    previous_chunks = [
+        (hash_ or chunk_content_hash(content), ai_response if processed else None, prompt_hash)
+        for hash_, content, processed, ai_response, prompt_hash in result.all()
+    ]
+    await session.execute(delete(FileChunk).where(FileChunk.file_id == user_file.file_id))
+    await session.execute(delete(FileSummary).where(FileSummary.file_id == user_file.file_id))
+    await session.execute(delete(FileContent).where(FileContent.source_file_id == user_file.file_id))
+    user_file.revision = (user_file.revision or 1) + 1
+    user_file.content_hash = content_hash
+    user_file.yandex_path = remote_path
+    user_file.upload_date = datetime.now(timezone.utc)
+    await session.flush()
+    return previous_chunks
+
+
+async def carry_over_chunk_answers(file_id: str, previous_chunks: list, session: AsyncSession) -> tuple[int, int]:
+    """
+    Сопоставляет чанки новой ревизии файла с чанками предыдущей по sha256 текста
+    (наибольшие общие подпоследовательности, difflib) и переносит ответы AI в неизменённые чанки.
+    Новые и изменённые чанки остаются необработанными и при анализе отправляются в AI.
+    Коммит не выполняется.
+
+    Args:
+        file_id (str): Файл с уже сохранёнными чанками новой ревизии.
+        previous_chunks (list): Чанки предыдущей ревизии (start_file_revision).
+        session (AsyncSession): Асинхронная сессия базы данных.
+
+    Returns:
+        tuple[int, int]: (сколько чанков получили готовый ответ, сколько всего чанков в новой ревизии).
+    """
+    result = await session.execute(
+        select(FileChunk.id, FileChunk.content_hash).where(FileChunk.file_id == file_id).order_by(FileChunk.chunk_index)
+    )
+    new_chunks = result.all()
+    matcher = difflib.SequenceMatcher(
+        None, [hash_ for hash_, _, _ in previous_chunks], [hash_ for _, hash_ in new_chunks], autojunk=False
+    )
+    responses = {}
+    for old_start, new_start, size in matcher.get_matching_blocks():
+        for offset in range(size):
+            _, ai_response, prompt_hash = previous_chunks[old_start + offset]
+            if ai_response is not None:
+                responses[new_chunks[new_start + offset].id] = (ai_response, prompt_hash)
+    await save_chunk_ai_responses(responses, session=session, commit=False)
+    return len(responses), len(new_chunks)
+
+
 async def get_users_files(user_id: int, session: AsyncSession):
     """
     Получает список всех файлов, загруженных пользователем.
@@ -156,23 +246,413 @@ async def save_user_if_not_exists(session: AsyncSession, user_id: int):
         return
 
 
-async def split_and_save_chunks(user_file: UserFile, full_text: str, session: AsyncSession):
-    chunks = split_text_into_semantic_chunks(full_text)
-    for idx, chunk_text in enumerate(chunks):
-        chunk = FileChunk(file_id=user_file.file_id, chunk_index=idx, content=chunk_text)
-        session.add(chunk)
+async def bulk_insert_chunks(file_id: str, chunk_texts: list[str], start_index: int, session: AsyncSession,
+                             embeddings: list = None):
+    """
+    Записывает пачку чанков файла одной операцией, минуя unit of work ORM.
+
+    На PostgreSQL (asyncpg) внутри открытой транзакции используется COPY, иначе —
+    многострочный INSERT. Коммит не выполняется: транзакцией управляет вызывающий код.
+
+    Args:
+        file_id (str): Идентификатор файла.
+        chunk_texts (list[str]): Тексты чанков по порядку.
+        start_index (int): chunk_index первого чанка пачки.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        embeddings (list[bytes | None], optional): Векторы чанков в том же порядке.
+    """
+    if not chunk_texts:
+        return
+    if embeddings is None:
+        embeddings = [None] * len(chunk_texts)
+    # Частоты терминов для BM25-индекса и сигнатура SimHash считаются сразу при сохранении чанков
+    features = await asyncio.to_thread(lambda: [
+        (chunk_content_hash(chunk_text), *chunk_search_features(chunk_text)) for chunk_text in chunk_texts
+    ])
+    rows = [
+        (start_index + offset, chunk_text, content_hash, embedding, freqs, signature)
+        for offset, (chunk_text, embedding, (content_hash, freqs, signature))
+        in enumerate(zip(chunk_texts, embeddings, features))
+    ]
+    connection = await session.connection()
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "asyncpg":
+        raw_connection = await connection.get_raw_connection()
+        driver_connection = raw_connection.driver_connection
+        # COPY вне транзакции зафиксировался бы сразу, поэтому используем его только внутри неё
+        if driver_connection.is_in_transaction():
+            await driver_connection.copy_records_to_table(
+                FileChunk.__tablename__,
+                records=[
+                    (file_id, chunk_index, chunk_text, content_hash, False, embedding,
+                     json.dumps(freqs, ensure_ascii=False), signature, simhash_bands(signature))
+                    for chunk_index, chunk_text, content_hash, embedding, freqs, signature in rows
+                ],
+                columns=["file_id", "chunk_index", "content", "content_hash", "processed", "embedding", "term_freqs",
+                         "simhash", "simhash_bands"],
+            )
+            return
+    await session.execute(
+        insert(FileChunk),
+        [
+            {"file_id": file_id, "chunk_index": chunk_index, "content": chunk_text, "content_hash": content_hash,
+             "processed": False, "embedding": embedding, "term_freqs": freqs, "simhash": signature,
+             "simhash_bands": simhash_bands(signature)}
+            for chunk_index, chunk_text, content_hash, embedding, freqs, signature in rows
+        ],
+    )
+
+
+async def stream_and_save_chunks(user_file: UserFile, chunk_batches, session: AsyncSession,
+                                embed_func=None, commit: bool = True) -> int:
+    """
+    Сохраняет чанки файла в БД пачками по мере их поступления из конвейера разбора.
+
+    Каждая пачка сразу отправляется в БД (bulk_insert_chunks), поэтому в памяти не накапливается
+    весь документ. Коммит выполняется один раз в конце: если файл сохранён через
+    file_save(commit=False), запись файла и все его чанки фиксируются одной транзакцией,
+    а при ошибке достаточно откатить сессию. После первой пачки калибруется оценка токенов
+    для следующих документов.
+
+    Args:
+        user_file (UserFile): Файл, к которому относятся чанки.
+        chunk_batches (AsyncIterator[list[str]]): Поток пачек чанков (stream_chunk_batches).
+        session (AsyncSession): Асинхронная сессия базы данных.
+        embed_func (Callable, optional): async-функция, возвращающая векторы (bytes) для пачки текстов;
+            векторы сохраняются вместе с чанками.
+        commit (bool): Зафиксировать транзакцию после сохранения чанков.
+
+    Returns:
+        int: Количество сохранённых чанков.
+    """
+    chunk_index = 0
+    async for batch in chunk_batches:
+        if chunk_index == 0 and batch:
+            await calibrate_token_estimator(batch[0])
+        embeddings = await embed_func(batch) if embed_func is not None else None
+        await bulk_insert_chunks(user_file.file_id, batch, chunk_index, session, embeddings=embeddings)
+        chunk_index += len(batch)
+    if commit:
+        await session.commit()
+    return chunk_index
+
+
+async def get_file_content(content_hash: str, session: AsyncSession):
+    """
+    Ищет в общем хранилище уже разобранный файл с таким же содержимым.
+
+    Returns:
+        FileContent | None: Запись хранилища или None.
+    """
+    result = await session.execute(select(FileContent).where(FileContent.content_hash == content_hash))
+    return result.scalar_one_or_none()
+
+
+async def register_file_content(content_hash: str, size_bytes: int, file_id: str, chunks_count: int,
+                                session: AsyncSession):
+    """
+    Добавляет разобранный файл в общее хранилище содержимого (если такого содержимого там ещё нет).
+    """
+    await session.execute(
+        pg_insert(FileContent).values(
+            content_hash=content_hash, size_bytes=size_bytes, source_file_id=file_id, chunks_count=chunks_count
+        ).on_conflict_do_nothing(index_elements=[FileContent.content_hash])
+    )
     await session.commit()
 
 
-async def save_chunk_ai_response(chunk_id: int, ai_response: str, session: AsyncSession):
-    stmt = update(FileChunk).where(FileChunk.id == chunk_id).values(ai_response=ai_response, processed=True)
+async def copy_file_chunks(source_file_id: str, target_file_id: str, session: AsyncSession) -> int:
+    """
+    Копирует чанки (текст, векторы, частоты терминов и сигнатуры SimHash) одного файла в другой одним запросом
+    INSERT ... SELECT — без повторного извлечения текста. Ответы AI не копируются:
+    они переиспользуются при анализе, если совпадает версия промта.
+    Коммит не выполняется.
+
+    Returns:
+        int: Количество скопированных чанков.
+    """
+    columns = ["file_id", "chunk_index", "content", "content_hash", "processed", "embedding", "term_freqs",
+               "simhash", "simhash_bands"]
+    source = select(
+        literal(target_file_id, String), FileChunk.chunk_index, FileChunk.content, FileChunk.content_hash,
+        literal(False), FileChunk.embedding, FileChunk.term_freqs, FileChunk.simhash, FileChunk.simhash_bands,
+    ).where(FileChunk.file_id == source_file_id)
+    result = await session.execute(insert(FileChunk).from_select(columns, source))
+    return result.rowcount or 0
+
+
+async def get_reusable_chunk_answers(content_hash: str, prompt_hash: str, file_id: str, session: AsyncSession) -> dict:
+    """
+    Ищет ответы AI, уже полученные с той же версией промта для чанков других файлов
+    с таким же содержимым (у любого пользователя).
+
+    Returns:
+        dict[int, tuple[str, str]]: (текст чанка, ответ AI) по chunk_index.
+    """
+    result = await session.execute(
+        select(FileChunk.chunk_index, FileChunk.content, FileChunk.ai_response)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where(
+            (UserFile.content_hash == content_hash) &
+            (UserFile.file_id != file_id) &
+            (FileChunk.prompt_hash == prompt_hash) &
+            FileChunk.processed.is_(True) &
+            FileChunk.ai_response.is_not(None)
+        )
+    )
+    return {chunk_index: (content, ai_response) for chunk_index, content, ai_response in result.all()}
+
+
+async def get_reusable_summary(content_hash: str, prompt_hash: str, file_id: str, session: AsyncSession):
+    """
+    Ищет итоговый отчёт, уже построенный с той же версией промта для другого файла
+    с таким же содержимым.
+
+    Returns:
+        str | None: Текст отчёта или None.
+    """
+    result = await session.execute(
+        select(FileSummary.summary)
+        .join(UserFile, UserFile.file_id == FileSummary.file_id)
+        .where(
+            (UserFile.content_hash == content_hash) &
+            (UserFile.file_id != file_id) &
+            (FileSummary.prompt_hash == prompt_hash) &
+            FileSummary.summary.is_not(None)
+        )
+        .limit(1)
+    )
+    return result.scalars().first()
+
+
+async def get_near_duplicate_answers(signatures: dict[int, int], prompt_hash: str, user_id: int,
+                                     session: AsyncSession, max_distance: int) -> dict[int, tuple[int, str]]:
+    """
+    Ищет для чанков уже обработанные с той же версией промта почти одинаковые чанки в файлах того же пользователя.
+
+    Ответы по чужим документам здесь не переиспользуются: похожий текст может отличаться именами,
+    суммами и датами, которые попали в ответ AI. Между пользователями ответы переносятся только
+    для полностью совпадающих документов (get_reusable_chunk_answers).
+
+    Кандидаты выбираются по совпадению хотя бы одной LSH-полосы сигнатуры (GIN-индекс по simhash_bands),
+    затем среди них берётся ближайший по расстоянию Хэмминга, если оно не больше max_distance.
+
+    Args:
+        signatures (dict[int, int]): Сигнатуры SimHash по id чанка.
+        prompt_hash (str): Версия промта.
+        user_id (int): Владелец чанков; кандидаты ищутся только среди его файлов.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        max_distance (int): Максимальное число различающихся битов сигнатуры.
+
+    Returns:
+        dict[int, tuple[int, str]]: (id найденного чанка, его ответ AI) по id исходного чанка.
+    """
+    if not signatures:
+        return {}
+    bands = sorted({band for signature in signatures.values() for band in simhash_bands(signature)})
+    result = await session.execute(
+        select(FileChunk.id, FileChunk.simhash, FileChunk.ai_response)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where(
+            (UserFile.user_id == user_id) &
+            FileChunk.simhash_bands.overlap(bands) &
+            (FileChunk.prompt_hash == prompt_hash) &
+            FileChunk.processed.is_(True) &
+            FileChunk.ai_response.is_not(None) &
+            FileChunk.id.not_in(list(signatures))
+        )
+    )
+    candidates_by_band = {}
+    for candidate in result.all():
+        for band in simhash_bands(candidate.simhash):
+            candidates_by_band.setdefault(band, []).append(candidate)
+
+    matches = {}
+    for chunk_id, signature in signatures.items():
+        best = None
+        for band in simhash_bands(signature):
+            for candidate in candidates_by_band.get(band, ()):
+                distance = hamming_distance(signature, candidate.simhash)
+                if distance <= max_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate.id, candidate.ai_response)
+        if best is not None:
+            matches[chunk_id] = best[1:]
+    return matches
+
+
+async def save_chunk_ai_responses(responses: dict[int, tuple[str, str | None]], session: AsyncSession,
+                                  commit: bool = True):
+    """
+    Сохраняет ответы AI по нескольким чанкам одним запросом UPDATE ... FROM (VALUES ...)
+    и одним коммитом.
+
+    Args:
+        responses (dict[int, tuple[str, str | None]]): (ответ AI, хэш промта) по id чанка.
+        session (AsyncSession): Асинхронная сессия базы данных.
+        commit (bool): Зафиксировать транзакцию после записи.
+    """
+    if not responses:
+        return
+    rows = values(
+        column("id", Integer), column("ai_response", Text), column("prompt_hash", String),
+        name="chunk_responses"
+    ).data([(chunk_id, ai_response, hash_) for chunk_id, (ai_response, hash_) in responses.items()])
+    stmt = (
+        update(FileChunk)
+        .where(FileChunk.id == rows.c.id)
+        .values(ai_response=rows.c.ai_response, prompt_hash=rows.c.prompt_hash, processed=True)
+        .execution_options(synchronize_session=False)
+    )
     await session.execute(stmt)
+    if commit:
+        await session.commit()
+
+
+async def increment_chunk_attempts(chunk_id: int, session: AsyncSession) -> int:
+    """
+    Увеличивает счётчик неудачных попыток анализа чанка.
+
+    Returns:
+        int: Новое значение счётчика.
+    """
+    result = await session.execute(
+        update(FileChunk).where(FileChunk.id == chunk_id)
+        .values(attempts=FileChunk.attempts + 1)
+        .returning(FileChunk.attempts)
+    )
+    attempts = result.scalar_one()
     await session.commit()
+    return attempts
+
+
+async def get_chunks_without_embeddings(user_id: int, session: AsyncSession, limit: int = 256):
+    """
+    Возвращает (id, content) чанков пользователя, для которых ещё не посчитан вектор.
+    """
+    result = await session.execute(
+        select(FileChunk.id, FileChunk.content)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where((UserFile.user_id == user_id) & FileChunk.embedding.is_(None))
+        .order_by(FileChunk.id)
+        .limit(limit)
+    )
+    return result.all()
 
 
-async def save_file_summary(file_id: str, summary: str, session: AsyncSession):
-    summary_entry = FileSummary(file_id=file_id, summary=summary)
-    session.add(summary_entry)
+async def save_chunk_embeddings(embeddings: dict[int, bytes], session: AsyncSession):
+    """
+    Сохраняет векторы нескольких чанков одним запросом UPDATE ... FROM (VALUES ...).
+
+    Args:
+        embeddings (dict[int, bytes]): Векторы по id чанка.
+        session (AsyncSession): Асинхронная сессия базы данных.
+    """
+    if not embeddings:
+        return
+    rows = values(
+        column("id", Integer), column("embedding", LargeBinary), name="chunk_embeddings"
+    ).data(list(embeddings.items()))
+    stmt = (
+        update(FileChunk)
+        .where(FileChunk.id == rows.c.id)
+        .values(embedding=rows.c.embedding)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def get_user_chunk_embeddings(user_id: int, session: AsyncSession):
+    """
+    Возвращает (id, file_id, embedding) всех чанков пользователя с посчитанными векторами.
+    """
+    result = await session.execute(
+        select(FileChunk.id, FileChunk.file_id, FileChunk.embedding)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where((UserFile.user_id == user_id) & FileChunk.embedding.is_not(None))
+        .order_by(FileChunk.id)
+    )
+    return result.all()
+
+
+async def get_chunks_without_term_freqs(user_id: int, session: AsyncSession, limit: int = 1000):
+    """
+    Возвращает (id, content) чанков пользователя, для которых ещё не посчитаны частоты терминов.
+    """
+    result = await session.execute(
+        select(FileChunk.id, FileChunk.content)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where((UserFile.user_id == user_id) & FileChunk.term_freqs.is_(None))
+        .order_by(FileChunk.id)
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def save_chunk_term_freqs(term_freqs: dict[int, dict], session: AsyncSession):
+    """
+    Сохраняет частоты терминов нескольких чанков одним запросом UPDATE ... FROM (VALUES ...).
+    """
+    if not term_freqs:
+        return
+    rows = values(
+        column("id", Integer), column("term_freqs", JSON), name="chunk_term_freqs"
+    ).data(list(term_freqs.items()))
+    stmt = (
+        update(FileChunk)
+        .where(FileChunk.id == rows.c.id)
+        .values(term_freqs=rows.c.term_freqs)
+        .execution_options(synchronize_session=False)
+    )
+    await session.execute(stmt)
+    await session.commit()
+
+
+async def get_user_chunk_term_freqs(user_id: int, session: AsyncSession, file_id: str = None):
+    """
+    Возвращает (id, file_id, term_freqs) всех проиндексированных чанков пользователя
+    (или только чанков файла file_id).
+    """
+    query = (
+        select(FileChunk.id, FileChunk.file_id, FileChunk.term_freqs)
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where((UserFile.user_id == user_id) & FileChunk.term_freqs.is_not(None))
+        .order_by(FileChunk.id)
+    )
+    if file_id is not None:
+        query = query.where(FileChunk.file_id == file_id)
+    result = await session.execute(query)
+    return result.all()
+
+
+async def get_chunks_by_ids(chunk_ids: list[int], session: AsyncSession):
+    """
+    Возвращает чанки с названиями их файлов в порядке переданных id.
+
+    Returns:
+        list[tuple[FileChunk, str]]: Пары (чанк, название файла).
+    """
+    if not chunk_ids:
+        return []
+    result = await session.execute(
+        select(FileChunk, func.coalesce(UserFile.title, UserFile.file_id))
+        .join(UserFile, UserFile.file_id == FileChunk.file_id)
+        .where(FileChunk.id.in_(chunk_ids))
+    )
+    by_id = {chunk.id: (chunk, title) for chunk, title in result.all()}
+    return [by_id[chunk_id] for chunk_id in chunk_ids if chunk_id in by_id]
+
+
+async def save_file_summary(file_id: str, summary: str, session: AsyncSession, prompt_hash: str = None):
+    """
+    Сохраняет итоговый отчёт по файлу. Отчёт у файла один: повторный анализ (например, после
+    неудачного резюмирования, сохранившего пустой отчёт) заменяет существующую запись.
+    """
+    stmt = pg_insert(FileSummary).values(file_id=file_id, summary=summary, prompt_hash=prompt_hash)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[FileSummary.file_id],
+        set_={"summary": stmt.excluded.summary, "prompt_hash": stmt.excluded.prompt_hash, "created_at": func.now()},
+    )
+    await session.execute(stmt)
     await session.commit()
 
 
@@ -181,3 +661,182 @@ async def get_file_chunks(file_id: str, session: AsyncSession):
         select(FileChunk).where(FileChunk.file_id == file_id).order_by(FileChunk.chunk_index)
     )
     return result.scalars().all()
+
+
+async def get_files_progress(user_id: int, session: AsyncSession):
+    """
+    Возвращает прогресс анализа всех файлов пользователя одним агрегирующим запросом,
+    не загружая тексты чанков.
+
+    Args:
+        user_id (int): Идентификатор пользователя (Telegram user_id).
+        session (AsyncSession): Асинхронная сессия базы данных.
+
+    Returns:
+        list[Row]: Строки с полями UserFile, total (всего чанков), done (обработано чанков),
+            has_summary (есть итоговый отчёт) и summary_preview (первые 500 символов отчёта).
+    """
+    result = await session.execute(
+        select(
+            UserFile,
+            func.count(FileChunk.id).label("total"),
+            func.count(FileChunk.id).filter(FileChunk.processed.is_(True)).label("done"),
+            (func.coalesce(FileSummary.summary, "") != "").label("has_summary"),
+            func.left(FileSummary.summary, 500).label("summary_preview"),
+        )
+        .outerjoin(FileChunk, FileChunk.file_id == UserFile.file_id)
+        .outerjoin(FileSummary, FileSummary.file_id == UserFile.file_id)
+        .where(UserFile.user_id == user_id)
+        .group_by(UserFile.id, FileSummary.id)
+        .order_by(UserFile.id)
+    )
+    return result.all()
+
+
+ACTIVE_JOB_STATUSES = ("pending", "running")
+
+
+async def enqueue_analysis_job(user_id: int, session: AsyncSession):
+    """
+    Ставит задачу анализа документов пользователя в очередь.
+
+    Если у пользователя уже есть задача в очереди или в работе, новая не создаётся. Проверка
+    атомарна: вставка выполняется с ON CONFLICT по частичному уникальному индексу активных задач
+    (ux_analysis_jobs_active_user), поэтому одновременные вызовы не ставят в очередь дубликаты.
+
+    Args:
+        user_id (int): Telegram user_id пользователя.
+        session (AsyncSession): Асинхронная сессия базы данных.
+
+    Returns:
+        AnalysisJob | str: Новая задача либо 'already_queued', если активная задача уже есть.
+    """
+    result = await session.execute(
+        pg_insert(AnalysisJob)
+        .values(user_id=user_id, status="pending", attempts=0)
+        .on_conflict_do_nothing(
+            index_elements=[AnalysisJob.user_id],
+            # Предикат литералом: с параметрами Postgres не сопоставит его с частичным индексом
+            index_where=text("status IN ('pending', 'running')"),
+        )
+        .returning(AnalysisJob.id)
+    )
+    job_id = result.scalar_one_or_none()
+    await session.commit()
+    if job_id is None:
+        return 'already_queued'
+    return await session.get(AnalysisJob, job_id)
+
+
+async def get_active_analysis_job(user_id: int, session: AsyncSession):
+    """
+    Возвращает задачу анализа пользователя в статусе pending или running, если она есть.
+    """
+    result = await session.execute(
+        select(AnalysisJob)
+        .where((AnalysisJob.user_id == user_id) & (AnalysisJob.status.in_(ACTIVE_JOB_STATUSES)))
+        .order_by(AnalysisJob.created_at)
+        .limit(1)
+    )
+    return result.scalar_one_or_none()
+
+
+async def claim_analysis_job(worker_id: str, lease_seconds: int, max_attempts: int, session: AsyncSession):
+    """
+    Забирает из очереди одну задачу анализа и оформляет на неё аренду.
+
+    Берётся самая старая задача в статусе pending либо running с истёкшей арендой
+    (воркер упал или бот был перезапущен). У пользователя не бывает больше одной активной
+    задачи (индекс ux_analysis_jobs_active_user), поэтому задачи забираются по одной на пользователя. Блокировка FOR UPDATE SKIP LOCKED позволяет
+    нескольким воркерам безопасно работать с одной очередью.
+
+    Args:
+        worker_id (str): Идентификатор воркера.
+        lease_seconds (int): Длительность аренды в секундах.
+        max_attempts (int): Максимальное число попыток обработки задачи.
+        session (AsyncSession): Асинхронная сессия базы данных.
+
+    Returns:
+        AnalysisJob | None: Захваченная задача либо None, если очередь пуста.
+    """
+    # Задачи, исчерпавшие попытки и брошенные воркером, помечаем как неуспешные
+    await session.execute(
+        update(AnalysisJob)
+        .where(
+            (AnalysisJob.status == "running") &
+            (AnalysisJob.lease_until < func.now()) &
+            (AnalysisJob.attempts >= max_attempts)
+        )
+        .values(status="failed", error="Превышено число попыток обработки")
+    )
+    candidate = (
+        select(AnalysisJob.id)
+        .where(
+            ((AnalysisJob.status == "pending") |
+             ((AnalysisJob.status == "running") & (AnalysisJob.lease_until < func.now()))) &
+            (AnalysisJob.attempts < max_attempts)
+        )
+        .order_by(AnalysisJob.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    result = await session.execute(
+        update(AnalysisJob)
+        .where(AnalysisJob.id == candidate)
+        .values(
+            status="running",
+            worker_id=worker_id,
+            attempts=AnalysisJob.attempts + 1,
+            lease_until=func.now() + text(f"interval '{int(lease_seconds)} seconds'"),
+        )
+        .returning(AnalysisJob)
+    )
+    job = result.scalar_one_or_none()
+    await session.commit()
+    return job
+
+
+async def renew_analysis_job_lease(job_id: int, worker_id: str, lease_seconds: int, session: AsyncSession) -> bool:
+    """
+    Продлевает аренду задачи. Возвращает False, если задача уже принадлежит другому воркеру.
+    """
+    result = await session.execute(
+        update(AnalysisJob)
+        .where((AnalysisJob.id == job_id) & (AnalysisJob.worker_id == worker_id) & (AnalysisJob.status == "running"))
+        .values(lease_until=func.now() + text(f"interval '{int(lease_seconds)} seconds'"))
+    )
+    await session.commit()
+    return bool(result.rowcount)
+
+
+async def finish_analysis_job(job_id: int, worker_id: str, status: str, session: AsyncSession, error: str = None):
+    """
+    Завершает задачу анализа со статусом done или failed и снимает аренду.
+    """
+    await session.execute(
+        update(AnalysisJob)
+        .where((AnalysisJob.id == job_id) & (AnalysisJob.worker_id == worker_id))
+        .values(status=status, error=error, lease_until=None)
+    )
+    await session.commit()
+
+
+async def set_analysis_job_prompt(job_id: int, prompt_hash: str, session: AsyncSession):
+    """
+    Запоминает версию промта, с которой выполняется задача анализа.
+    """
+    await session.execute(update(AnalysisJob).where(AnalysisJob.id == job_id).values(prompt_hash=prompt_hash))
+    await session.commit()
+
+
+async def release_analysis_job(job_id: int, worker_id: str, session: AsyncSession):
+    """
+    Возвращает задачу в очередь при штатной остановке воркера, не засчитывая попытку.
+    """
+    await session.execute(
+        update(AnalysisJob)
+        .where((AnalysisJob.id == job_id) & (AnalysisJob.worker_id == worker_id))
+        .values(status="pending", worker_id=None, lease_until=None, attempts=AnalysisJob.attempts - 1)
+    )
+    await session.commit()
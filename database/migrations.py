@@ -0,0 +1,96 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+logger = logging.getLogger(__name__)
+
+# Произвольный ключ advisory-блокировки: бот и воркеры стартуют одновременно,
+# миграции должен применить только один процесс
+MIGRATIONS_LOCK_KEY = 7310420115
+
+# Версионированные миграции схемы: (версия, описание, SQL-операторы).
+# Уже применённые версии не меняются — новые изменения схемы добавляются новой версией в конец списка.
+# Операторы должны быть идемпотентными (IF NOT EXISTS): на новой базе таблицы и индексы
+# уже созданы create_all по моделям.
+MIGRATIONS = [
+    (1, "chunk and file lookup indexes", [
+        "CREATE INDEX IF NOT EXISTS ix_file_chunks_file_id_chunk_index ON file_chunks (file_id, chunk_index)",
+        "CREATE INDEX IF NOT EXISTS ix_file_chunks_file_id_processed ON file_chunks (file_id, processed)",
+        "CREATE INDEX IF NOT EXISTS ix_user_files_user_id ON user_files (user_id)",
+    ]),
+    (2, "chunk embeddings", [
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS embedding BYTEA",
+    ]),
+    (3, "chunk term frequencies", [
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS term_freqs JSON",
+    ]),
+    (4, "prompt version of analysis results", [
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS prompt_hash VARCHAR(64)",
+        "ALTER TABLE file_summaries ADD COLUMN IF NOT EXISTS prompt_hash VARCHAR(64)",
+        "ALTER TABLE analysis_jobs ADD COLUMN IF NOT EXISTS prompt_hash VARCHAR(64)",
+    ]),
+    (5, "file content hashes", [
+        "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+        "CREATE INDEX IF NOT EXISTS ix_user_files_content_hash ON user_files (content_hash)",
+    ]),
+    (6, "chunk simhash signatures", [
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS simhash BIGINT",
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS simhash_bands INTEGER[]",
+        "CREATE INDEX IF NOT EXISTS ix_file_chunks_simhash_bands ON file_chunks USING gin (simhash_bands)",
+    ]),
+    (7, "document revisions", [
+        "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    ]),
+    (8, "chunk analysis attempts", [
+        "ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS attempts SMALLINT NOT NULL DEFAULT 0",
+    ]),
+    (9, "one active analysis job per user", [
+        # Дубликаты, поставленные в очередь до появления индекса, закрываются — остаётся самая ранняя задача
+        "UPDATE analysis_jobs SET status = 'failed', error = 'duplicate active job' "
+        "WHERE status IN ('pending', 'running') AND id NOT IN ("
+        "SELECT min(id) FROM analysis_jobs WHERE status IN ('pending', 'running') GROUP BY user_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_analysis_jobs_active_user ON analysis_jobs (user_id) "
+        "WHERE status IN ('pending', 'running')",
+    ]),
+]
+
+
+async def apply_migrations(conn: AsyncConnection) -> list[int]:
+    """
+    Применяет к базе данных ещё не применённые миграции из MIGRATIONS.
+
+    Применённые версии хранятся в таблице schema_migrations. Выполняется внутри
+    транзакции соединения под advisory-блокировкой, поэтому одновременный запуск
+    нескольких процессов безопасен.
+
+    Args:
+        conn (AsyncConnection): Соединение с открытой транзакцией (engine.begin()).
+
+    Returns:
+        list[int]: Версии миграций, применённые при этом запуске.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "name VARCHAR(255) NOT NULL, "
+        "applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now())"
+    ))
+    result = await conn.execute(text("SELECT version FROM schema_migrations"))
+    applied_versions = set(result.scalars().all())
+
+    applied_now = []
+    for version, name, statements in MIGRATIONS:
+        if version in applied_versions:
+            continue
+        for statement in statements:
+            await conn.execute(text(statement))
+        await conn.execute(
+            text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+            {"version": version, "name": name},
+        )
+        applied_now.append(version)
+        logger.info(f"Applied schema migration {version}: {name}")
+    return applied_now
@@ -1,5 +1,6 @@
 from sqlalchemy import (String, Integer, BigInteger, Column, DateTime, func,
-                        Text, ForeignKey, JSON, Boolean, SmallInteger)
+                        Text, ForeignKey, JSON, Boolean, SmallInteger, Index, LargeBinary, text)
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -17,10 +18,12 @@ class UserFile(Base):
     __tablename__ = "user_files"
     id = Column(Integer, primary_key=True, autoincrement=True)
     file_id = Column(String(255), unique=True, nullable=False)
-    user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False, index=True)
     title = Column(String(512), nullable=True)
     yandex_path = Column(String(1024), nullable=False)
     upload_date = Column(DateTime(timezone=True), server_default=func.now())
+    content_hash = Column(String(64), nullable=True, index=True)  # sha256 содержимого файла
+    revision = Column(Integer, nullable=False, default=1, server_default="1")  # Номер ревизии документа
     user = relationship("User", back_populates="files")
     chunks = relationship("FileChunk", back_populates="user_file", cascade="all, delete-orphan")
     summary = relationship("FileSummary", back_populates="user_file", uselist=False)
@@ -31,16 +34,75 @@ class FileChunk(Base):
     file_id = Column(String(255), ForeignKey("user_files.file_id"), nullable=False)
     chunk_index = Column(SmallInteger, nullable=False)  # Порядковый номер чанка
     content = Column(Text, nullable=False)  # Текст части документа
+    content_hash = Column(String(64), nullable=True)  # sha256 текста чанка, по нему сравниваются ревизии
     ai_response = Column(Text, nullable=True)  # Ответ YandexGPT по этой части
     processed = Column(Boolean, default=False)  # Чанк обработан AI
+    attempts = Column(SmallInteger, nullable=False, default=0, server_default="0")  # Неудачных попыток анализа
+    embedding = Column(LargeBinary, nullable=True)  # Нормированный вектор чанка, float16
+    term_freqs = Column(JSON, nullable=True)  # Частоты терминов чанка для BM25-поиска
+    prompt_hash = Column(String(64), nullable=True)  # Версия промта, с которой получен ai_response
+    simhash = Column(BigInteger, nullable=True)  # Сигнатура SimHash текста чанка
+    simhash_bands = Column(ARRAY(Integer), nullable=True)  # LSH-полосы сигнатуры для поиска похожих чанков
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user_file = relationship("UserFile", back_populates="chunks")
 
+    __table_args__ = (
+        # Чанки файла по порядку (get_file_chunks)
+        Index("ix_file_chunks_file_id_chunk_index", "file_id", "chunk_index"),
+        # Подсчёт прогресса анализа по файлу (get_files_progress)
+        Index("ix_file_chunks_file_id_processed", "file_id", "processed"),
+        # Поиск почти одинаковых чанков по совпадающим полосам сигнатуры
+        Index("ix_file_chunks_simhash_bands", "simhash_bands", postgresql_using="gin"),
+    )
+
 class FileSummary(Base):
     __tablename__ = "file_summaries"
     id = Column(Integer, primary_key=True, autoincrement=True)
     file_id = Column(String(255), ForeignKey("user_files.file_id"), unique=True, nullable=False)
     summary = Column(Text, nullable=True)  # Итоговое резюме по всему документу
+    prompt_hash = Column(String(64), nullable=True)  # Версия промта, с которой построен отчёт
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     user_file = relationship("UserFile", back_populates="summary")
+
+class FileContent(Base):
+    """
+    Общее хранилище содержимого файлов: по sha256 находится файл, чанки которого
+    можно скопировать вместо повторного разбора такого же документа.
+    """
+    __tablename__ = "file_contents"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    content_hash = Column(String(64), unique=True, nullable=False, index=True)  # sha256 содержимого файла
+    size_bytes = Column(BigInteger, nullable=False)
+    source_file_id = Column(String(255), ForeignKey("user_files.file_id"), nullable=False)  # Файл с эталонными чанками
+    chunks_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class CompletionCache(Base):
+    __tablename__ = "completion_cache"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache_key = Column(String(64), unique=True, nullable=False, index=True)  # sha256 полного запроса
+    model = Column(String(255), nullable=True)
+    response = Column(JSON, nullable=False)  # JSON-ответ Yandex GPT
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(BigInteger, ForeignKey("users.user_id"), nullable=False, index=True)
+    status = Column(String(32), nullable=False, default="pending", index=True)  # pending | running | done | failed
+    attempts = Column(SmallInteger, nullable=False, default=0)  # Сколько раз задача была взята воркером
+    worker_id = Column(String(255), nullable=True)  # Воркер, владеющий арендой
+    lease_until = Column(DateTime(timezone=True), nullable=True)  # До какого момента действует аренда
+    error = Column(Text, nullable=True)
+    prompt_hash = Column(String(64), nullable=True)  # Версия промта, с которой выполнялся анализ
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # Не больше одной активной задачи на пользователя (enqueue_analysis_job)
+        Index("ux_analysis_jobs_active_user", "user_id", unique=True,
+              postgresql_where=text("status IN ('pending', 'running')")),
+    )
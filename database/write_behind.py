@@ -0,0 +1,110 @@
+import asyncio
+import logging
+
+from config import CHUNK_WRITE_BATCH_SIZE, CHUNK_WRITE_FLUSH_MS
+from database.db_init import async_session
+from database.db_services import save_chunk_ai_responses
+
+logger = logging.getLogger(__name__)
+
+
+class ChunkResponseWriter:
+    """
+    Буфер отложенной записи ответов AI по чанкам.
+
+    Ответы копятся в памяти и записываются в БД пачкой (save_chunk_ai_responses),
+    как только набралось batch_size ответов или прошло flush_interval_ms миллисекунд
+    с момента появления первого ответа в буфере. Для каждого ответа возвращается future,
+    который завершается после коммита пачки — только тогда чанк можно считать обработанным.
+    """
+
+    def __init__(self, batch_size: int = CHUNK_WRITE_BATCH_SIZE, flush_interval_ms: int = CHUNK_WRITE_FLUSH_MS):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._items = []
+        self._has_items = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def submit(self, chunk_id: int, ai_response: str, prompt_hash: str = None) -> asyncio.Future:
+        """
+        Ставит ответ AI по чанку в очередь на запись.
+
+        Args:
+            chunk_id (int): id чанка.
+            ai_response (str): Ответ AI.
+            prompt_hash (str, optional): Версия промта, с которой получен ответ.
+
+        Returns:
+            asyncio.Future: Завершается после записи ответа в БД (или с ошибкой записи).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._items.append((chunk_id, (ai_response, prompt_hash), future))
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.create_task(self._run())
+        self._has_items.set()
+        if len(self._items) >= self.batch_size:
+            self._full.set()
+        return future
+
+    async def save(self, chunk_id: int, ai_response: str, prompt_hash: str = None):
+        """
+        Ставит ответ AI в очередь и ждёт, пока он будет записан в БД.
+        """
+        await self.submit(chunk_id, ai_response, prompt_hash)
+
+    async def _run(self):
+        while True:
+            await self._has_items.wait()
+            if not self._closing:
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._has_items.clear()
+            self._full.clear()
+            await self._flush()
+            if self._closing and not self._items:
+                return
+
+    async def _flush(self):
+        while self._items:
+            items, self._items = self._items[:self.batch_size], self._items[self.batch_size:]
+            # Повторный ответ по тому же чанку заменяет предыдущий
+            responses = {chunk_id: response for chunk_id, response, _ in items}
+            try:
+                async with async_session() as session:
+                    await save_chunk_ai_responses(responses, session=session)
+            except Exception as ex:
+                logger.error(f"Ошибка пакетной записи {len(responses)} ответов AI: {ex}")
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(ex)
+                continue
+            for _, _, future in items:
+                if not future.done():
+                    future.set_result(None)
+            logger.debug(f"Записано ответов AI пачкой: {len(responses)}")
+
+    async def close(self):
+        """
+        Записывает все накопленные ответы и останавливает фоновую запись.
+        """
+        if self._task is None:
+            return
+        self._closing = True
+        self._has_items.set()
+        await self._task
+        self._task = None
+
+
+chunk_response_writer = ChunkResponseWriter()
+
+
+async def close_chunk_response_writer():
+    """
+    Дописывает буфер ответов AI в БД. Вызывается при остановке бота и воркера.
+    """
+    await chunk_response_writer.close()
@@ -1,7 +1,209 @@
+import asyncio
+import json
+import logging
+import time
 import aiohttp
-from config import YANDEX_GPT_API_KEY, FOLDER_ID
+from config import (YANDEX_GPT_API_KEY, FOLDER_ID, YANDEX_GPT_POOL_LIMIT, YANDEX_GPT_POOL_LIMIT_PER_HOST,
+                    YANDEX_GPT_DNS_CACHE_TTL, YANDEX_GPT_KEEPALIVE_TIMEOUT, COMPLETION_CACHE_ENABLED,
+                    YANDEX_GPT_API_URL, YANDEX_GPT_ASYNC_API_URL, YANDEX_OPERATIONS_API_URL,
+                    DEFERRED_POLL_INTERVAL_SEC, DEFERRED_TIMEOUT_SEC, YANDEX_GPT_TOKENIZE_URL, YANDEX_GPT_MAX_RETRIES)
+from external_services.completion_cache import make_cache_key, get_cached_completion, store_completion
+from external_services.circuit_breaker import yandex_gpt_breaker
+from external_services.hedging import hedge_policy
+from external_services.llm_scheduler import llm_scheduler, LANE_BULK
+from external_services.model_routing import route_stats
+from external_services.rate_limiter import (yandex_gpt_limiter, estimate_request_tokens, usage_total_tokens,
+                                            backoff_delay, parse_retry_after)
+
+logger = logging.getLogger(__name__)
+
+_http_session: aiohttp.ClientSession | None = None
+_http_session_lock = asyncio.Lock()
+
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """
+    Возвращает общий долгоживущий HTTP-клиент для запросов к Yandex GPT.
+
+    Клиент создаётся лениво при первом обращении и переиспользует keep-alive соединения,
+    кэширует DNS и ограничивает число соединений (всего и на один хост), поэтому
+    TCP+TLS рукопожатие не повторяется для каждого чанка.
+
+    Returns:
+        aiohttp.ClientSession: Общая сессия aiohttp.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        return _http_session
+    async with _http_session_lock:
+        if _http_session is None or _http_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=YANDEX_GPT_POOL_LIMIT,
+                limit_per_host=YANDEX_GPT_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=YANDEX_GPT_DNS_CACHE_TTL,
+                keepalive_timeout=YANDEX_GPT_KEEPALIVE_TIMEOUT,
+            )
+            _http_session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=120),
+            )
+            logger.info("Создан пул HTTP-соединений к Yandex GPT")
+    return _http_session
+
+
+async def close_http_session():
+    """
+    Закрывает общий HTTP-клиент Yandex GPT. Вызывается при остановке бота.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+        logger.info("Пул HTTP-соединений к Yandex GPT закрыт")
+    _http_session = None
+
+
+def _build_headers() -> dict:
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
+        "x-folder-id": FOLDER_ID,
+    }
+
+
+def _build_payload(messages: list, model: str, temperature: float, max_tokens: int, stream: bool) -> dict:
+    return {
+        "modelUri": f"gpt://{FOLDER_ID}/{model}",
+        "completionOptions": {
+            "stream": stream,
+            "temperature": temperature,
+            "maxTokens": str(max_tokens),
+        },
+        "messages": messages,
+    }
+
+
+async def _post_with_retries(url: str, payload: dict, tokens: int, user_id: int = None, lane: str = LANE_BULK,
+                             max_retries: int = YANDEX_GPT_MAX_RETRIES) -> aiohttp.ClientResponse:
+    """
+    Отправляет POST-запрос к API Yandex GPT с учётом квот и повторами временных ошибок.
+
+    Перед каждой попыткой запрос ждёт своей очереди в планировщике (llm_scheduler), который
+    по кругу между пользователями допускает запросы к общим квотам (yandex_gpt_limiter).
+    Ответы 429 и 5xx, ошибки соединения и таймауты повторяются не больше max_retries раз
+    с экспоненциальной задержкой и джиттером; при 429 задержка не меньше Retry-After,
+    и на это время приостанавливаются все запросы процесса. Ошибки 5xx, соединения и таймауты
+    учитываются предохранителем (yandex_gpt_breaker), успешные ответы замыкают его.
+    Резерв токенов неудачной попытки возвращается в квоту.
+
+    Args:
+        url (str): Адрес метода API.
+        payload (dict): Тело запроса.
+        tokens (int): Резерв токенов в квоте (estimate_request_tokens).
+        user_id (int, optional): Пользователь, для которого выполняется запрос.
+        lane (str): Полоса планировщика: interactive или bulk.
+        max_retries (int): Максимальное число повторов.
+
+    Raises:
+        aiohttp.ClientResponseError: Ошибка API (в том числе после исчерпания повторов).
+
+    Returns:
+        aiohttp.ClientResponse: Успешный ответ; тело читает и освобождает вызывающий код.
+    """
+    session = await get_http_session()
+    for attempt in range(max_retries + 1):
+        await llm_scheduler.admit(tokens, user_id=user_id, lane=lane)
+        try:
+            response = await session.post(url, headers=_build_headers(), json=payload)
+        except asyncio.CancelledError:
+            # Запрос отменён (например, проигравший дубль _complete_hedged) — резерв не понадобится
+            yandex_gpt_limiter.settle(tokens, 0)
+            raise
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as ex:
+            yandex_gpt_limiter.settle(tokens, 0)
+            yandex_gpt_breaker.record_failure()
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt)
+            logger.warning(f"Ошибка соединения с Yandex GPT ({ex!r}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+            continue
+        if response.status < 400:
+            yandex_gpt_breaker.record_success()
+            return response
+        if response.status != 429 and response.status < 500:
+            # Ошибка запроса (400, 401, 403...) не повторяется и не говорит о состоянии API
+            yandex_gpt_limiter.settle(tokens, 0)
+            response.raise_for_status()
+        yandex_gpt_limiter.settle(tokens, 0)
+        if response.status >= 500:
+            yandex_gpt_breaker.record_failure()
+        if attempt == max_retries:
+            response.raise_for_status()
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        response.release()
+        delay = max(retry_after or 0.0, backoff_delay(attempt))
+        if response.status == 429:
+            yandex_gpt_limiter.pause(delay)
+        logger.warning(f"Yandex GPT ответил {response.status}, повтор через {delay:.1f} с")
+        await asyncio.sleep(delay)
+
+
+async def _complete(payload: dict, tokens: int, user_id: int, lane: str) -> dict:
+    # Резерв успешного ответа уточняет вызывающий код по usage; если тело не прочитано
+    # (отмена, обрыв соединения, некорректный JSON), резерв возвращается здесь
+    result = None
+    async with await _post_with_retries(YANDEX_GPT_API_URL, payload, tokens, user_id=user_id, lane=lane) as response:
+        try:
+            result = await response.json()
+        finally:
+            if result is None:
+                yandex_gpt_limiter.settle(tokens, 0)
+    return result
+
+
+async def _complete_hedged(payload: dict, tokens: int, model: str, user_id: int, lane: str) -> dict:
+    """
+    Выполняет запрос completion с дублированием: если ответ не пришёл за p95 задержек последних
+    запросов (hedge_policy), отправляется такой же второй запрос и берётся первый успешный ответ.
+    Дубль отправляется, только пока в планировщике нет очереди, — при нехватке квоты он лишь
+    отнял бы её у других запросов. Проигравший запрос отменяется, его соединение закрывается.
+    """
+    started = time.monotonic()
+    delay = hedge_policy.delay(model)
+    tasks = {asyncio.create_task(_complete(payload, tokens, user_id, lane))}
+    launched = set(tasks)
+    hedge = None
+    winner = None
+    error = None
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and not any(llm_scheduler.queued().values()) and hedge_policy.allow_hedge():
+                logger.info(f"Ответ Yandex GPT не получен за {delay:.1f} с, отправлен дублирующий запрос")
+                hedge = asyncio.create_task(_complete(payload, tokens, user_id, lane))
+                tasks.add(hedge)
+                launched.add(hedge)
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                    if task is hedge:
+                        hedge_policy.hedge_wins += 1
+                    hedge_policy.observe(model, time.monotonic() - started)
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Резерв победителя уточняет вызывающий код; проигравший, успевший получить ответ
+        # (в том же цикле событий или до своей отмены), тоже израсходовал токены
+        for task in launched:
+            if task is not winner and not task.cancelled() and task.exception() is None:
+                yandex_gpt_limiter.settle(tokens, usage_total_tokens(task.result().get("result", {})))
 
-YANDEX_GPT_API_URL = 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion'
 
 async def yandex_gpt_request(
     messages: list,
@@ -9,34 +211,305 @@ async def yandex_gpt_request(
     temperature: float = 0.6,
     max_tokens: int = 2000,
     stream: bool = False,
+    use_cache: bool = True,
+    user_id: int = None,
+    lane: str = LANE_BULK,
+    route: str = None,
 ) -> dict:
     """
-    Асинхронно отправляет запрос к YandexGPT и возвращает ответ
-    :param api_key: API-KEY сервисного аккаунта
-    :param folder_id: Идентификатор каталога (FOLDER_ID)
+    Асинхронно отправляет запрос к YandexGPT и возвращает ответ.
+    Запрос учитывается в квотах процесса, временные ошибки повторяются (см. _post_with_retries),
+    долгие ответы дублируются (см. _complete_hedged)
     :param messages: Список сообщений [{"role": "system"|"user"|"assistant", "text": ...}]
     :param model: Имя модели
     :param temperature: Температура сэмплирования (креативность)
     :param max_tokens: Макс. размер ответа
     :param stream: включить ли потоковый вывод (стрим)
+    :param use_cache: искать ли ответ в кэше и сохранять ли его туда (стрим не кэшируется)
+    :param user_id: пользователь, для которого выполняется запрос (очередь планировщика)
+    :param lane: полоса планировщика: interactive (ответ ждёт пользователь) или bulk
+    :param route: шаг обработки (model_routing), по которому ведётся статистика задержек и токенов
     :return: dict — весь JSON-ответ Yandex GPT
     """
     url = YANDEX_GPT_API_URL
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {YANDEX_GPT_API_KEY}",
-        "x-folder-id": FOLDER_ID,
-    }
-    payload = {
-        "modelUri": f"gpt://{FOLDER_ID}/{model}",
-        "completionOptions": {
-            "stream": stream,
-            "temperature": temperature,
-            "maxTokens": str(max_tokens),
-        },
-        "messages": messages,
-    }
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=120)) as session:
-        async with session.post(url, headers=headers, json=payload) as response:
-            response.raise_for_status()
-            return await response.json()
+    payload = _build_payload(messages, model, temperature, max_tokens, stream)
+    cache_key = None
+    if use_cache and not stream and COMPLETION_CACHE_ENABLED:
+        cache_key = make_cache_key(payload)
+        cached = await get_cached_completion(cache_key)
+        if cached is not None:
+            logger.debug(f"Ответ Yandex GPT взят из кэша ({cache_key[:12]})")
+            route_stats.observe_cached(route)
+            return cached
+
+    started = time.monotonic()
+    tokens = estimate_request_tokens(messages, max_tokens)
+    try:
+        if stream:
+            async with await _post_with_retries(url, payload, tokens, user_id=user_id, lane=lane) as response:
+                result = await response.json()
+        else:
+            result = await _complete_hedged(payload, tokens, model, user_id, lane)
+    except Exception:
+        route_stats.observe_error(route)
+        raise
+    used_tokens = usage_total_tokens(result.get("result", {}))
+    yandex_gpt_limiter.settle(tokens, used_tokens)
+    route_stats.observe(route, time.monotonic() - started, used_tokens)
+
+    if cache_key is not None:
+        await store_completion(cache_key, model, result)
+    return result
+
+
+async def yandex_gpt_stream(
+    messages: list,
+    model: str = "yandexgpt-lite",
+    temperature: float = 0.6,
+    max_tokens: int = 2000,
+    use_cache: bool = True,
+    user_id: int = None,
+    lane: str = LANE_BULK,
+    route: str = None,
+):
+    """
+    Отправляет запрос к YandexGPT в потоковом режиме и отдаёт ответ по частям.
+
+    API присылает по строке JSON на каждое обновление; текст альтернативы в каждой
+    части накопительный (содержит весь сгенерированный к этому моменту ответ).
+    Итоговый ответ сохраняется в кэш под тем же ключом, что и обычный запрос,
+    а при попадании в кэш сразу отдаётся готовая альтернатива.
+
+    Args:
+        messages (list): Список сообщений [{"role": ..., "text": ...}].
+        model (str): Имя модели.
+        temperature (float): Температура сэмплирования.
+        max_tokens (int): Макс. размер ответа.
+        use_cache (bool): Использовать ли кэш ответов.
+        user_id (int, optional): Пользователь, для которого выполняется запрос.
+        lane (str): Полоса планировщика: interactive или bulk.
+        route (str, optional): Шаг обработки (model_routing) для статистики.
+
+    Yields:
+        dict: Альтернатива {"message": {"role": ..., "text": ...}, "status": ...}.
+    """
+    cache_key = None
+    if use_cache and COMPLETION_CACHE_ENABLED:
+        cache_key = make_cache_key(_build_payload(messages, model, temperature, max_tokens, stream=False))
+        cached = await get_cached_completion(cache_key)
+        if cached is not None:
+            route_stats.observe_cached(route)
+            yield cached["result"]["alternatives"][0]
+            return
+
+    started = time.monotonic()
+    payload = _build_payload(messages, model, temperature, max_tokens, stream=True)
+    tokens = estimate_request_tokens(messages, max_tokens)
+    last_result = None
+    completed = False
+    # Неудачные попытки отправки возвращают резерв сами (_post_with_retries); после получения
+    # ответа резерв уточняется ровно один раз при любом исходе: успех, ошибка в потоке,
+    # отмена или остановка чтения потребителем
+    response = await _post_with_retries(YANDEX_GPT_API_URL, payload, tokens, user_id=user_id, lane=lane)
+    try:
+        async with response:
+            async for line in response.content:
+                line = line.strip()
+                if not line:
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(f"Ошибка потокового ответа Yandex GPT: {data['error']}")
+                last_result = data["result"]
+                yield last_result["alternatives"][0]
+        completed = True
+    except Exception:
+        route_stats.observe_error(route)
+        raise
+    finally:
+        used_tokens = usage_total_tokens(last_result) if last_result is not None else None
+        yandex_gpt_limiter.settle(tokens, used_tokens if completed or used_tokens is not None else 0)
+    if last_result is not None:
+        route_stats.observe(route, time.monotonic() - started, used_tokens)
+
+    if cache_key is not None and last_result is not None:
+        await store_completion(cache_key, model, {"result": last_result})
+
+
+async def yandex_gpt_tokenize(text: str, model: str = "yandexgpt-lite") -> int:
+    """
+    Считает количество токенов текста токенизатором модели Yandex GPT.
+
+    Args:
+        text (str): Текст.
+        model (str): Имя модели.
+
+    Returns:
+        int: Количество токенов.
+    """
+    payload = {"modelUri": f"gpt://{FOLDER_ID}/{model}", "text": text}
+    session = await get_http_session()
+    async with session.post(YANDEX_GPT_TOKENIZE_URL, headers=_build_headers(), json=payload) as response:
+        response.raise_for_status()
+        data = await response.json()
+    return len(data.get("tokens", []))
+
+
+async def yandex_gpt_submit_deferred(
+    messages: list,
+    model: str = "yandexgpt-lite",
+    temperature: float = 0.6,
+    max_tokens: int = 2000,
+    user_id: int = None,
+) -> str:
+    """
+    Отправляет запрос в отложенный (асинхронный) режим Yandex GPT (с учётом квот, см. _post_with_retries).
+
+    Ответ не ждёт генерации: API сразу возвращает операцию, результат которой
+    затем забирается через yandex_gpt_get_operation.
+
+    Args:
+        messages (list): Список сообщений [{"role": ..., "text": ...}].
+        model (str): Имя модели.
+        temperature (float): Температура сэмплирования.
+        max_tokens (int): Макс. размер ответа.
+        user_id (int, optional): Пользователь, для которого выполняется запрос.
+
+    Returns:
+        str: Идентификатор операции.
+    """
+    payload = _build_payload(messages, model, temperature, max_tokens, stream=False)
+    tokens = estimate_request_tokens(messages, max_tokens)
+    operation_id = None
+    async with await _post_with_retries(YANDEX_GPT_ASYNC_API_URL, payload, tokens, user_id=user_id) as response:
+        try:
+            operation_id = (await response.json())["id"]
+        finally:
+            # Резерв принятой операции уточняется при получении её результата (yandex_gpt_deferred_batch)
+            if operation_id is None:
+                yandex_gpt_limiter.settle(tokens, 0)
+    return operation_id
+
+
+async def yandex_gpt_get_operation(operation_id: str) -> dict:
+    """
+    Получает состояние операции отложенного запроса.
+
+    Args:
+        operation_id (str): Идентификатор операции.
+
+    Returns:
+        dict: JSON операции: done, а также response или error, если операция завершена.
+    """
+    session = await get_http_session()
+    url = f"{YANDEX_OPERATIONS_API_URL}/{operation_id}"
+    async with session.get(url, headers=_build_headers()) as response:
+        response.raise_for_status()
+        return await response.json()
+
+
+async def yandex_gpt_deferred_batch(
+    requests: list,
+    model: str = "yandexgpt-lite",
+    temperature: float = 0.6,
+    max_tokens: int | list = 2000,
+    concurrency: int = 16,
+    use_cache: bool = True,
+    user_id: int = None,
+    route: str = None,
+):
+    """
+    Отправляет пачку запросов в отложенном режиме и отдаёт результаты по мере готовности.
+
+    Ответы, найденные в кэше, отдаются сразу без обращения к API. Остальные запросы
+    отправляются все сразу (не более concurrency одновременных HTTP-вызовов),
+    после чего незавершённые операции опрашиваются раз в DEFERRED_POLL_INTERVAL_SEC секунд.
+    Результат приводится к формату синхронного ответа: {"result": {"alternatives": [...], ...}}.
+
+    Args:
+        requests (list[list]): Список наборов сообщений — по одному на запрос.
+        model (str): Имя модели.
+        temperature (float): Температура сэмплирования.
+        max_tokens (int | list[int]): Макс. размер ответа — общий или по значению на запрос.
+        concurrency (int): Максимальное число одновременных HTTP-вызовов при отправке и опросе.
+        use_cache (bool): Использовать ли кэш ответов.
+        user_id (int, optional): Пользователь, для которого выполняются запросы.
+        route (str, optional): Шаг обработки (model_routing) для статистики.
+
+    Yields:
+        tuple[int, dict | None, Exception | None]: Индекс запроса, ответ либо ошибка.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    cache_enabled = use_cache and COMPLETION_CACHE_ENABLED
+    cache_keys = {}
+    pending = {}
+    submitted_at = {}
+    limits = max_tokens if isinstance(max_tokens, list) else [max_tokens] * len(requests)
+
+    for idx, messages in enumerate(requests):
+        if cache_enabled:
+            cache_key = make_cache_key(_build_payload(messages, model, temperature, limits[idx], stream=False))
+            cached = await get_cached_completion(cache_key)
+            if cached is not None:
+                route_stats.observe_cached(route)
+                yield idx, cached, None
+                continue
+            cache_keys[idx] = cache_key
+
+    async def submit(idx: int):
+        async with semaphore:
+            try:
+                submitted_at[idx] = time.monotonic()
+                operation_id = await yandex_gpt_submit_deferred(
+                    requests[idx], model, temperature, limits[idx], user_id=user_id
+                )
+                return idx, operation_id, None
+            except Exception as ex:
+                return idx, None, ex
+
+    to_submit = [idx for idx in range(len(requests)) if not cache_enabled or idx in cache_keys]
+    for submitted in asyncio.as_completed([submit(idx) for idx in to_submit]):
+        idx, operation_id, error = await submitted
+        if error is not None:
+            logger.error(f"Ошибка отправки отложенного запроса в Yandex GPT: {error}")
+            route_stats.observe_error(route)
+            yield idx, None, error
+            continue
+        pending[operation_id] = idx
+    logger.info(f"Отправлено отложенных запросов в Yandex GPT: {len(pending)}")
+
+    async def poll(operation_id: str):
+        async with semaphore:
+            return operation_id, await yandex_gpt_get_operation(operation_id)
+
+    deadline = time.monotonic() + DEFERRED_TIMEOUT_SEC
+    while pending:
+        await asyncio.sleep(DEFERRED_POLL_INTERVAL_SEC)
+        for polled in asyncio.as_completed([poll(operation_id) for operation_id in list(pending)]):
+            try:
+                operation_id, operation = await polled
+            except Exception as ex:
+                logger.warning(f"Ошибка опроса операции Yandex GPT: {ex}")
+                continue
+            if not operation.get("done"):
+                continue
+            idx = pending.pop(operation_id)
+            if "error" in operation:
+                error = operation["error"]
+                yandex_gpt_limiter.settle(estimate_request_tokens(requests[idx], limits[idx]), 0)
+                route_stats.observe_error(route)
+                yield idx, None, RuntimeError(f"Операция {operation_id} завершилась ошибкой: {error.get('message', error)}")
+                continue
+            result = {"result": operation.get("response", {})}
+            used_tokens = usage_total_tokens(result["result"])
+            yandex_gpt_limiter.settle(estimate_request_tokens(requests[idx], limits[idx]), used_tokens)
+            route_stats.observe(route, time.monotonic() - submitted_at[idx], used_tokens)
+            if idx in cache_keys:
+                await store_completion(cache_keys[idx], model, result)
+            yield idx, result, None
+        if pending and time.monotonic() > deadline:
+            for operation_id, idx in pending.items():
+                yandex_gpt_limiter.settle(estimate_request_tokens(requests[idx], limits[idx]), 0)
+                route_stats.observe_error(route)
+                yield idx, None, TimeoutError(f"Операция {operation_id} не завершилась за {DEFERRED_TIMEOUT_SEC:.0f} с")
+            return
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import time
+
+from config import CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_COOLDOWN_SEC, CIRCUIT_MAX_COOLDOWN_SEC
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    API Yandex GPT признан недоступным, запрос не отправлялся.
+    """
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Yandex GPT временно недоступен, повторите через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Предохранитель запросов к Yandex GPT.
+
+    После failure_threshold ошибок подряд (5xx, таймауты, ошибки соединения) размыкается:
+    очередь запросов приостанавливается на cooldown секунд, затем пропускается один пробный
+    запрос. Успех замыкает цепь, ошибка снова размыкает её с удвоенной паузой (не больше max_cooldown).
+    """
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, cooldown: float = CIRCUIT_COOLDOWN_SEC,
+                 max_cooldown: float = CIRCUIT_MAX_COOLDOWN_SEC):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = STATE_CLOSED
+        self._cooldown = cooldown
+        self._failures = 0
+        self._opened_at = 0.0
+        self._result = None
+
+    def retry_in(self) -> float:
+        if self.state == STATE_CLOSED:
+            return 0.0
+        return max(0.0, self._opened_at + self._cooldown - time.monotonic())
+
+    def _notify(self):
+        if self._result is not None:
+            self._result.set()
+
+    def record_success(self):
+        if self.state != STATE_CLOSED:
+            logger.info("Yandex GPT снова отвечает, очередь запросов возобновлена")
+        self.state = STATE_CLOSED
+        self._failures = 0
+        self._cooldown = self.base_cooldown
+        self._notify()
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == STATE_HALF_OPEN:
+            self._cooldown = min(self._cooldown * 2, self.max_cooldown)
+        elif self.state == STATE_OPEN or self._failures < self.failure_threshold:
+            return
+        self.state = STATE_OPEN
+        self._opened_at = time.monotonic()
+        logger.warning(
+            f"Yandex GPT недоступен ({self._failures} ошибок подряд), запросы приостановлены на {self._cooldown:.0f} с"
+        )
+        self._notify()
+
+    async def wait_for_dispatch(self):
+        """
+        Ждёт, пока запрос можно отправить: цепь замкнута или настала очередь пробного запроса.
+        """
+        while self.state != STATE_CLOSED:
+            if self.state == STATE_OPEN:
+                remaining = self.retry_in()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
+                    continue
+                self.state = STATE_HALF_OPEN
+                logger.info("Пробный запрос к Yandex GPT после паузы")
+                return
+            # Пробный запрос уже отправлен — ждём его результата (или повторяем пробу, если он потерялся)
+            self._result = asyncio.Event()
+            try:
+                await asyncio.wait_for(self._result.wait(), timeout=self._cooldown)
+            except asyncio.TimeoutError:
+                return
+            finally:
+                self._result = None
+
+
+yandex_gpt_breaker = CircuitBreaker()
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+
+from config import COMPLETION_CACHE_TTL_HOURS, COMPLETION_CACHE_MAX_ENTRIES, COMPLETION_CACHE_EVICT_EVERY
+from database.db_init import async_session
+from database.models import CompletionCache
+
+logger = logging.getLogger(__name__)
+
+# Счётчики работы кэша за время жизни процесса
+cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evicted": 0}
+_stores_since_eviction = 0
+
+
+def make_cache_key(payload: dict) -> str:
+    """
+    Вычисляет ключ кэша как sha256 от полного тела запроса к Yandex GPT.
+
+    В ключ входят модель (modelUri), параметры генерации и все сообщения,
+    поэтому любое изменение промта, текста чанка, модели, temperature или maxTokens
+    даёт новый ключ.
+
+    Args:
+        payload (dict): Тело запроса к API completion.
+
+    Returns:
+        str: Hex-строка sha256.
+    """
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _expiration_border() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(hours=COMPLETION_CACHE_TTL_HOURS)
+
+
+async def get_cached_completion(cache_key: str) -> dict | None:
+    """
+    Ищет сохранённый ответ Yandex GPT по ключу запроса.
+
+    Устаревшие по TTL записи не возвращаются. При попадании увеличивает счётчик
+    обращений записи и обновляет время последнего использования.
+
+    Args:
+        cache_key (str): Ключ запроса (make_cache_key).
+
+    Returns:
+        dict | None: JSON-ответ Yandex GPT либо None, если в кэше ничего нет.
+    """
+    try:
+        async with async_session() as session:
+            result = await session.execute(
+                select(CompletionCache.response).where(
+                    (CompletionCache.cache_key == cache_key) &
+                    (CompletionCache.created_at > _expiration_border())
+                )
+            )
+            response = result.scalar_one_or_none()
+            if response is None:
+                cache_stats["misses"] += 1
+                return None
+            await session.execute(
+                update(CompletionCache)
+                .where(CompletionCache.cache_key == cache_key)
+                .values(hits=CompletionCache.hits + 1, last_used_at=func.now())
+            )
+            await session.commit()
+            cache_stats["hits"] += 1
+            return response
+    except Exception as ex:
+        logger.error("Error during reading completion cache: %s", str(ex))
+        cache_stats["misses"] += 1
+        return None
+
+
+async def store_completion(cache_key: str, model: str, response: dict):
+    """
+    Сохраняет ответ Yandex GPT в кэш. Периодически запускает вытеснение записей.
+
+    Args:
+        cache_key (str): Ключ запроса (make_cache_key).
+        model (str): Имя модели (для диагностики).
+        response (dict): JSON-ответ Yandex GPT.
+    """
+    global _stores_since_eviction
+    try:
+        async with async_session() as session:
+            stmt = insert(CompletionCache).values(
+                cache_key=cache_key, model=model, response=response, hits=0
+            ).on_conflict_do_update(
+                index_elements=[CompletionCache.cache_key],
+                set_={"response": response, "created_at": func.now(), "last_used_at": func.now()},
+            )
+            await session.execute(stmt)
+            await session.commit()
+        cache_stats["stores"] += 1
+        _stores_since_eviction += 1
+        if _stores_since_eviction >= COMPLETION_CACHE_EVICT_EVERY:
+            _stores_since_eviction = 0
+            await evict_completion_cache()
+    except Exception as ex:
+        logger.error("Error during saving completion to cache: %s", str(ex))
+
+
+async def evict_completion_cache() -> int:
+    """
+    Удаляет из кэша записи старше TTL, а затем самые давно использованные записи
+    сверх COMPLETION_CACHE_MAX_ENTRIES.
+
+    Returns:
+        int: Количество удалённых записей.
+    """
+    removed = 0
+    try:
+        async with async_session() as session:
+            result = await session.execute(
+                delete(CompletionCache).where(CompletionCache.created_at <= _expiration_border())
+            )
+            removed += result.rowcount or 0
+
+            total = (await session.execute(select(func.count(CompletionCache.id)))).scalar_one()
+            overflow = total - COMPLETION_CACHE_MAX_ENTRIES
+            if overflow > 0:
+                oldest = (
+                    select(CompletionCache.id)
+                    .order_by(CompletionCache.last_used_at)
+                    .limit(overflow)
+                    .scalar_subquery()
+                )
+                result = await session.execute(delete(CompletionCache).where(CompletionCache.id.in_(oldest)))
+                removed += result.rowcount or 0
+            await session.commit()
+        cache_stats["evicted"] += removed
+        logger.info(f"Кэш ответов AI: вытеснено {removed} записей")
+    except Exception as ex:
+        logger.error("Error during completion cache eviction: %s", str(ex))
+    return removed
@@ -0,0 +1,53 @@
+import logging
+from collections import deque
+
+from config import HEDGE_ENABLED, HEDGE_QUANTILE, HEDGE_MIN_DELAY_SEC, HEDGE_MIN_SAMPLES, HEDGE_MAX_RATIO
+
+logger = logging.getLogger(__name__)
+
+
+class HedgePolicy:
+    """
+    Решает, когда отправлять дублирующий запрос к Yandex GPT.
+
+    Хранит задержки последних window успешных запросов по каждой модели. Если ответ не пришёл
+    за квантиль quantile этих задержек (но не раньше min_delay), отправляется дубль и берётся
+    тот ответ, что придёт первым. Дубли ограничены долей max_ratio от всех запросов.
+    """
+
+    def __init__(self, enabled: bool = HEDGE_ENABLED, quantile: float = HEDGE_QUANTILE,
+                 min_delay: float = HEDGE_MIN_DELAY_SEC, min_samples: int = HEDGE_MIN_SAMPLES,
+                 max_ratio: float = HEDGE_MAX_RATIO, window: int = 200):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.max_ratio = max_ratio
+        self.window = window
+        self._latencies = {}
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def observe(self, model: str, latency: float):
+        self._latencies.setdefault(model, deque(maxlen=self.window)).append(latency)
+
+    def delay(self, model: str) -> float | None:
+        """
+        Возвращает задержку перед дублирующим запросом или None, если дублировать не нужно.
+        """
+        self.requests += 1
+        latencies = self._latencies.get(model)
+        if not self.enabled or latencies is None or len(latencies) < self.min_samples:
+            return None
+        ordered = sorted(latencies)
+        return max(self.min_delay, ordered[int(self.quantile * (len(ordered) - 1))])
+
+    def allow_hedge(self) -> bool:
+        if self.hedged >= self.max_ratio * self.requests:
+            return False
+        self.hedged += 1
+        return True
+
+
+hedge_policy = HedgePolicy()
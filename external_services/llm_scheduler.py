@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+
+from external_services.circuit_breaker import CircuitBreaker, CircuitOpenError, STATE_CLOSED, yandex_gpt_breaker
+from external_services.rate_limiter import RateLimiter, yandex_gpt_limiter
+
+logger = logging.getLogger(__name__)
+
+# Интерактивные запросы (ответы на вопросы) обслуживаются раньше фонового анализа документов
+LANE_INTERACTIVE = "interactive"
+LANE_BULK = "bulk"
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+
+class FairScheduler:
+    """
+    Планировщик запросов к Yandex GPT от всех пользователей процесса.
+
+    Запросы ждут допуска к квотам (RateLimiter) в очередях по пользователям. Очереди
+    обслуживаются по кругу — по одному запросу от каждого пользователя, — поэтому архив
+    на тысячи блоков не задерживает короткий документ другого пользователя дольше чем
+    на несколько запросов. Полоса interactive имеет строгий приоритет над bulk.
+
+    Пока предохранитель (CircuitBreaker) разомкнут, очередь не обслуживается: фоновые запросы
+    ждут восстановления API, а интерактивные сразу получают CircuitOpenError.
+    """
+
+    def __init__(self, limiter: RateLimiter, breaker: CircuitBreaker):
+        self.limiter = limiter
+        self.breaker = breaker
+        self._queues = {lane: OrderedDict() for lane in LANES}
+        self._wakeup = None
+        self._dispatcher = None
+        self._loop = None
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Новый цикл событий (перезапуск): очереди и задача прежнего цикла недействительны
+            self._queues = {lane: OrderedDict() for lane in LANES}
+            self._wakeup = asyncio.Event()
+            self._dispatcher = None
+            self._loop = loop
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _next_request(self):
+        for lane in LANES:
+            queues = self._queues[lane]
+            while queues:
+                user_id, queue = next(iter(queues.items()))
+                request = queue.popleft()
+                if queue:
+                    queues.move_to_end(user_id)
+                else:
+                    del queues[user_id]
+                if not request[0].done():
+                    return request
+        return None
+
+    async def _dispatch(self):
+        while True:
+            request = self._next_request()
+            if request is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            future, tokens, lane, enqueued_at = request
+            await self.breaker.wait_for_dispatch()
+            await self.limiter.acquire(tokens)
+            if future.done():
+                # Запрос отменён, пока ждал квоту, — возвращаем зарезервированные токены
+                self.limiter.settle(tokens, 0)
+                continue
+            future.set_result(time.monotonic() - enqueued_at)
+
+    async def admit(self, tokens: int = 0, user_id: int = None, lane: str = LANE_BULK):
+        """
+        Ждёт своей очереди и допуска к квотам Yandex GPT.
+
+        Args:
+            tokens (int): Резерв токенов запроса (estimate_request_tokens).
+            user_id (int, optional): Пользователь, для которого выполняется запрос.
+            lane (str): Полоса: interactive или bulk.
+
+        Raises:
+            CircuitOpenError: API недоступен, а запрос интерактивный.
+        """
+        if lane == LANE_INTERACTIVE and self.breaker.state != STATE_CLOSED:
+            raise CircuitOpenError(self.breaker.retry_in())
+        self._ensure_dispatcher()
+        future = self._loop.create_future()
+        self._queues[lane].setdefault(user_id, deque()).append((future, tokens, lane, time.monotonic()))
+        self._wakeup.set()
+        try:
+            waited = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Квота уже выдана, но запрос отменён до отправки — возвращаем резерв
+                self.limiter.settle(tokens, 0)
+            raise
+        if waited > 5:
+            logger.debug(f"Запрос пользователя {user_id} ({lane}) ждал очереди {waited:.1f} с")
+
+    def queued(self) -> dict:
+        """
+        Возвращает число ожидающих запросов по полосам.
+        """
+        return {lane: sum(len(queue) for queue in queues.values()) for lane, queues in self._queues.items()}
+
+
+llm_scheduler = FairScheduler(yandex_gpt_limiter, yandex_gpt_breaker)
@@ -0,0 +1,117 @@
+import logging
+import math
+from dataclasses import dataclass
+
+from config import (MODEL_MAP, MODEL_REDUCE, MODEL_FINAL, MODEL_QA,
+                    OUTPUT_RATIO_MAP, OUTPUT_RATIO_REDUCE, OUTPUT_RATIO_FINAL, OUTPUT_RATIO_QA,
+                    MAX_TOKENS_MAP, MAX_TOKENS_REDUCE, MAX_TOKENS_FINAL, MAX_TOKENS_QA,
+                    MIN_OUTPUT_TOKENS)
+from bot.services.text_processing import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Шаги обработки, для каждого из которых модель и размер ответа настраиваются отдельно
+ROUTE_MAP = "map"  # анализ одного блока документа
+ROUTE_REDUCE = "reduce"  # промежуточное резюме группы ответов
+ROUTE_FINAL = "final"  # итоговый отчёт по документу
+ROUTE_QA = "qa"  # ответ на вопрос по документам
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    name: str
+    model: str
+    temperature: float
+    output_ratio: float  # доля объёма входа, отводимая на ответ
+    max_tokens: int  # верхняя граница размера ответа
+
+    def size_max_tokens(self, messages: list) -> int:
+        """
+        Подбирает max_tokens по объёму входа: доля output_ratio от текста пользовательских
+        сообщений, но не меньше MIN_OUTPUT_TOKENS и не больше max_tokens маршрута.
+        Системный промт не учитывается — он одинаков для всех запросов шага.
+        Объём входа оценивается estimate_tokens, то есть с откалиброванным числом символов на токен.
+        """
+        tokens = sum(estimate_tokens(message.get("text", "")) for message in messages if message.get("role") != "system")
+        wanted = math.ceil(tokens * self.output_ratio)
+        return max(min(MIN_OUTPUT_TOKENS, self.max_tokens), min(wanted, self.max_tokens))
+
+
+ROUTES = {
+    ROUTE_MAP: ModelRoute(ROUTE_MAP, MODEL_MAP, 0.1, OUTPUT_RATIO_MAP, MAX_TOKENS_MAP),
+    ROUTE_REDUCE: ModelRoute(ROUTE_REDUCE, MODEL_REDUCE, 0.1, OUTPUT_RATIO_REDUCE, MAX_TOKENS_REDUCE),
+    ROUTE_FINAL: ModelRoute(ROUTE_FINAL, MODEL_FINAL, 0.1, OUTPUT_RATIO_FINAL, MAX_TOKENS_FINAL),
+    ROUTE_QA: ModelRoute(ROUTE_QA, MODEL_QA, 0.2, OUTPUT_RATIO_QA, MAX_TOKENS_QA),
+}
+
+
+def route_options(route: str, messages: list) -> dict:
+    """
+    Возвращает параметры запроса к Yandex GPT для шага route: model, temperature, max_tokens
+    и имя маршрута (для статистики) — их передают в yandex_gpt_request / yandex_gpt_stream.
+
+    Args:
+        route (str): Шаг обработки (ROUTE_MAP, ROUTE_REDUCE, ROUTE_FINAL, ROUTE_QA).
+        messages (list): Сообщения запроса.
+
+    Returns:
+        dict: Именованные аргументы запроса.
+    """
+    selected = ROUTES[route]
+    return {
+        "model": selected.model,
+        "temperature": selected.temperature,
+        "max_tokens": selected.size_max_tokens(messages),
+        "route": route,
+    }
+
+
+class RouteStats:
+    """
+    Статистика запросов к Yandex GPT по маршрутам: число запросов, ответов из кэша и ошибок,
+    суммарные задержка и расход токенов (usage.totalTokens). По ней подбираются модели
+    и размеры ответов шагов (MODEL_*, OUTPUT_RATIO_*, MAX_TOKENS_*).
+    """
+
+    def __init__(self):
+        self._stats = {}
+
+    def _route(self, route: str) -> dict:
+        return self._stats.setdefault(
+            route, {"requests": 0, "cached": 0, "errors": 0, "latency": 0.0, "tokens": 0}
+        )
+
+    def observe(self, route: str | None, latency: float, tokens: int | None):
+        if route is None:
+            return
+        stats = self._route(route)
+        stats["requests"] += 1
+        stats["latency"] += latency
+        stats["tokens"] += tokens or 0
+
+    def observe_cached(self, route: str | None):
+        if route is not None:
+            self._route(route)["cached"] += 1
+
+    def observe_error(self, route: str | None):
+        if route is not None:
+            self._route(route)["errors"] += 1
+
+    def snapshot(self) -> dict:
+        return {route: dict(stats) for route, stats in self._stats.items()}
+
+    def format(self) -> str:
+        parts = []
+        for route, stats in sorted(self._stats.items()):
+            requests = stats["requests"]
+            avg_latency = stats["latency"] / requests if requests else 0.0
+            avg_tokens = stats["tokens"] / requests if requests else 0.0
+            parts.append(
+                f"{route} ({ROUTES[route].model if route in ROUTES else '?'}): {requests} запросов, "
+                f"{stats['cached']} из кэша, {stats['errors']} ошибок, "
+                f"в среднем {avg_latency:.1f} с и {avg_tokens:.0f} токенов"
+            )
+        return "; ".join(parts)
+
+
+route_stats = RouteStats()
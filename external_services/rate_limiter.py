@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from config import YANDEX_GPT_RPS, YANDEX_GPT_TOKENS_PER_HOUR, YANDEX_GPT_BACKOFF_BASE_SEC, YANDEX_GPT_BACKOFF_MAX_SEC
+from bot.services.text_processing import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Ведро токенов: пополняется со скоростью rate единиц в секунду, вмещает не больше capacity.
+
+    Ожидающие обслуживаются по очереди (под общей блокировкой), поэтому большой запрос
+    не может бесконечно пропускать вперёд маленькие.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float):
+        # Запрос больше ёмкости ведра ждёт полного ведра и уводит его в минус
+        needed = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._level >= needed:
+                    self._level -= amount
+                    return
+                await asyncio.sleep((needed - self._level) / self.rate)
+
+    def refund(self, amount: float):
+        """
+        Возвращает в ведро неиспользованное (или списывает перерасходованное при amount < 0).
+        """
+        self._refill()
+        self._level = min(self.capacity, self._level + amount)
+
+
+class RateLimiter:
+    """
+    Общий для процесса ограничитель запросов к Yandex GPT по двум квотам:
+    запросов в секунду и токенов в час.
+
+    Перед запросом резервируется оценка токенов (вход + max_tokens), после ответа
+    резерв уточняется по фактическому расходу (usage.totalTokens). При ответе 429
+    все запросы процесса приостанавливаются на время из Retry-After.
+    """
+
+    def __init__(self, rps: float, tokens_per_hour: int):
+        # Запросы равномерно распределяются без всплесков: в любом окне в секунду их не больше rps
+        self.requests = TokenBucket(rps, 1.0) if rps > 0 else None
+        # Ёмкость — минутная доля часовой квоты, чтобы не выбрать её всплеском в начале часа
+        self.tokens = (
+            TokenBucket(tokens_per_hour / 3600, max(1.0, tokens_per_hour / 60)) if tokens_per_hour > 0 else None
+        )
+        self._paused_until = 0.0
+
+    def pause(self, seconds: float):
+        paused_until = time.monotonic() + seconds
+        if paused_until > self._paused_until:
+            self._paused_until = paused_until
+            logger.warning(f"Запросы к Yandex GPT приостановлены на {seconds:.1f} с")
+
+    async def acquire(self, tokens: int = 0):
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None and tokens:
+            await self.tokens.acquire(tokens)
+
+    def settle(self, reserved: int, used: int | None):
+        if self.tokens is not None and used is not None:
+            self.tokens.refund(reserved - used)
+
+
+yandex_gpt_limiter = RateLimiter(YANDEX_GPT_RPS, YANDEX_GPT_TOKENS_PER_HOUR)
+
+
+def estimate_request_tokens(messages: list, max_tokens: int) -> int:
+    """
+    Оценивает расход токенов запроса для резерва в квоте: вход по estimate_tokens
+    (с откалиброванным числом символов на токен) и весь max_tokens.
+    """
+    return sum(estimate_tokens(message.get("text", "")) for message in messages) + max_tokens
+
+
+def usage_total_tokens(result: dict) -> int | None:
+    try:
+        return int(result["usage"]["totalTokens"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = YANDEX_GPT_BACKOFF_BASE_SEC,
+                  cap: float = YANDEX_GPT_BACKOFF_MAX_SEC) -> float:
+    """
+    Задержка перед повтором с экспоненциальным ростом и полным джиттером:
+    случайная величина от 0 до min(cap, base * 2^attempt).
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбирает заголовок Retry-After: число секунд или HTTP-дата.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
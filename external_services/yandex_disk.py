@@ -1,3 +1,4 @@
+import io
 import logging
 import aiohttp
 import yadisk
@@ -203,3 +204,37 @@ async def download_prompt_from_yandex(local_prompt_path="prompt.txt", remote_pro
         except Exception as ex:
             logger.error(f"Не удалось скачать промт с Яндекс.Диска: {ex}")
             return False
+
+
+async def get_prompt_meta(remote_prompt_path="/prompt.txt") -> dict | None:
+    """
+    Получает метаданные файла промта на Яндекс.Диске без скачивания содержимого.
+
+    Args:
+        remote_prompt_path (str): Путь к промту на Яндекс.Диске.
+
+    Returns:
+        dict | None: {"md5": ..., "modified": ...} или None, если файл не найден.
+    """
+    try:
+        meta = await y.get_meta(remote_prompt_path, fields=["md5", "modified"])
+    except yadisk.exceptions.PathNotFoundError:
+        logger.error(f"Файл {remote_prompt_path} не найден на Яндекс.Диске.")
+        return None
+    return {"md5": meta.md5, "modified": meta.modified}
+
+
+async def read_prompt_from_yandex(remote_prompt_path="/prompt.txt") -> str:
+    """
+    Скачивает промт с Яндекс.Диска в память, не создавая локальных файлов.
+
+    Args:
+        remote_prompt_path (str): Путь к промту на Яндекс.Диске.
+
+    Returns:
+        str: Текст промта.
+    """
+    buffer = io.BytesIO()
+    await y.download(remote_prompt_path, buffer)
+    return buffer.getvalue().decode("utf-8")
+
@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+
+def _fake_result(payload: dict) -> dict:
+    user_text = next(
+        (m.get("text", "") for m in reversed(payload.get("messages", [])) if m.get("role") == "user"), ""
+    )
+    input_tokens = sum(len(m.get("text", "")) for m in payload.get("messages", [])) // 3
+    answer = f"Ответ заглушки: {user_text[:200]}"
+    return {
+        "alternatives": [
+            {"message": {"role": "assistant", "text": answer}, "status": "ALTERNATIVE_STATUS_FINAL"}
+        ],
+        "usage": {
+            "inputTextTokens": str(input_tokens),
+            "completionTokens": str(len(answer) // 3),
+            "totalTokens": str(input_tokens + len(answer) // 3),
+        },
+        "modelVersion": "stub",
+    }
+
+
+def create_app(delay: float = 1.0, rps: float = 0, slow_ratio: float = 0, fail_ratio: float = 0) -> web.Application:
+    """
+    Создаёт aiohttp-приложение заглушки.
+
+    Args:
+        delay (float): Через сколько секунд отложенная операция считается завершённой
+            (и сколько длится синхронный запрос).
+        rps (float): Квота запросов в секунду; сверх неё отвечает 429 с Retry-After (0 — без квоты).
+        slow_ratio (float): Доля синхронных запросов, которые отвечают в 10 раз дольше обычного.
+        fail_ratio (float): Доля запросов, на которые заглушка отвечает 503.
+
+    Returns:
+        web.Application: Приложение aiohttp.
+    """
+    operations = {}
+    recent_requests = []
+
+    def over_quota() -> web.Response | None:
+        if rps <= 0:
+            return None
+        now = time.monotonic()
+        recent_requests[:] = [moment for moment in recent_requests if now - moment < 1.0]
+        if len(recent_requests) >= rps:
+            return web.json_response(
+                {"code": 8, "message": "ai.textGenerationCompletionSessionsCount.count gauge quota limit exceed"},
+                status=429, headers={"Retry-After": "1"},
+            )
+        recent_requests.append(now)
+        return None
+
+    async def completion(request: web.Request):
+        if (rejected := over_quota()) is not None:
+            return rejected
+        if random.random() < fail_ratio:
+            return web.json_response({"code": 14, "message": "Service unavailable"}, status=503)
+        payload = await request.json()
+        if not payload.get("completionOptions", {}).get("stream"):
+            await asyncio.sleep(delay * 10 if random.random() < slow_ratio else delay)
+            return web.json_response({"result": _fake_result(payload)})
+
+        # Потоковый режим: по строке JSON на обновление, текст накопительный
+        result = _fake_result(payload)
+        full_text = result["alternatives"][0]["message"]["text"]
+        response = web.StreamResponse()
+        await response.prepare(request)
+        parts = 5
+        for part in range(1, parts + 1):
+            await asyncio.sleep(delay / parts)
+            alternative = {
+                "message": {"role": "assistant", "text": full_text[:len(full_text) * part // parts]},
+                "status": "ALTERNATIVE_STATUS_FINAL" if part == parts else "ALTERNATIVE_STATUS_PARTIAL",
+            }
+            chunk = {"result": {**result, "alternatives": [alternative]}}
+            await response.write(json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n")
+        await response.write_eof()
+        return response
+
+    async def completion_async(request: web.Request):
+        if (rejected := over_quota()) is not None:
+            return rejected
+        payload = await request.json()
+        operation_id = uuid.uuid4().hex
+        operations[operation_id] = (time.monotonic() + delay, payload)
+        return web.json_response({"id": operation_id, "description": "Async GPT Completion", "done": False})
+
+    async def get_operation(request: web.Request):
+        operation_id = request.match_info["operation_id"]
+        if operation_id not in operations:
+            return web.json_response({"code": 5, "message": "Operation not found"}, status=404)
+        ready_at, payload = operations[operation_id]
+        if time.monotonic() < ready_at:
+            return web.json_response({"id": operation_id, "done": False})
+        return web.json_response({"id": operation_id, "done": True, "response": _fake_result(payload)})
+
+    app = web.Application()
+    app.router.add_post("/foundationModels/v1/completion", completion)
+    app.router.add_post("/foundationModels/v1/completionAsync", completion_async)
+    app.router.add_get("/operations/{operation_id}", get_operation)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Заглушка API Yandex GPT")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--delay", type=float, default=1.0)
+    parser.add_argument("--rps", type=float, default=0)
+    parser.add_argument("--slow-ratio", type=float, default=0)
+    parser.add_argument("--fail-ratio", type=float, default=0)
+    args = parser.parse_args()
+    web.run_app(create_app(args.delay, args.rps, args.slow_ratio, args.fail_ratio), host=args.host, port=args.port)
@@ -2,6 +2,11 @@ import asyncio
 from bot.bot_init import init_bot
 from bot.bot_instance import bot, dp
 from database.db_init import init_db
+from external_services.ai_yandex_gpt import close_http_session
+from bot.services.analysis_worker import run_analysis_worker
+from bot.services.extraction_pool import shutdown_extraction_pool
+from database.write_behind import close_chunk_response_writer
+from config import ANALYSIS_WORKER_IN_PROCESS
 
 
 async def main():
@@ -11,11 +16,24 @@ async def main():
     Выполняет:
     1. Инициализацию базы данных (создание таблиц при необходимости).
     2. Инициализацию бота и регистрация обработчиков.
-    3. Запуск процесса опроса Telegram для получения обновлений.
+    3. Запуск воркера очереди анализа (если он не вынесен в отдельный процесс worker.py).
+    4. Запуск процесса опроса Telegram для получения обновлений.
+    5. Запись буфера ответов AI, закрытие общих HTTP-клиентов и пула извлечения текста при остановке.
     """
     await init_db()
     await init_bot(bot, dp)
-    await dp.start_polling(bot)
+    worker_task = None
+    if ANALYSIS_WORKER_IN_PROCESS:
+        worker_task = asyncio.create_task(run_analysis_worker())
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if worker_task is not None:
+            worker_task.cancel()
+            await asyncio.gather(worker_task, return_exceptions=True)
+        await close_chunk_response_writer()
+        await close_http_session()
+        shutdown_extraction_pool()
 
 if __name__ == "__main__":
     print("Start bot")
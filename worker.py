@@ -0,0 +1,29 @@
+import asyncio
+import logging
+from bot.bot_instance import bot
+from bot.services.analysis_worker import run_analysis_worker
+from database.db_init import init_db
+from database.write_behind import close_chunk_response_writer
+from external_services.ai_yandex_gpt import close_http_session
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def main():
+    """
+    Запуск отдельного процесса-воркера очереди анализа документов.
+
+    Позволяет масштабировать анализ независимо от процесса бота:
+    можно запустить несколько воркеров, они делят одну очередь в БД.
+    """
+    await init_db()
+    try:
+        await run_analysis_worker()
+    finally:
+        await close_chunk_response_writer()
+        await close_http_session()
+        await bot.session.close()
+
+if __name__ == "__main__":
+    print("Start analysis worker")
+    asyncio.run(main())